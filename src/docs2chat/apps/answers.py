@@ -0,0 +1,620 @@
+"""
+Purpose: Precomputed answers to recurring questions, persisted per index
+version and checked before running a chain.
+"""
+
+
+import argparse
+from dataclasses import dataclass, field
+import functools
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import re
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Iterable, Literal, Optional
+import unicodedata
+
+
+from docs2chat.apps.utils import (
+    ChainFactory,
+    DESERIALIZE_FUNC_FACTORY,
+    load_bool,
+    load_none_or_list,
+    load_none_or_str,
+    SERIALIZE_FUNC_FACTORY
+)
+from docs2chat.config import config
+from docs2chat.preprocessing import ShardedIndex
+from docs2chat.preprocessing.shards import CURRENT_FILE
+from docs2chat.preprocessing.utils import list_document_paths
+from docs2chat.profiling import profiler
+
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.INFO)
+_formatter = logging.Formatter(
+    "%(asctime)s:%(levelname)s:%(module)s: %(message)s"
+)
+_console_handler = logging.StreamHandler(sys.stdout)
+_console_handler.setFormatter(_formatter)
+_logger.addHandler(_console_handler)
+
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS answers (
+    version TEXT NOT NULL,
+    chain_type TEXT NOT NULL,
+    question TEXT NOT NULL,
+    normalized TEXT NOT NULL,
+    output TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (version, chain_type, question)
+)
+"""
+CREATE_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS answers_normalized
+ON answers (version, chain_type, normalized)
+"""
+EXACT_SQL = """
+SELECT output FROM answers
+WHERE version = ? AND chain_type = ? AND question = ?
+"""
+NORMALIZED_SQL = """
+SELECT output FROM answers
+WHERE version = ? AND chain_type = ? AND normalized = ?
+ORDER BY created DESC LIMIT 1
+"""
+
+
+def normalize_question(question: str) -> str:
+    """
+    Casefold and drop punctuation and extra whitespace, so trivially
+    different spellings of a question match.
+    """
+    question = unicodedata.normalize("NFKC", question).casefold()
+    return " ".join(re.findall(r"\w+", question))
+
+
+# {path: (size, mtime_ns, digest)} of the files hashed by `file_digest`.
+_file_digests = {}
+_file_digests_lock = threading.Lock()
+
+
+def file_digest(path: Path) -> str:
+    """
+    SHA-256 of a file's contents, reused until its size or modification
+    time changes.
+    """
+    stat = os.stat(path)
+    with _file_digests_lock:
+        cached = _file_digests.get(str(path))
+    if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(functools.partial(f.read, 2 ** 20), b""):
+            digest.update(block)
+    digest = digest.hexdigest()
+    with _file_digests_lock:
+        _file_digests[str(path)] = (stat.st_size, stat.st_mtime_ns, digest)
+    return digest
+
+
+def index_version(
+    chain_type: Literal["generative", "search", "snip"],
+    docs_dir: Optional[str] = None,
+    index: Optional[Any] = None,
+    num_return_docs: Optional[int] = None,
+    return_threshold: Optional[float] = None
+) -> str:
+    """
+    Fingerprint everything a chain's answers depend on.
+
+    That is the live version of each corpus of a ShardedIndex, or else the
+    path and a SHA-256 of the contents of every file in `docs_dir`, along
+    with the chain settings and the models and chunking in the config.
+    Hashing contents rather than modification times keeps answers valid
+    across copies and checkouts that only touch files. Each process
+    hashes a file once and again only after its size or mtime changes,
+    so recomputing the version after an index swap reads just the
+    changed files.
+    """
+    if isinstance(index, ShardedIndex):
+        documents = {
+            name: (index.index_dir / name / CURRENT_FILE).read_text().strip()
+            for name in sorted(index.shards)
+        }
+    else:
+        documents = []
+        for path in sorted(list_document_paths(docs_dir)):
+            try:
+                digest = file_digest(path)
+            except FileNotFoundError:
+                continue
+            documents.append([str(path.relative_to(docs_dir)), digest])
+    settings = {
+        "chain_type": chain_type,
+        "documents": documents,
+        "embedding_model": config.EMBEDDING_DIR,
+        "chunk_size_tokens": config.CHUNK_SIZE_TOKENS,
+        "chunk_overlap_tokens": config.CHUNK_OVERLAP_TOKENS,
+        "deduplicate": config.DEDUPLICATE and config.DEDUP_THRESHOLD
+    }
+    if chain_type == "generative":
+        settings["model"] = config.MODEL_PATH
+    else:
+        settings["num_return_docs"] = num_return_docs
+        settings["return_threshold"] = return_threshold
+        if chain_type == "snip":
+            settings["model"] = config.HS_READER_DIR
+    digest = hashlib.sha256(
+        json.dumps(settings, sort_keys=True, default=str).encode("utf-8")
+    )
+    return digest.hexdigest()[:16]
+
+
+class AnswerIndex:
+    """
+    Persisted chain outputs for known questions, in an SQLite file.
+
+    Outputs are stored serialized, per index version and chain type, under
+    the question as asked and its normalized form. Each thread, and each
+    forked server worker, opens its own connection; the database runs in
+    WAL mode so a build job can write while servers read.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        if path is None:
+            path = config.ANSWER_INDEX_PATH
+        self.path = str(path)
+        self._local = threading.local()
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        connection = self._connect()
+        with connection:
+            connection.execute(CREATE_TABLE_SQL)
+            connection.execute(CREATE_INDEX_SQL)
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection inherited across fork must not be used by the child.
+        if getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def put_many(
+        self,
+        version: str,
+        chain_type: str,
+        answers: Iterable[tuple[str, Any]]
+    ) -> int:
+        """
+        Store `(question, serialized output)` pairs, replacing old ones.
+        """
+        created = time.time()
+        rows = [
+            (
+                version,
+                chain_type,
+                question,
+                normalize_question(question),
+                json.dumps(output, default=str),
+                created
+            )
+            for question, output in answers
+        ]
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        return len(rows)
+
+    def lookup(
+        self,
+        version: str,
+        chain_type: str,
+        question: str
+    ) -> Optional[Any]:
+        """
+        Return the serialized output stored for `question`, matched
+        exactly and then normalized, or None.
+        """
+        connection = self._connect()
+        row = connection.execute(
+            EXACT_SQL, (version, chain_type, question)
+        ).fetchone()
+        if row is None:
+            normalized = normalize_question(question)
+            if normalized:
+                row = connection.execute(
+                    NORMALIZED_SQL, (version, chain_type, normalized)
+                ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def count(self, version: Optional[str] = None) -> int:
+        connection = self._connect()
+        if version is None:
+            return connection.execute(
+                "SELECT COUNT(*) FROM answers"
+            ).fetchone()[0]
+        return connection.execute(
+            "SELECT COUNT(*) FROM answers WHERE version = ?", (version,)
+        ).fetchone()[0]
+
+    def prune(self, keep_versions: list[str]) -> int:
+        """
+        Delete the answers of every version not in `keep_versions`.
+        """
+        placeholders = ", ".join("?" for _ in keep_versions)
+        connection = self._connect()
+        with connection:
+            cursor = connection.execute(
+                f"DELETE FROM answers WHERE version NOT IN ({placeholders})",
+                list(keep_versions)
+            )
+        return cursor.rowcount
+
+
+@dataclass
+class AnsweringChain:
+    """
+    Answer known questions from an AnswerIndex and others with `pipeline`.
+
+    A question is looked up among the answers stored for `version`. Those
+    with filters always run `pipeline`, as do follow-up questions in a
+    conversation, whose meaning depends on its history; a stored answer
+    to a first question is added to the history. After an index swap,
+    `update_retriever` recomputes `version` with `version_func`, so
+    answers built from the old documents stop matching.
+    """
+
+    pipeline: Any
+    chain_type: Literal["generative", "search", "snip"]
+    answer_index: AnswerIndex
+    version: Optional[str] = field(default=None)
+    version_func: Optional[Callable[[], str]] = field(default=None)
+
+    def __post_init__(self):
+        if self.version is None and self.version_func is not None:
+            setattr(self, "version", self.version_func())
+
+    @property
+    def chain(self):
+        # The wrapped conversation chain, if any, for callers that clear
+        # its memory between requests.
+        return getattr(self.pipeline, "chain", None)
+
+    def lookup(self, query: str, filters: Optional[dict] = None):
+        if filters is not None or self.version is None:
+            return None
+        memory = getattr(self.chain, "memory", None)
+        if memory is not None and memory.chat_memory.messages:
+            return None
+        with profiler.span("answers.lookup"):
+            payload = self.answer_index.lookup(
+                self.version, self.chain_type, query
+            )
+        profiler.count("answers.hits", int(payload is not None))
+        if payload is None:
+            return None
+        deserialize_func = DESERIALIZE_FUNC_FACTORY[self.chain_type]
+        output = deserialize_func(payload, query=query)
+        if memory is not None:
+            memory.save_context(
+                {"question": query}, {"answer": output["answer"]}
+            )
+        return output
+
+    def update_retriever(self, retriever: Any):
+        self.pipeline.update_retriever(retriever)
+        if self.version_func is not None:
+            self.version = self.version_func()
+
+    def __call__(self, query: str, filters: Optional[dict] = None):
+        return self.run(query=query, filters=filters)
+
+    def run(self, query: str, filters: Optional[dict] = None):
+        output = self.lookup(query, filters=filters)
+        if output is None:
+            output = self.pipeline(query, filters=filters)
+        return output
+
+    async def arun(self, query: str, filters: Optional[dict] = None):
+        output = self.lookup(query, filters=filters)
+        if output is None:
+            output = await self.pipeline.arun(query, filters=filters)
+        return output
+
+    async def astream(
+        self,
+        query: str,
+        filters: Optional[dict] = None
+    ) -> AsyncIterator[Any]:
+        output = self.lookup(query, filters=filters)
+        if output is None:
+            async for item in self.pipeline.astream(
+                query=query, filters=filters
+            ):
+                yield item
+            return
+        yield output["answer"]
+        yield output
+
+
+def resolve_answer_index(path: Optional[str] = None) -> Optional[str]:
+    """
+    Return the answer index the apps should check: `path` if given, else
+    ANSWER_INDEX_PATH once an index has been built there, else None.
+    """
+    if path is not None:
+        return path
+    path = config.ANSWER_INDEX_PATH
+    if path and Path(path).is_file():
+        return str(path)
+    return None
+
+
+def with_answer_index(
+    chain: Any,
+    chain_type: Literal["generative", "search", "snip"],
+    answer_index_path: Optional[str] = None,
+    docs_dir: Optional[str] = None,
+    index: Optional[Any] = None,
+    num_return_docs: Optional[int] = None,
+    return_threshold: Optional[float] = None
+) -> AnsweringChain:
+    """
+    Wrap a chain from ChainFactory to check an AnswerIndex first.
+    """
+    version_func = functools.partial(
+        index_version,
+        chain_type=chain_type,
+        docs_dir=docs_dir,
+        index=index,
+        num_return_docs=num_return_docs,
+        return_threshold=return_threshold
+    )
+    answering_chain = AnsweringChain(
+        pipeline=chain,
+        chain_type=chain_type,
+        answer_index=AnswerIndex(answer_index_path),
+        version_func=version_func
+    )
+    num_answers = answering_chain.answer_index.count(answering_chain.version)
+    _logger.info(
+        f"Found {num_answers} precomputed answers for index version "
+        f"{answering_chain.version}."
+    )
+    return answering_chain
+
+
+def load_questions(path: str) -> list[str]:
+    """
+    Read one question per line, dropping blanks and repeats.
+    """
+    with open(path, "r") as f:
+        questions = [line.strip() for line in f]
+    return list(dict.fromkeys(question for question in questions if question))
+
+
+def precompute_answers(
+    chain: Any,
+    chain_type: Literal["generative", "search", "snip"],
+    questions: list[str],
+    answer_index: AnswerIndex,
+    version: str,
+    batch_size: int = 32
+) -> int:
+    """
+    Answer `questions` with `chain` and store the outputs under `version`.
+
+    Extractive pipelines answer a batch at a time with `run_batch`; a
+    conversation chain answers each question with an empty history.
+    """
+    serialize_func = SERIALIZE_FUNC_FACTORY[chain_type]
+    memory = getattr(getattr(chain, "chain", None), "memory", None)
+    num_stored = 0
+    for start in range(0, len(questions), batch_size):
+        batch = questions[start:start + batch_size]
+        if hasattr(chain, "run_batch"):
+            outputs = chain.run_batch(batch)
+        else:
+            outputs = []
+            for question in batch:
+                if memory is not None:
+                    memory.clear()
+                outputs.append(chain(question))
+        num_stored += answer_index.put_many(
+            version,
+            chain_type,
+            [
+                (question, serialize_func(output))
+                for question, output in zip(batch, outputs)
+            ]
+        )
+        _logger.info(
+            f"Stored answers to {num_stored}/{len(questions)} questions."
+        )
+    if memory is not None:
+        memory.clear()
+    return num_stored
+
+
+def build_answers(
+    questions_path: str,
+    chain_type: Literal["generative", "search", "snip"] = "snip",
+    config_yaml: str = None,
+    docs_dir: str = None,
+    answer_index_path: str = None,
+    num_return_docs: int = 4,
+    return_threshold: float = 0,
+    corpora: Optional[list[str]] = None,
+    batch_size: int = 32,
+    prune: bool = False
+) -> str:
+    """
+    Precompute answers to a question list for the current index version.
+    """
+    if config_yaml is not None:
+        config.reset_config(config_yaml)
+    if docs_dir is None:
+        docs_dir = config.DOCUMENTS_DIR
+    questions = load_questions(questions_path)
+    index = None
+    if corpora is not None:
+        index = ShardedIndex(corpora=corpora)
+    chain, _ = ChainFactory(
+        chain_type=chain_type,
+        docs_dir=docs_dir,
+        config_obj=config,
+        num_return_docs=num_return_docs,
+        return_threshold=return_threshold,
+        index=index
+    )
+    version = index_version(
+        chain_type=chain_type,
+        docs_dir=docs_dir,
+        index=index,
+        num_return_docs=num_return_docs,
+        return_threshold=return_threshold
+    )
+    answer_index = AnswerIndex(answer_index_path)
+    _logger.info(
+        f"Answering {len(questions)} questions for index version {version}."
+    )
+    precompute_answers(
+        chain=chain,
+        chain_type=chain_type,
+        questions=questions,
+        answer_index=answer_index,
+        version=version,
+        batch_size=batch_size
+    )
+    if prune:
+        num_pruned = answer_index.prune(keep_versions=[version])
+        _logger.info(
+            f"Pruned {num_pruned} answers for other index versions."
+        )
+    if index is not None:
+        index.close()
+    return version
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Precompute answers to recurring questions."
+    )
+
+    parser.add_argument(
+        "--questions",
+        type=str,
+        help="Path to a file with one question per line.",
+        required=True
+    )
+
+    parser.add_argument(
+        "--config_yaml",
+        type=load_none_or_str,
+        help="Absolute path to yaml config file.",
+        default="None",
+        required=False
+    )
+
+    parser.add_argument(
+        "--docs_dir",
+        type=str,
+        help="Full path to directory containing documents.",
+        default=config.DOCUMENTS_DIR,
+        required=False
+    )
+
+    parser.add_argument(
+        "--chain_type",
+        type=str,
+        help=(
+            "What type of QA to perform. "
+            "One of `generative`, `search` or `snip`."),
+        default="snip",
+        required=False
+    )
+
+    parser.add_argument(
+        "--num_return_docs",
+        type=int,
+        help=(
+            "The number of documents to return "
+            "(if `chain_type` is `extractive`)."),
+        default=4,
+        required=False
+    )
+
+    parser.add_argument(
+        "--return_threshold",
+        type=float,
+        help=(
+            "The confidence threshold in [0,1] to use as a cutoff "
+            "(if `chain_type` is `extractive`.)"),
+        default=0,
+        required=False
+    )
+
+    parser.add_argument(
+        "--corpora",
+        type=load_none_or_list,
+        help=(
+            "Comma-separated names of prebuilt corpora in INDEX_DIR to "
+            "search instead of `docs_dir`."),
+        default="None",
+        required=False
+    )
+
+    parser.add_argument(
+        "--answer_index",
+        type=load_none_or_str,
+        help="Path of the answer index. Defaults to ANSWER_INDEX_PATH.",
+        default="None",
+        required=False
+    )
+
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        help="Number of questions answered at a time.",
+        default=32,
+        required=False
+    )
+
+    parser.add_argument(
+        "--prune",
+        type=load_bool,
+        help="Whether or not to delete answers for other index versions.",
+        default=False,
+        required=False
+    )
+
+    args = parser.parse_args()
+
+    build_answers(
+        questions_path=args.questions,
+        chain_type=args.chain_type,
+        config_yaml=args.config_yaml,
+        docs_dir=args.docs_dir,
+        answer_index_path=args.answer_index,
+        num_return_docs=args.num_return_docs,
+        return_threshold=args.return_threshold,
+        corpora=args.corpora,
+        batch_size=args.batch_size,
+        prune=args.prune
+    )
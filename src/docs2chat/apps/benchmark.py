@@ -0,0 +1,495 @@
+"""
+Purpose: Offline per-stage benchmark suite for docs2chat.
+"""
+
+
+import argparse
+import json
+from langchain.document_loaders import TextLoader
+import logging
+import os
+from pathlib import Path
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Optional
+
+
+from docs2chat.apps.stubs import (
+    EMBEDDING_DIM,
+    StubEmbeddingRetriever,
+    StubEmbeddings,
+    StubLLM,
+    StubRanker,
+    StubReader,
+    StubTokenizer
+)
+from docs2chat.chat import get_conversation_chain
+from docs2chat.config import config
+from docs2chat.extract import SearchExtractivePipeline, SnipExtractivePipeline
+from docs2chat.preprocessing.dedup import MinHashDeduplicator
+from docs2chat.preprocessing.preprocessing import (
+    ExtractivePreProcessor,
+    GenerativePreProcessor
+)
+from docs2chat.preprocessing.text_splitter import TokenTextSplitter
+from docs2chat.preprocessing.utils import (
+    create_vectorstore,
+    langchain_to_haystack_docs,
+    load_and_split_from_dir
+)
+
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.INFO)
+_formatter = logging.Formatter(
+    "%(asctime)s:%(levelname)s:%(module)s: %(message)s"
+)
+_console_handler = logging.StreamHandler(sys.stdout)
+_console_handler.setFormatter(_formatter)
+_logger.addHandler(_console_handler)
+
+
+BOILERPLATE = (
+    "This document is confidential and intended solely for the use of the "
+    "individual to whom it is addressed. If you have received it in error "
+    "please notify the sender and delete it from your system."
+)
+
+
+def _make_vocabulary(generator: random.Random, size: int = 5000) -> list[str]:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return [
+        "".join(generator.choice(letters) for _ in range(generator.randint(2, 10)))
+        for _ in range(size)
+    ]
+
+
+def _make_sentence(generator: random.Random, vocabulary: list[str]) -> str:
+    words = generator.choices(vocabulary, k=generator.randint(5, 20))
+    return " ".join(words).capitalize() + "."
+
+
+def generate_corpus(
+    docs_dir: str,
+    num_docs: int = 200,
+    words_per_doc: int = 500,
+    duplicate_fraction: float = 0.1,
+    seed: int = 0
+) -> list[str]:
+    """
+    Write a synthetic corpus of text files and return its sentences.
+    """
+    generator = random.Random(seed)
+    vocabulary = _make_vocabulary(generator)
+    sentences = []
+    for doc_idx in range(num_docs):
+        paragraphs = []
+        num_words = 0
+        while num_words < words_per_doc:
+            paragraph = [
+                _make_sentence(generator, vocabulary)
+                for _ in range(generator.randint(2, 6))
+            ]
+            sentences.extend(paragraph)
+            num_words += sum(len(sentence.split()) for sentence in paragraph)
+            paragraphs.append(" ".join(paragraph))
+        if generator.random() < duplicate_fraction:
+            paragraphs.append(BOILERPLATE)
+        path = Path(docs_dir) / f"doc_{doc_idx:05d}.txt"
+        path.write_text("\n\n".join(paragraphs))
+    return sentences
+
+
+def generate_queries(
+    sentences: list[str],
+    num_queries: int = 50,
+    seed: int = 0
+) -> list[str]:
+    """
+    Sample questions from words of corpus sentences.
+    """
+    generator = random.Random(seed)
+    queries = []
+    for sentence in generator.sample(sentences, k=min(num_queries, len(sentences))):
+        words = sentence.rstrip(".").split()
+        start = generator.randint(0, max(len(words) - 4, 0))
+        queries.append("What is " + " ".join(words[start:start + 6]) + "?")
+    return queries
+
+
+def _time_stage(
+    func: Callable,
+    repeat: int,
+    num_items: Optional[int] = None,
+    setup: Optional[Callable] = None
+) -> tuple[Any, dict]:
+    durations = []
+    result = None
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        result = func(*args)
+        durations.append(time.perf_counter() - start)
+    median_seconds = statistics.median(durations)
+    stats = {
+        "median_seconds": median_seconds,
+        "min_seconds": min(durations),
+        "max_seconds": max(durations),
+        "repeat": repeat
+    }
+    if num_items is not None:
+        stats["items"] = num_items
+        stats["items_per_second"] = num_items / max(median_seconds, 1e-12)
+    return result, stats
+
+
+def run_benchmarks(
+    num_docs: int = 200,
+    words_per_doc: int = 500,
+    num_queries: int = 50,
+    num_return_docs: int = 4,
+    duplicate_fraction: float = 0.1,
+    repeat: int = 3,
+    seed: int = 0
+) -> dict:
+    """
+    Time every pipeline stage on a synthetic corpus using stub models.
+    """
+    stages = {}
+    with tempfile.TemporaryDirectory() as docs_dir:
+        _logger.info(
+            f"Generating synthetic corpus of {num_docs} documents."
+        )
+        sentences = generate_corpus(
+            docs_dir=docs_dir,
+            num_docs=num_docs,
+            words_per_doc=words_per_doc,
+            duplicate_fraction=duplicate_fraction,
+            seed=seed
+        )
+        queries = generate_queries(sentences, num_queries=num_queries, seed=seed)
+        text_splitter = TokenTextSplitter(
+            tokenizer=StubTokenizer(),
+            max_seq_length=StubTokenizer.model_max_length
+        )
+        embeddings = StubEmbeddings()
+
+        docs, stages["load_and_split"] = _time_stage(
+            lambda: load_and_split_from_dir(
+                content=docs_dir,
+                text_splitter=text_splitter,
+                show_progress=False,
+                loader_cls=TextLoader
+            ),
+            repeat=repeat,
+            num_items=num_docs
+        )
+        text_splitter.reset_stats()
+
+        deduplicator = MinHashDeduplicator()
+
+        def _reset_deduplicator():
+            deduplicator.reset_stats()
+            return ()
+
+        _, stages["deduplicate"] = _time_stage(
+            lambda: deduplicator.deduplicate(docs),
+            repeat=repeat,
+            num_items=len(docs),
+            setup=_reset_deduplicator
+        )
+
+        _, stages["create_vectorstore"] = _time_stage(
+            lambda: create_vectorstore(docs=docs, embeddings=embeddings),
+            repeat=repeat,
+            num_items=len(docs)
+        )
+
+        hs_docs = langchain_to_haystack_docs(docs)
+
+        def _new_document_store():
+            document_store_cls = ExtractivePreProcessor.DOCUMENT_STORE_FACTORY[
+                config.DOCUMENT_STORE
+            ]
+            return (document_store_cls(
+                embedding_dim=EMBEDDING_DIM,
+                progress_bar=False
+            ),)
+
+        _, stages["write_documents"] = _time_stage(
+            lambda document_store: document_store.write_documents(hs_docs),
+            repeat=repeat,
+            num_items=len(hs_docs),
+            setup=_new_document_store
+        )
+
+        def _new_filled_document_store():
+            (document_store,) = _new_document_store()
+            document_store.write_documents(hs_docs)
+            return (document_store,)
+
+        retriever = StubEmbeddingRetriever()
+        document_store, stages["update_embeddings"] = _time_stage(
+            lambda document_store: (
+                document_store.update_embeddings(retriever) or document_store
+            ),
+            repeat=repeat,
+            num_items=len(hs_docs),
+            setup=_new_filled_document_store
+        )
+        retriever.document_store = document_store
+
+        top_k = min(100, int(1.5 * num_return_docs))
+        candidates, stages["retrieval"] = _time_stage(
+            lambda: [
+                retriever.retrieve(query=query, top_k=top_k)
+                for query in queries
+            ],
+            repeat=repeat,
+            num_items=len(queries)
+        )
+
+        ranker = StubRanker()
+        _, stages["ranking"] = _time_stage(
+            lambda: [
+                ranker.predict(query=query, documents=docs, top_k=num_return_docs)
+                for query, docs in zip(queries, candidates)
+            ],
+            repeat=repeat,
+            num_items=len(queries)
+        )
+
+        reader = StubReader()
+        _, stages["reading"] = _time_stage(
+            lambda: [
+                reader.predict(query=query, documents=docs, top_k=num_return_docs)
+                for query, docs in zip(queries, candidates)
+            ],
+            repeat=repeat,
+            num_items=len(queries)
+        )
+
+        preprocessor = ExtractivePreProcessor(
+            content=docs_dir,
+            embeddings=embeddings,
+            text_splitter=text_splitter
+        )
+        preprocessor.vectorstore = document_store
+        search_pipeline = SearchExtractivePipeline(
+            preprocessor=preprocessor,
+            num_return_docs=num_return_docs,
+            ranker=ranker,
+            retriever=retriever
+        )
+        _, stages["search_pipeline"] = _time_stage(
+            lambda: [search_pipeline.run(query=query) for query in queries],
+            repeat=repeat,
+            num_items=len(queries)
+        )
+        snip_pipeline = SnipExtractivePipeline(
+            preprocessor=preprocessor,
+            num_return_docs=num_return_docs,
+            reader=reader,
+            retriever=retriever
+        )
+        _, stages["snip_pipeline"] = _time_stage(
+            lambda: [snip_pipeline.run(query=query) for query in queries],
+            repeat=repeat,
+            num_items=len(queries)
+        )
+
+        chain = get_conversation_chain(
+            docs_dir=docs_dir,
+            preprocessor=GenerativePreProcessor(
+                content=[
+                    path.read_text() for path in sorted(Path(docs_dir).iterdir())
+                ],
+                embeddings=embeddings,
+                load_from_type="text",
+                text_splitter=text_splitter
+            ),
+            llm=StubLLM()
+        )
+
+        def _clear_memory():
+            chain.memory.clear()
+            return ()
+
+        _, stages["generation"] = _time_stage(
+            lambda: [chain(question) for question in queries],
+            repeat=repeat,
+            num_items=len(queries),
+            setup=_clear_memory
+        )
+
+    return {
+        "meta": {
+            "num_docs": num_docs,
+            "words_per_doc": words_per_doc,
+            "num_queries": num_queries,
+            "num_return_docs": num_return_docs,
+            "duplicate_fraction": duplicate_fraction,
+            "repeat": repeat,
+            "seed": seed,
+            "num_chunks": len(docs),
+            "document_store": config.DOCUMENT_STORE,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "stages": stages
+    }
+
+
+def compare_to_baseline(
+    results: dict,
+    baseline: dict,
+    threshold: float = 0.2,
+    stage_thresholds: Optional[dict[str, float]] = None,
+    min_delta: float = 0.001
+) -> list[dict]:
+    """
+    Return the stages whose median time regressed past their threshold.
+
+    A stage regresses when its median is more than `threshold` (relative)
+    and more than `min_delta` seconds (absolute) slower than the baseline.
+    """
+    stage_thresholds = stage_thresholds or {}
+    regressions = []
+    for stage, stats in results["stages"].items():
+        baseline_stats = baseline.get("stages", {}).get(stage)
+        if baseline_stats is None:
+            continue
+        limit = stage_thresholds.get(stage, threshold)
+        current = stats["median_seconds"]
+        previous = baseline_stats["median_seconds"]
+        if current > previous * (1 + limit) and current - previous > min_delta:
+            regressions.append({
+                "stage": stage,
+                "baseline_seconds": previous,
+                "current_seconds": current,
+                "ratio": current / max(previous, 1e-12),
+                "threshold": limit
+            })
+    return regressions
+
+
+def format_results(results: dict, baseline: Optional[dict] = None) -> str:
+    lines = [f"{'stage':<20}{'median (s)':>12}{'items/s':>12}{'vs base':>10}"]
+    for stage, stats in results["stages"].items():
+        change = ""
+        if baseline is not None and stage in baseline.get("stages", {}):
+            previous = baseline["stages"][stage]["median_seconds"]
+            change = f"{stats['median_seconds'] / max(previous, 1e-12):.2f}x"
+        lines.append(
+            f"{stage:<20}{stats['median_seconds']:>12.4f}"
+            f"{stats.get('items_per_second', 0):>12.1f}{change:>10}"
+        )
+    return "\n".join(lines)
+
+
+def _parse_stage_threshold(value: str) -> tuple[str, float]:
+    stage, _, threshold = value.partition("=")
+    return stage, float(threshold)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark docs2chat pipeline stages with stub models."
+    )
+    parser.add_argument("--num_docs", type=int, default=200, required=False)
+    parser.add_argument("--words_per_doc", type=int, default=500, required=False)
+    parser.add_argument("--num_queries", type=int, default=50, required=False)
+    parser.add_argument("--num_return_docs", type=int, default=4, required=False)
+    parser.add_argument(
+        "--duplicate_fraction",
+        type=float,
+        help="Fraction of documents that get a shared boilerplate paragraph.",
+        default=0.1,
+        required=False
+    )
+    parser.add_argument("--repeat", type=int, default=3, required=False)
+    parser.add_argument("--seed", type=int, default=0, required=False)
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Path to write the JSON results to.",
+        default="benchmark_results.json",
+        required=False
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        help="Path to a JSON results file to compare against.",
+        default=None,
+        required=False
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        help="Allowed relative slowdown per stage before failing.",
+        default=0.2,
+        required=False
+    )
+    parser.add_argument(
+        "--stage_threshold",
+        type=_parse_stage_threshold,
+        help="Per-stage override of `--threshold`, as `stage=value`.",
+        action="append",
+        default=[],
+        required=False
+    )
+    parser.add_argument(
+        "--min_delta",
+        type=float,
+        help="Absolute slowdown in seconds ignored as noise.",
+        default=0.001,
+        required=False
+    )
+
+    args = parser.parse_args()
+
+    results = run_benchmarks(
+        num_docs=args.num_docs,
+        words_per_doc=args.words_per_doc,
+        num_queries=args.num_queries,
+        num_return_docs=args.num_return_docs,
+        duplicate_fraction=args.duplicate_fraction,
+        repeat=args.repeat,
+        seed=args.seed
+    )
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    print(format_results(results, baseline=baseline))
+    if baseline is None:
+        return
+    regressions = compare_to_baseline(
+        results=results,
+        baseline=baseline,
+        threshold=args.threshold,
+        stage_thresholds=dict(args.stage_threshold),
+        min_delta=args.min_delta
+    )
+    for regression in regressions:
+        print(
+            f"REGRESSION: {regression['stage']} took "
+            f"{regression['current_seconds']:.4f}s vs "
+            f"{regression['baseline_seconds']:.4f}s "
+            f"({regression['ratio']:.2f}x, threshold "
+            f"{1 + regression['threshold']:.2f}x)"
+        )
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Purpose: Build or rebuild named corpora for a sharded docs2chat index.
+"""
+
+
+import argparse
+import logging
+import sys
+
+
+from docs2chat.apps.utils import load_none_or_str
+from docs2chat.config import config
+from docs2chat.preprocessing import ShardedIndex
+
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.INFO)
+_formatter = logging.Formatter(
+    "%(asctime)s:%(levelname)s:%(module)s: %(message)s"
+)
+_console_handler = logging.StreamHandler(sys.stdout)
+_console_handler.setFormatter(_formatter)
+_logger.addHandler(_console_handler)
+
+
+def build_corpora(
+    corpora: dict[str, str],
+    config_yaml: str = None,
+    index_dir: str = None
+):
+    """
+    Build each `name: docs_dir` corpus, leaving the others untouched.
+    """
+    if config_yaml is not None:
+        config.reset_config(config_yaml)
+    if index_dir is None:
+        index_dir = config.INDEX_DIR
+    index = ShardedIndex(index_dir=index_dir, corpora=[])
+    for name, docs_dir in corpora.items():
+        index.build_corpus(name=name, content=docs_dir)
+        _logger.info(
+            f"Corpus `{name}` built from {docs_dir}."
+        )
+    index.close()
+
+
+def _parse_corpus(value):
+    name, sep, docs_dir = value.partition("=")
+    if not sep or not name or not docs_dir:
+        raise argparse.ArgumentTypeError(
+            "Corpora must be given as `name=docs_dir`."
+        )
+    return name, docs_dir
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Build corpora for a sharded docs2chat index."
+    )
+
+    parser.add_argument(
+        "--corpus",
+        type=_parse_corpus,
+        action="append",
+        help=(
+            "A corpus to build, as `name=docs_dir`. "
+            "May be given more than once."),
+        required=True
+    )
+
+    parser.add_argument(
+        "--config_yaml",
+        type=load_none_or_str,
+        help="Absolute path to yaml config file.",
+        default="None",
+        required=False
+    )
+
+    parser.add_argument(
+        "--index_dir",
+        type=load_none_or_str,
+        help="Directory holding the corpora. Defaults to INDEX_DIR.",
+        default="None",
+        required=False
+    )
+
+    args = parser.parse_args()
+
+    build_corpora(
+        corpora=dict(args.corpus),
+        config_yaml=args.config_yaml,
+        index_dir=args.index_dir
+    )
@@ -8,12 +8,27 @@ import logging
 import os
 import readline
 import sys
-from typing import Literal
+from typing import Literal, Optional
 
 
-from docs2chat.apps.utils import ChainFactory, load_bool, load_none_or_str
+from docs2chat.apps.answers import (
+    resolve_answer_index,
+    with_answer_index
+)
+from docs2chat.apps.utils import (
+    ChainFactory,
+    load_bool,
+    load_none_or_float,
+    load_none_or_json,
+    load_none_or_list,
+    load_none_or_str,
+    update_chain_index
+)
+from docs2chat.concurrency import Deadline, use_deadline
 from docs2chat.config import config
 from docs2chat.chat import get_conversation_chain
+from docs2chat.preprocessing import IndexWatcher, ShardedIndex
+from docs2chat.profiling import profiler
 
 
 _logger = logging.getLogger(__name__)
@@ -44,30 +59,76 @@ def run_cli_application(
     config_yaml: str = None,
     docs_dir: str = None,
     num_return_docs: int = None,
-    return_threshold: float = None
+    return_threshold: float = None,
+    profile: bool = False,
+    corpora: Optional[list[str]] = None,
+    filters: Optional[dict] = None,
+    watch: bool = False,
+    answer_index: Optional[str] = None,
+    deadline_ms: Optional[float] = None
 ):
     if docs_dir is None:
         docs_dir = config.DOCUMENTS_DIR
     if config_yaml is not None:
         config.reset_config(config_yaml)
+    if deadline_ms is None:
+        deadline_ms = config.DEADLINE_MS
+    answer_index = resolve_answer_index(answer_index)
+    if profile:
+        profiler.enable(track_memory=True)
 
     print(BANNER, COLOR_RESET)
     
-    chain, format_func = ChainFactory(
-        chain_type=chain_type,
-        docs_dir=docs_dir,
-        config_obj=config,
-        num_return_docs=num_return_docs,
-        return_threshold=return_threshold
-    )
+    with profiler.trace("index") as index_profile:
+        index = None
+        watcher = None
+        if corpora is not None:
+            index = ShardedIndex(corpora=corpora)
+        elif watch:
+            watcher = IndexWatcher(content=docs_dir)
+            index = watcher.index
+        chain, format_func = ChainFactory(
+            chain_type=chain_type,
+            docs_dir=docs_dir,
+            config_obj=config,
+            num_return_docs=num_return_docs,
+            return_threshold=return_threshold,
+            index=index
+        )
+        if answer_index is not None:
+            chain = with_answer_index(
+                chain=chain,
+                chain_type=chain_type,
+                answer_index_path=answer_index,
+                docs_dir=docs_dir,
+                index=index,
+                num_return_docs=num_return_docs,
+                return_threshold=return_threshold
+            )
+    if watcher is not None:
+        watcher.add_hook(lambda index: update_chain_index(chain, index))
+        watcher.start()
+    if index_profile is not None:
+        print(f"{COLOR_RESET}{index_profile.format()}")
 
     print(f"\n----------{GREEN}Enter a Question Below{COLOR_RESET}----------{GREEN}\n")
     question = input("User Question: ")
     while question != "quit":
-        response = chain(question)
+        deadline = Deadline.from_ms(deadline_ms)
+        with use_deadline(deadline), profiler.trace("query") as query_profile:
+            response = chain(question, filters=filters)
         format_func(response)
+        if deadline is not None and deadline.degradations:
+            print(
+                f"{COLOR_RESET}Degraded to meet the deadline: "
+                f"{', '.join(deadline.degradations)}{GREEN}"
+            )
+        if query_profile is not None:
+            print(f"{COLOR_RESET}{query_profile.format()}{GREEN}")
         print(f"{COLOR_RESET}--------------{GREEN}")
         question = input("User Question: ")
+    if watcher is not None:
+        watcher.stop()
     print(f"Quitting chat. Goodbye!{COLOR_RESET}")
 
 
@@ -121,6 +182,65 @@ if __name__ == "__main__":
         required=False
     )
 
+    parser.add_argument(
+        "--profile",
+        type=load_bool,
+        help="Whether or not to print a per-query timing breakdown.",
+        default=False,
+        required=False
+    )
+
+    parser.add_argument(
+        "--corpora",
+        type=load_none_or_list,
+        help=(
+            "Comma-separated names of prebuilt corpora in INDEX_DIR to "
+            "search instead of `docs_dir`."),
+        default="None",
+        required=False
+    )
+
+    parser.add_argument(
+        "--filters",
+        type=load_none_or_json,
+        help=(
+            "JSON metadata filter applied to every question, e.g. "
+            "'{\"extension\": [\".pdf\"], \"folders\": \"hr\"}'."),
+        default="None",
+        required=False
+    )
+
+    parser.add_argument(
+        "--watch",
+        type=load_bool,
+        help=(
+            "Whether or not to re-index `docs_dir` in the background "
+            "as files change."),
+        default=False,
+        required=False
+    )
+
+    parser.add_argument(
+        "--answer_index",
+        type=load_none_or_str,
+        help=(
+            "Path to an answer index built by `docs2chat.apps.answers` "
+            "to check before running the chain. Defaults to "
+            "ANSWER_INDEX_PATH, if an index has been built there."),
+        default="None",
+        required=False
+    )
+
+    parser.add_argument(
+        "--deadline_ms",
+        type=load_none_or_float,
+        help=(
+            "Per-question deadline in milliseconds, met by degrading "
+            "stages. Defaults to DEADLINE_MS."),
+        default="None",
+        required=False
+    )
+
     args = parser.parse_args()
 
     run_cli_application(
@@ -128,5 +248,11 @@ if __name__ == "__main__":
         config_yaml=args.config_yaml,
         docs_dir=args.docs_dir,
         num_return_docs=args.num_return_docs,
-        return_threshold=args.return_threshold
+        return_threshold=args.return_threshold,
+        profile=args.profile,
+        corpora=args.corpora,
+        filters=args.filters,
+        watch=args.watch,
+        answer_index=args.answer_index,
+        deadline_ms=args.deadline_ms
     )
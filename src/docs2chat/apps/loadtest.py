@@ -0,0 +1,626 @@
+"""
+Purpose: Replay a query log against a docs2chat chain at a target load.
+"""
+
+
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import json
+from langchain.document_loaders import TextLoader
+import logging
+import numpy as np
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Literal, Optional
+import urllib.request
+
+
+from docs2chat.apps.benchmark import generate_corpus, generate_queries
+from docs2chat.apps.server import DEGRADATIONS_HEADER, STAGE_SECONDS_HEADER
+from docs2chat.apps.stubs import (
+    EMBEDDING_DIM,
+    StubEmbeddingRetriever,
+    StubLLM,
+    StubRanker,
+    StubReader,
+    StubTokenizer
+)
+from docs2chat.apps.utils import (
+    ChainFactory,
+    load_bool,
+    load_none_or_float,
+    load_none_or_str
+)
+from docs2chat.chat import GenerativePipeline, get_conversation_chain
+from docs2chat.concurrency import Deadline, use_deadline
+from docs2chat.config import config
+from docs2chat.extract import SearchExtractivePipeline, SnipExtractivePipeline
+from docs2chat.preprocessing import SharedIndex
+from docs2chat.preprocessing.preprocessing import ExtractivePreProcessor
+from docs2chat.preprocessing.text_splitter import TokenTextSplitter
+from docs2chat.preprocessing.utils import (
+    langchain_to_haystack_docs,
+    load_and_split_from_dir
+)
+from docs2chat.profiling import profiler
+
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.INFO)
+_formatter = logging.Formatter(
+    "%(asctime)s:%(levelname)s:%(module)s: %(message)s"
+)
+_console_handler = logging.StreamHandler(sys.stdout)
+_console_handler.setFormatter(_formatter)
+_logger.addHandler(_console_handler)
+
+
+PERCENTILES = (50, 95, 99)
+
+
+def load_queries(path: str) -> list[dict]:
+    """
+    Read a query log: one query per line, as plain text or as a JSON
+    object with a `query` and optional `filters`.
+    """
+    queries = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                record = json.loads(line)
+                queries.append({
+                    "query": record["query"],
+                    "filters": record.get("filters")
+                })
+            else:
+                queries.append({"query": line, "filters": None})
+    return queries
+
+
+def build_stub_chain(
+    chain_type: Literal["generative", "search", "snip"],
+    docs_dir: str,
+    num_return_docs: int = 4
+):
+    """
+    Build a chain over `docs_dir` that uses stub models only.
+    """
+    text_splitter = TokenTextSplitter(
+        tokenizer=StubTokenizer(),
+        max_seq_length=StubTokenizer.model_max_length
+    )
+    docs = load_and_split_from_dir(
+        content=docs_dir,
+        text_splitter=text_splitter,
+        show_progress=False,
+        loader_cls=TextLoader
+    )
+    document_store_cls = ExtractivePreProcessor.DOCUMENT_STORE_FACTORY[
+        config.DOCUMENT_STORE
+    ]
+    document_store = document_store_cls(
+        embedding_dim=EMBEDDING_DIM,
+        progress_bar=False
+    )
+    document_store.write_documents(langchain_to_haystack_docs(docs))
+    retriever = StubEmbeddingRetriever(document_store=document_store)
+    document_store.update_embeddings(retriever)
+    index = SharedIndex(document_store=document_store, retriever=retriever)
+    if chain_type == "search":
+        return SearchExtractivePipeline(
+            num_return_docs=num_return_docs,
+            ranker=StubRanker(),
+            retriever=index.retriever
+        )
+    if chain_type == "snip":
+        return SnipExtractivePipeline(
+            num_return_docs=num_return_docs,
+            reader=StubReader(),
+            retriever=index.retriever
+        )
+    return GenerativePipeline(chain=get_conversation_chain(
+        docs_dir=docs_dir,
+        llm=StubLLM(),
+        retriever=index.as_langchain_retriever(top_k=num_return_docs)
+    ))
+
+
+@dataclass
+class InProcessTarget:
+    """
+    Send queries to a chain in this process through its `arun` API.
+    """
+
+    chain: Any
+    deadline_ms: Optional[float] = field(default=None)
+
+    def __post_init__(self):
+        profiler.enable()
+        # Created on first use, in the event loop that runs the queries.
+        self._memory_lock = None
+
+    async def _run(
+        self,
+        query: str,
+        filters: Optional[dict],
+        deadline: Optional[Deadline]
+    ):
+        with use_deadline(deadline), profiler.trace("query") as profile:
+            await self.chain.arun(query, filters=filters)
+        return profile
+
+    async def query(self, query: str, filters: Optional[dict] = None):
+        deadline = Deadline.from_ms(self.deadline_ms)
+        memory = getattr(getattr(self.chain, "chain", None), "memory", None)
+        if memory is None:
+            profile = await self._run(query, filters, deadline)
+        else:
+            # Requests are independent, as in the server, so a conversation
+            # chain starts each one without history. It runs one query at a
+            # time anyway; the lock keeps another's history out of this one.
+            if self._memory_lock is None:
+                self._memory_lock = asyncio.Lock()
+            async with self._memory_lock:
+                memory.clear()
+                profile = await self._run(query, filters, deadline)
+        degradations = deadline.degradations if deadline is not None else []
+        return profile.stage_seconds(), degradations
+
+    def close(self):
+        return
+
+
+@dataclass
+class HTTPTarget:
+    """
+    Send queries to a `docs2chat.apps.server` over HTTP.
+
+    Stage timings are read from the server's `X-Stage-Seconds` header,
+    which it only sends when started with profiling enabled, and
+    degradations from its `X-Degradations` header.
+    """
+
+    url: str
+    deadline_ms: Optional[float] = field(default=None)
+    max_connections: int = field(default=64)
+    timeout: float = field(default=60.0)
+
+    def __post_init__(self):
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_connections,
+            thread_name_prefix="docs2chat-loadtest"
+        )
+
+    def _post(
+        self,
+        query: str,
+        filters: Optional[dict]
+    ) -> tuple[dict, list[str]]:
+        body = {"query": query, "filters": filters}
+        if self.deadline_ms is not None:
+            body["deadline_ms"] = self.deadline_ms
+        request = urllib.request.Request(
+            f"{self.url.rstrip('/')}/query",
+            data=json.dumps(body).encode(),
+            headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+            stage_seconds = response.headers.get(STAGE_SECONDS_HEADER)
+            degradations = response.headers.get(DEGRADATIONS_HEADER)
+        return (
+            json.loads(stage_seconds) if stage_seconds else {},
+            json.loads(degradations) if degradations else []
+        )
+
+    async def query(self, query: str, filters: Optional[dict] = None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, self._post, query, filters
+        )
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+@dataclass
+class LoadResult:
+    latency: float
+    stage_seconds: dict[str, float]
+    degradations: list[str] = field(default_factory=list)
+    error: Optional[str] = field(default=None)
+
+
+async def _send(target, request: dict, scheduled: float) -> LoadResult:
+    # Latency is measured from the scheduled send time, so time spent
+    # waiting behind slow requests counts (no coordinated omission).
+    try:
+        stage_seconds, degradations = await target.query(
+            request["query"], filters=request["filters"]
+        )
+        error = None
+    except Exception as e:
+        stage_seconds, degradations = {}, []
+        error = f"{type(e).__name__}: {e}"
+    return LoadResult(
+        latency=time.perf_counter() - scheduled,
+        stage_seconds=stage_seconds,
+        degradations=degradations,
+        error=error
+    )
+
+
+async def run_open_loop(
+    target,
+    queries: list[dict],
+    qps: float,
+    num_requests: int,
+    seed: int = 0
+) -> tuple[list[LoadResult], float]:
+    """
+    Send requests as a Poisson process at `qps`, whether or not earlier
+    ones have completed.
+    """
+    generator = random.Random(seed)
+    start = time.perf_counter()
+    scheduled = start
+    tasks = []
+    for idx in range(num_requests):
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(
+            _send(target, queries[idx % len(queries)], scheduled)
+        ))
+        scheduled += generator.expovariate(qps)
+    results = await asyncio.gather(*tasks)
+    return results, time.perf_counter() - start
+
+
+async def run_closed_loop(
+    target,
+    queries: list[dict],
+    concurrency: int,
+    num_requests: int
+) -> tuple[list[LoadResult], float]:
+    """
+    Keep `concurrency` requests in flight, each client sending its next
+    request as soon as the previous one completes.
+    """
+    results = []
+    next_idx = 0
+
+    async def client():
+        nonlocal next_idx
+        while next_idx < num_requests:
+            request = queries[next_idx % len(queries)]
+            next_idx += 1
+            results.append(
+                await _send(target, request, time.perf_counter())
+            )
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return results, time.perf_counter() - start
+
+
+def _percentiles(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {}
+    stats = {
+        f"p{percentile}_seconds": float(np.percentile(values, percentile))
+        for percentile in PERCENTILES
+    }
+    stats["mean_seconds"] = float(np.mean(values))
+    stats["max_seconds"] = float(np.max(values))
+    return stats
+
+
+def summarize(results: list[LoadResult], elapsed: float) -> dict:
+    completed = [result for result in results if result.error is None]
+    errors = {}
+    for result in results:
+        if result.error is not None:
+            errors[result.error] = errors.get(result.error, 0) + 1
+    degradations = {}
+    for result in completed:
+        for name in result.degradations:
+            degradations[name] = degradations.get(name, 0) + 1
+    stage_names = sorted({
+        name for result in completed for name in result.stage_seconds
+    })
+    return {
+        "requests": len(results),
+        "completed": len(completed),
+        "errors": errors,
+        "degradations": degradations,
+        "elapsed_seconds": elapsed,
+        "throughput_qps": len(completed) / max(elapsed, 1e-12),
+        "latency": _percentiles([result.latency for result in completed]),
+        "stages": {
+            name: _percentiles([
+                result.stage_seconds.get(name, 0) for result in completed
+            ])
+            for name in stage_names
+        }
+    }
+
+
+def run_load_test(
+    chain_type: Literal["generative", "search", "snip"] = "search",
+    mode: Literal["open", "closed"] = "closed",
+    qps: float = 10.0,
+    concurrency: int = 4,
+    num_requests: int = 200,
+    warmup_requests: int = 10,
+    queries_path: Optional[str] = None,
+    url: Optional[str] = None,
+    docs_dir: Optional[str] = None,
+    stub_models: bool = True,
+    num_docs: int = 200,
+    num_return_docs: int = 4,
+    seed: int = 0,
+    deadline_ms: Optional[float] = None
+) -> dict:
+    """
+    Replay queries against a chain (in-process, or a server at `url`) and
+    report latency percentiles, throughput and per-stage timings.
+
+    The in-process chain uses stub models over a synthetic corpus unless
+    `docs_dir` is given; with `stub_models` off it is built by
+    ChainFactory with the configured models.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sentences = None
+        if url is None and docs_dir is None:
+            _logger.info(
+                f"Generating synthetic corpus of {num_docs} documents."
+            )
+            docs_dir = tmp_dir
+            sentences = generate_corpus(
+                docs_dir=docs_dir, num_docs=num_docs, seed=seed
+            )
+        if queries_path is not None:
+            queries = load_queries(queries_path)
+        else:
+            if sentences is None:
+                sentences = generate_corpus(
+                    docs_dir=tmp_dir, num_docs=num_docs, seed=seed
+                )
+            queries = [
+                {"query": query, "filters": None}
+                for query in generate_queries(sentences, seed=seed)
+            ]
+        if url is not None:
+            target = HTTPTarget(
+                url=url,
+                deadline_ms=deadline_ms,
+                max_connections=max(
+                    concurrency, int(qps * 10) if mode == "open" else 1
+                )
+            )
+        elif stub_models:
+            target = InProcessTarget(
+                chain=build_stub_chain(
+                    chain_type, docs_dir, num_return_docs=num_return_docs
+                ),
+                deadline_ms=deadline_ms
+            )
+        else:
+            chain, _ = ChainFactory(
+                chain_type=chain_type,
+                docs_dir=docs_dir,
+                config_obj=config,
+                num_return_docs=num_return_docs,
+                return_threshold=0
+            )
+            target = InProcessTarget(chain=chain, deadline_ms=deadline_ms)
+
+        async def _run():
+            if warmup_requests:
+                await run_closed_loop(
+                    target, queries, concurrency=concurrency,
+                    num_requests=warmup_requests
+                )
+            if mode == "open":
+                return await run_open_loop(
+                    target, queries, qps=qps, num_requests=num_requests,
+                    seed=seed
+                )
+            return await run_closed_loop(
+                target, queries, concurrency=concurrency,
+                num_requests=num_requests
+            )
+
+        _logger.info(
+            f"Sending {num_requests} `{chain_type}` requests "
+            f"({mode} loop) to {url or 'an in-process chain'}."
+        )
+        try:
+            results, elapsed = asyncio.run(_run())
+        finally:
+            target.close()
+    return {
+        "meta": {
+            "chain_type": chain_type,
+            "mode": mode,
+            "qps": qps if mode == "open" else None,
+            "concurrency": concurrency if mode == "closed" else None,
+            "num_requests": num_requests,
+            "num_queries": len(queries),
+            "deadline_ms": deadline_ms,
+            "target": url or ("in-process (stub models)" if stub_models
+                              else "in-process"),
+            "document_store": None if url else config.DOCUMENT_STORE,
+            "inference_workers": None if url else config.INFERENCE_WORKERS,
+            "seed": seed,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        **summarize(results, elapsed)
+    }
+
+
+def format_report(report: dict, baseline: Optional[dict] = None) -> str:
+    def _row(name, stats, base_stats):
+        row = f"{name:<24}"
+        for percentile in PERCENTILES:
+            row += f"{stats.get(f'p{percentile}_seconds', 0) * 1000:>10.2f}"
+        change = ""
+        if base_stats and base_stats.get("p95_seconds"):
+            change = (
+                f"{stats.get('p95_seconds', 0) / base_stats['p95_seconds']:.2f}x"
+            )
+        return row + f"{change:>12}"
+
+    baseline = baseline or {}
+    lines = [
+        f"{'stage':<24}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}"
+        f"{'p95 vs base':>12}",
+        _row("request", report["latency"], baseline.get("latency"))
+    ]
+    for stage, stats in report["stages"].items():
+        lines.append(_row(
+            stage, stats, baseline.get("stages", {}).get(stage)
+        ))
+    throughput = f"\nthroughput: {report['throughput_qps']:.1f} req/s"
+    if baseline.get("throughput_qps"):
+        throughput += (
+            f" ({report['throughput_qps'] / baseline['throughput_qps']:.2f}x"
+            " base)"
+        )
+    lines.append(throughput)
+    lines.append(
+        f"completed: {report['completed']}/{report['requests']}"
+        f", errors: {sum(report['errors'].values())}"
+    )
+    for name, count in report.get("degradations", {}).items():
+        lines.append(f"degraded ({name}): {count}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load-test a docs2chat chain by replaying queries."
+    )
+    parser.add_argument(
+        "--chain_type",
+        type=str,
+        help="One of `generative`, `search` or `snip`.",
+        default="search",
+        required=False
+    )
+    parser.add_argument(
+        "--mode",
+        type=str,
+        help=(
+            "`open` sends at `--qps` regardless of completions; `closed` "
+            "keeps `--concurrency` requests in flight."),
+        default="closed",
+        required=False
+    )
+    parser.add_argument("--qps", type=float, default=10.0, required=False)
+    parser.add_argument("--concurrency", type=int, default=4, required=False)
+    parser.add_argument(
+        "--num_requests", type=int, default=200, required=False
+    )
+    parser.add_argument(
+        "--warmup_requests", type=int, default=10, required=False
+    )
+    parser.add_argument(
+        "--queries",
+        type=load_none_or_str,
+        help=(
+            "Query log to replay: one query per line, or JSON lines with "
+            "`query` and `filters`. Defaults to synthetic queries."),
+        default="None",
+        required=False
+    )
+    parser.add_argument(
+        "--url",
+        type=load_none_or_str,
+        help="Base URL of a running docs2chat server to load instead.",
+        default="None",
+        required=False
+    )
+    parser.add_argument(
+        "--docs_dir",
+        type=load_none_or_str,
+        help="Documents for the in-process chain. Defaults to synthetic.",
+        default="None",
+        required=False
+    )
+    parser.add_argument(
+        "--stub_models",
+        type=load_bool,
+        help="Whether or not the in-process chain uses stub models.",
+        default="true",
+        required=False
+    )
+    parser.add_argument("--num_docs", type=int, default=200, required=False)
+    parser.add_argument(
+        "--num_return_docs", type=int, default=4, required=False
+    )
+    parser.add_argument("--seed", type=int, default=0, required=False)
+    parser.add_argument(
+        "--deadline_ms",
+        type=load_none_or_float,
+        help="Per-request deadline in milliseconds.",
+        default="None",
+        required=False
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Path to write the JSON report to.",
+        default="loadtest_results.json",
+        required=False
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        help="Path to a JSON report to compare against.",
+        default=None,
+        required=False
+    )
+
+    args = parser.parse_args()
+
+    report = run_load_test(
+        chain_type=args.chain_type,
+        mode=args.mode,
+        qps=args.qps,
+        concurrency=args.concurrency,
+        num_requests=args.num_requests,
+        warmup_requests=args.warmup_requests,
+        queries_path=args.queries,
+        url=args.url,
+        docs_dir=args.docs_dir,
+        stub_models=args.stub_models,
+        num_docs=args.num_docs,
+        num_return_docs=args.num_return_docs,
+        seed=args.seed,
+        deadline_ms=args.deadline_ms
+    )
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    print(format_report(report, baseline=baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,7 @@ from docs2chat.config import config
 
 APPS_PATH = Path(os.path.realpath(__file__)).parents[1].absolute() / "apps"
 CLI_SCRIPT_PATH = APPS_PATH / "cli.py"
+SERVER_SCRIPT_PATH = APPS_PATH / "server.py"
 
 
 def main():
@@ -24,7 +25,7 @@ def main():
         "--type",
         type=str,
         help=(
-            "One of 'cli', 'gui' or 'web'. "
+            "One of 'cli', 'server', 'gui' or 'web'. "
             "Determines the type of app to launch."
         ),
         default="cli",
@@ -85,6 +86,65 @@ def main():
         required=False
     )
 
+    parser.add_argument(
+        "--profile",
+        type=load_bool,
+        help="Whether or not to print a per-query timing breakdown.",
+        default=False,
+        required=False
+    )
+
+    parser.add_argument(
+        "--corpora",
+        type=str,
+        help=(
+            "Comma-separated names of prebuilt corpora in INDEX_DIR to "
+            "search instead of `docs_dir`."),
+        default="None",
+        required=False
+    )
+
+    parser.add_argument(
+        "--filters",
+        type=str,
+        help=(
+            "JSON metadata filter applied to every question, e.g. "
+            "'{\"extension\": [\".pdf\"], \"folders\": \"hr\"}'."),
+        default="None",
+        required=False
+    )
+
+    parser.add_argument(
+        "--watch",
+        type=load_bool,
+        help=(
+            "Whether or not to re-index `docs_dir` in the background "
+            "as files change."),
+        default=False,
+        required=False
+    )
+
+    parser.add_argument(
+        "--answer_index",
+        type=str,
+        help=(
+            "Path to an answer index built by `docs2chat.apps.answers` "
+            "to check before running the chain. Defaults to "
+            "ANSWER_INDEX_PATH, if an index has been built there."),
+        default="None",
+        required=False
+    )
+
+    parser.add_argument(
+        "--deadline_ms",
+        type=str,
+        help=(
+            "Per-question deadline in milliseconds, met by degrading "
+            "stages. Defaults to DEADLINE_MS."),
+        default="None",
+        required=False
+    )
+
     args = parser.parse_args()
     
     if args.type == "cli":
@@ -96,12 +156,32 @@ def main():
                 f"--config_yaml={args.config_yaml}",
                 f"--chain_type={args.chain_type}",
                 f"--num_return_docs={args.num_return_docs}",
-                f"--return_threshold={args.return_threshold}"
+                f"--return_threshold={args.return_threshold}",
+                f"--profile={args.profile}",
+                f"--corpora={args.corpora}",
+                f"--filters={args.filters}",
+                f"--watch={args.watch}",
+                f"--answer_index={args.answer_index}",
+                f"--deadline_ms={args.deadline_ms}"
             ]
         }
         if not args.debug:
             run_kwargs["stderr"] = subprocess.DEVNULL
         subprocess.run(**run_kwargs)
+    elif args.type == "server":
+        subprocess.run(args=[
+            "python3",
+            str(SERVER_SCRIPT_PATH),
+            f"--docs_dir={args.docs_dir}",
+            f"--config_yaml={args.config_yaml}",
+            f"--chain_type={args.chain_type}",
+            f"--num_return_docs={args.num_return_docs}",
+            f"--return_threshold={args.return_threshold}",
+            f"--profile={args.profile}",
+            f"--corpora={args.corpora}",
+            f"--answer_index={args.answer_index}",
+            f"--deadline_ms={args.deadline_ms}"
+        ])
     
 
 if __name__ == "__main__":
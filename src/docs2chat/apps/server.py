@@ -0,0 +1,503 @@
+"""
+Purpose: Pre-fork HTTP server for docs2chat.
+"""
+
+
+import argparse
+from dataclasses import dataclass, field
+import faiss
+import gc
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+import torch
+from typing import Any, Callable, Literal, Optional
+
+
+from docs2chat.apps.answers import (
+    resolve_answer_index,
+    with_answer_index
+)
+from docs2chat.apps.utils import (
+    ChainFactory,
+    load_bool,
+    load_none_or_float,
+    load_none_or_list,
+    load_none_or_str,
+    SERIALIZE_FUNC_FACTORY
+)
+from docs2chat.concurrency import Deadline, use_deadline
+from docs2chat.config import config
+from docs2chat.preprocessing import ShardedIndex
+from docs2chat.preprocessing.filters import (
+    prepare_stores_for_fork,
+    reopen_stores_after_fork
+)
+from docs2chat.profiling import profiler, QueryProfile
+
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.INFO)
+_formatter = logging.Formatter(
+    "%(asctime)s:%(levelname)s:%(module)s: %(message)s"
+)
+_console_handler = logging.StreamHandler(sys.stdout)
+_console_handler.setFormatter(_formatter)
+_logger.addHandler(_console_handler)
+
+
+STAGE_SECONDS_HEADER = "X-Stage-Seconds"
+DEGRADATIONS_HEADER = "X-Degradations"
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON API served by each worker.
+
+    `POST /query` takes `{"query": ..., "filters": ..., "deadline_ms":
+    ...}` and returns the serialized chain output; with profiling
+    enabled, the time spent in each stage is sent in the
+    `X-Stage-Seconds` header as JSON. Stages degraded to meet the
+    deadline are listed in the `X-Degradations` header. `GET
+    /health` reports the worker pid and `GET /metrics` the worker's
+    profiler metrics in Prometheus format.
+    """
+
+    def _send(
+        self,
+        status: int,
+        body: bytes,
+        content_type: str,
+        headers: Optional[dict] = None
+    ):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(
+        self,
+        status: int,
+        payload: Any,
+        headers: Optional[dict] = None
+    ):
+        body = json.dumps(payload, default=str).encode("utf-8")
+        self._send(status, body, "application/json", headers=headers)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", "pid": os.getpid()})
+        elif self.path == "/metrics":
+            body = profiler.registry.to_prometheus().encode("utf-8")
+            self._send(200, body, "text/plain; version=0.0.4")
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}."})
+
+    def do_POST(self):
+        if self.path != "/query":
+            self._send_json(404, {"error": f"Unknown path {self.path}."})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            query = request["query"]
+            filters = request.get("filters")
+            deadline_ms = request.get("deadline_ms", self.server.deadline_ms)
+            if deadline_ms is not None:
+                deadline_ms = float(deadline_ms)
+        except (KeyError, TypeError, ValueError):
+            self._send_json(
+                400, {"error": "Expected a JSON body with a `query`."}
+            )
+            return
+        try:
+            output, profile, deadline = self.server.answer(
+                query, filters, deadline_ms=deadline_ms
+            )
+        except Exception as e:
+            _logger.exception(f"Failed to answer query {query!r}.")
+            self._send_json(500, {"error": str(e)})
+            return
+        headers = {}
+        if profile is not None:
+            headers[STAGE_SECONDS_HEADER] = json.dumps(
+                profile.stage_seconds()
+            )
+        if deadline is not None and deadline.degradations:
+            headers[DEGRADATIONS_HEADER] = json.dumps(deadline.degradations)
+        self._send_json(200, output, headers=headers)
+
+    def log_message(self, format: str, *args):
+        _logger.debug(f"{self.address_string()} {format % args}")
+
+
+class WorkerHTTPServer(HTTPServer):
+    """
+    HTTPServer that accepts connections on an inherited listening socket.
+    """
+
+    def __init__(
+        self,
+        listen_socket: socket.socket,
+        chain: Callable,
+        serialize_func: Callable,
+        deadline_ms: Optional[float] = None
+    ):
+        super().__init__(
+            listen_socket.getsockname()[:2],
+            QueryRequestHandler,
+            bind_and_activate=False
+        )
+        self.socket.close()
+        self.socket = listen_socket
+        self.chain = chain
+        self.serialize_func = serialize_func
+        self.deadline_ms = deadline_ms
+
+    def answer(
+        self,
+        query: str,
+        filters: Optional[dict] = None,
+        deadline_ms: Optional[float] = None
+    ) -> tuple[Any, Optional[QueryProfile], Optional[Deadline]]:
+        # Requests are independent, so a conversation chain starts each
+        # one without history.
+        memory = getattr(getattr(self.chain, "chain", None), "memory", None)
+        if memory is not None:
+            memory.clear()
+        deadline = Deadline.from_ms(deadline_ms)
+        with use_deadline(deadline), profiler.trace("query") as profile:
+            output = self.chain(query, filters=filters)
+        return self.serialize_func(output), profile, deadline
+
+
+@dataclass
+class PreForkServer:
+    """
+    Serve a loaded chain from `num_workers` forked worker processes.
+
+    The chain (models and index) is loaded once by the caller, in the
+    parent. The parent then freezes the garbage collector, so objects that
+    already exist are never scanned (and their pages never written) by a
+    collection, and forks the workers, which share those pages with it
+    copy-on-write. Each worker answers one request at a time from a shared
+    listening socket, using `worker_threads` threads for torch and FAISS;
+    keeping this at 1 also avoids OpenMP thread pools inherited across
+    fork. SQLite connections must not be shared across fork either, so
+    before forking the parent closes those of every document store,
+    moving in-memory databases to files in a temporary directory, and
+    each worker drops any it inherited and opens its own. The parent
+    restarts any worker that exits, waiting `restart_delay` seconds first
+    if it ran for less than `min_uptime`. Requests without a
+    `deadline_ms` of their own get `deadline_ms`. POSIX only.
+    """
+
+    chain: Callable
+    chain_type: Literal["generative", "search", "snip"]
+    host: str = field(default=config.SERVER_HOST)
+    port: int = field(default=config.SERVER_PORT)
+    num_workers: Optional[int] = field(default=config.SERVER_WORKERS)
+    worker_threads: int = field(default=config.SERVER_WORKER_THREADS)
+    deadline_ms: Optional[float] = field(default=config.DEADLINE_MS)
+    min_uptime: float = field(default=5.0)
+    restart_delay: float = field(default=1.0)
+
+    def __post_init__(self):
+        if not hasattr(os, "fork"):
+            raise RuntimeError(
+                "PreForkServer requires a platform with `os.fork`."
+            )
+        if self.num_workers is None:
+            setattr(self, "num_workers", os.cpu_count() or 1)
+        self._socket = None
+        self._sql_dir = None
+        self._workers = {}
+
+    def serve_forever(self):
+        self._socket = socket.create_server(
+            (self.host, self.port), backlog=128
+        )
+        self._sql_dir = tempfile.mkdtemp(prefix="docs2chat-")
+        prepare_stores_for_fork(self._sql_dir)
+        # Objects created so far are shared with the workers; keep the
+        # collector off them.
+        gc.collect()
+        gc.freeze()
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        _logger.info(
+            f"Serving `{self.chain_type}` on {self.host}:{self.port} "
+            f"with {self.num_workers} workers."
+        )
+        try:
+            for _ in range(self.num_workers):
+                self._spawn_worker()
+            self._supervise()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._stop_workers()
+            self._socket.close()
+            gc.unfreeze()
+            shutil.rmtree(self._sql_dir, ignore_errors=True)
+
+    def _handle_signal(self, signum, frame):
+        raise KeyboardInterrupt
+
+    def _spawn_worker(self):
+        pid = os.fork()
+        if pid:
+            self._workers[pid] = time.monotonic()
+            return
+        exit_code = 1
+        try:
+            self._run_worker()
+            exit_code = 0
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 0
+        except BaseException:
+            _logger.exception(f"Worker {os.getpid()} failed.")
+        finally:
+            # Never return into the parent's stack or run its exit hooks.
+            os._exit(exit_code)
+
+    def _run_worker(self):
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        torch.set_num_threads(self.worker_threads)
+        faiss.omp_set_num_threads(self.worker_threads)
+        reopen_stores_after_fork()
+        server = WorkerHTTPServer(
+            listen_socket=self._socket,
+            chain=self.chain,
+            serialize_func=SERIALIZE_FUNC_FACTORY[self.chain_type],
+            deadline_ms=self.deadline_ms
+        )
+        server.serve_forever()
+
+    def _supervise(self):
+        while True:
+            pid, status = os.wait()
+            started = self._workers.pop(pid, None)
+            if started is None:
+                continue
+            exit_code = os.waitstatus_to_exitcode(status)
+            _logger.warning(
+                f"Worker {pid} exited with code {exit_code}. Restarting."
+            )
+            if time.monotonic() - started < self.min_uptime:
+                time.sleep(self.restart_delay)
+            self._spawn_worker()
+
+    def _stop_workers(self, timeout: float = 10.0):
+        for pid in self._workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + timeout
+        while self._workers and time.monotonic() < deadline:
+            for pid in list(self._workers):
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    self._workers.pop(pid)
+            time.sleep(0.05)
+        for pid in self._workers:
+            _logger.warning(f"Killing worker {pid}.")
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self._workers = {}
+
+
+def run_server(
+    chain_type: Literal["generative", "search", "snip"] = "generative",
+    config_yaml: str = None,
+    docs_dir: str = None,
+    num_return_docs: int = None,
+    return_threshold: float = None,
+    profile: bool = False,
+    corpora: Optional[list[str]] = None,
+    host: str = None,
+    port: int = None,
+    num_workers: Optional[int] = None,
+    answer_index: Optional[str] = None,
+    deadline_ms: Optional[float] = None
+):
+    if config_yaml is not None:
+        config.reset_config(config_yaml)
+    if docs_dir is None:
+        docs_dir = config.DOCUMENTS_DIR
+    answer_index = resolve_answer_index(answer_index)
+    if profile:
+        profiler.enable()
+    index = None
+    if corpora is not None:
+        index = ShardedIndex(corpora=corpora)
+    chain, _ = ChainFactory(
+        chain_type=chain_type,
+        docs_dir=docs_dir,
+        config_obj=config,
+        num_return_docs=num_return_docs,
+        return_threshold=return_threshold,
+        index=index
+    )
+    if answer_index is not None:
+        chain = with_answer_index(
+            chain=chain,
+            chain_type=chain_type,
+            answer_index_path=answer_index,
+            docs_dir=docs_dir,
+            index=index,
+            num_return_docs=num_return_docs,
+            return_threshold=return_threshold
+        )
+    server = PreForkServer(
+        chain=chain,
+        chain_type=chain_type,
+        host=host or config.SERVER_HOST,
+        port=port or config.SERVER_PORT,
+        num_workers=num_workers or config.SERVER_WORKERS,
+        deadline_ms=(
+            deadline_ms if deadline_ms is not None else config.DEADLINE_MS
+        )
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Serve docs2chat over HTTP.")
+
+    parser.add_argument(
+        "--config_yaml",
+        type=load_none_or_str,
+        help="Absolute path to yaml config file.",
+        default="None",
+        required=False
+    )
+
+    parser.add_argument(
+        "--docs_dir",
+        type=str,
+        help="Full path to directory containing documents.",
+        default=config.DOCUMENTS_DIR,
+        required=False
+    )
+
+    parser.add_argument(
+        "--chain_type",
+        type=str,
+        help=(
+            "What type of QA to perform. "
+            "One of `generative`, `search` or `snip`."),
+        default="generative",
+        required=False
+    )
+
+    parser.add_argument(
+        "--num_return_docs",
+        type=int,
+        help=(
+            "The number of documents to return "
+            "(if `chain_type` is `extractive`)."),
+        default=4,
+        required=False
+    )
+
+    parser.add_argument(
+        "--return_threshold",
+        type=float,
+        help=(
+            "The confidence threshold in [0,1] to use as a cutoff "
+            "(if `chain_type` is `extractive`.)"),
+        default=0,
+        required=False
+    )
+
+    parser.add_argument(
+        "--profile",
+        type=load_bool,
+        help="Whether or not to record metrics served at `/metrics`.",
+        default=False,
+        required=False
+    )
+
+    parser.add_argument(
+        "--corpora",
+        type=load_none_or_list,
+        help=(
+            "Comma-separated names of prebuilt corpora in INDEX_DIR to "
+            "search instead of `docs_dir`."),
+        default="None",
+        required=False
+    )
+
+    parser.add_argument(
+        "--host",
+        type=str,
+        help="Address to listen on.",
+        default=config.SERVER_HOST,
+        required=False
+    )
+
+    parser.add_argument(
+        "--port",
+        type=int,
+        help="Port to listen on.",
+        default=config.SERVER_PORT,
+        required=False
+    )
+
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        help="Number of worker processes. Defaults to one per core.",
+        default=config.SERVER_WORKERS,
+        required=False
+    )
+
+    parser.add_argument(
+        "--answer_index",
+        type=load_none_or_str,
+        help=(
+            "Path to an answer index built by `docs2chat.apps.answers` "
+            "to check before running the chain. Defaults to "
+            "ANSWER_INDEX_PATH, if an index has been built there."),
+        default="None",
+        required=False
+    )
+
+    parser.add_argument(
+        "--deadline_ms",
+        type=load_none_or_float,
+        help=(
+            "Per-question deadline in milliseconds, met by degrading "
+            "stages. Defaults to DEADLINE_MS."),
+        default="None",
+        required=False
+    )
+
+    args = parser.parse_args()
+
+    run_server(
+        chain_type=args.chain_type,
+        config_yaml=args.config_yaml,
+        docs_dir=args.docs_dir,
+        num_return_docs=args.num_return_docs,
+        return_threshold=args.return_threshold,
+        profile=args.profile,
+        corpora=args.corpora,
+        host=args.host,
+        port=args.port,
+        num_workers=args.num_workers,
+        answer_index=args.answer_index,
+        deadline_ms=args.deadline_ms
+    )
@@ -0,0 +1,302 @@
+"""
+Purpose: Deterministic stand-in models for offline benchmarks of docs2chat.
+"""
+
+
+from copy import copy
+from dataclasses import dataclass, field
+from haystack.document_stores import BaseDocumentStore
+from haystack.nodes import BaseRanker, BaseReader, BaseRetriever
+from haystack.schema import Answer, Document as HS_Document, Span
+from langchain.llms.base import LLM
+import numpy as np
+import re
+from typing import Any, Optional, Union
+import zlib
+
+
+EMBEDDING_DIM = 384
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_PATTERN = re.compile(r"[^.!?]+[.!?]?")
+
+
+def _words(text: str) -> set[str]:
+    return set(re.findall(r"\w+", text.lower()))
+
+
+def hash_embed(texts: list[str], dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """
+    Embed texts as normalized hashed bag-of-words vectors.
+    """
+    embeddings = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in re.findall(r"\w+", text.lower()):
+            hashed = zlib.crc32(word.encode("utf-8"))
+            embeddings[row, hashed % dim] += 1.0 if hashed & 1 else -1.0
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def _overlap_score(query: str, text: str) -> float:
+    query_words = _words(query)
+    if not query_words:
+        return 0.0
+    return len(query_words & _words(text)) / len(query_words)
+
+
+class StubTokenizer:
+    """
+    Word/punctuation tokenizer with the fast-tokenizer call signature.
+    """
+
+    model_max_length = 256
+
+    def num_special_tokens_to_add(self, pair: bool = False) -> int:
+        return 3 if pair else 2
+
+    def _encode(self, text: str, return_offsets_mapping: bool) -> dict:
+        matches = list(_TOKEN_PATTERN.finditer(text))
+        encoding = {
+            "input_ids": [
+                zlib.crc32(match.group().encode("utf-8")) % 30000
+                for match in matches
+            ]
+        }
+        if return_offsets_mapping:
+            encoding["offset_mapping"] = [match.span() for match in matches]
+        return encoding
+
+    def __call__(
+        self,
+        text,
+        add_special_tokens: bool = True,
+        return_offsets_mapping: bool = False,
+        **kwargs
+    ) -> dict:
+        if isinstance(text, str):
+            return self._encode(text, return_offsets_mapping)
+        encodings = [
+            self._encode(ele, return_offsets_mapping) for ele in text
+        ]
+        return {
+            key: [encoding[key] for encoding in encodings]
+            for key in (encodings[0] if encodings else {"input_ids": []})
+        }
+
+
+@dataclass
+class StubEmbeddings:
+    """
+    LangChain-compatible embeddings backed by `hash_embed`.
+    """
+
+    dim: int = field(default=EMBEDDING_DIM)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return hash_embed(texts, dim=self.dim).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return hash_embed([text], dim=self.dim)[0].tolist()
+
+
+class StubEmbeddingRetriever(BaseRetriever):
+    """
+    Dense retriever that embeds with `hash_embed` instead of a model.
+    """
+
+    def __init__(
+        self,
+        document_store: Optional[BaseDocumentStore] = None,
+        top_k: int = 10,
+        dim: int = EMBEDDING_DIM,
+        scale_score: bool = True
+    ):
+        super().__init__()
+        self.document_store = document_store
+        self.top_k = top_k
+        self.dim = dim
+        self.scale_score = scale_score
+
+    def embed_queries(self, queries: list[str]) -> np.ndarray:
+        return hash_embed(queries, dim=self.dim)
+
+    def embed_documents(self, documents: list[HS_Document]) -> np.ndarray:
+        return hash_embed([doc.content for doc in documents], dim=self.dim)
+
+    def retrieve(
+        self,
+        query: str,
+        filters: Optional[dict] = None,
+        top_k: Optional[int] = None,
+        index: Optional[str] = None,
+        headers: Optional[dict] = None,
+        scale_score: Optional[bool] = None,
+        document_store: Optional[BaseDocumentStore] = None
+    ) -> list[HS_Document]:
+        document_store = document_store or self.document_store
+        return document_store.query_by_embedding(
+            query_emb=self.embed_queries([query])[0],
+            filters=filters,
+            top_k=top_k or self.top_k,
+            index=index,
+            headers=headers,
+            scale_score=(
+                self.scale_score if scale_score is None else scale_score
+            )
+        )
+
+    def retrieve_batch(
+        self,
+        queries: list[str],
+        filters: Optional[dict] = None,
+        top_k: Optional[int] = None,
+        index: Optional[str] = None,
+        headers: Optional[dict] = None,
+        batch_size: Optional[int] = None,
+        scale_score: Optional[bool] = None,
+        document_store: Optional[BaseDocumentStore] = None
+    ) -> list[list[HS_Document]]:
+        return [
+            self.retrieve(
+                query=query,
+                filters=filters,
+                top_k=top_k,
+                index=index,
+                headers=headers,
+                scale_score=scale_score,
+                document_store=document_store
+            )
+            for query in queries
+        ]
+
+
+class StubRanker(BaseRanker):
+    """
+    Ranker that scores documents by query-word overlap.
+    """
+
+    def predict(
+        self,
+        query: str,
+        documents: list[HS_Document],
+        top_k: Optional[int] = None
+    ) -> list[HS_Document]:
+        ranked = []
+        for doc in documents:
+            doc = copy(doc)
+            doc.score = _overlap_score(query, doc.content)
+            ranked.append(doc)
+        ranked.sort(key=lambda doc: doc.score, reverse=True)
+        return ranked[:top_k]
+
+    def predict_batch(
+        self,
+        queries: list[str],
+        documents: Union[list[HS_Document], list[list[HS_Document]]],
+        top_k: Optional[int] = None,
+        batch_size: Optional[int] = None
+    ) -> list[list[HS_Document]]:
+        # Lists of documents pair up with the queries (or all go with a
+        # single query); a flat list goes with every query.
+        if documents and isinstance(documents[0], list):
+            if len(queries) == 1:
+                queries = queries * len(documents)
+            pairs = list(zip(queries, documents))
+        else:
+            pairs = [(query, documents) for query in queries]
+        return [
+            self.predict(query=query, documents=docs, top_k=top_k)
+            for query, docs in pairs
+        ]
+
+
+class StubReader(BaseReader):
+    """
+    Reader that answers with each document's best-overlapping sentence.
+    """
+
+    def __init__(self, return_no_answers: bool = False):
+        super().__init__()
+        self.return_no_answers = return_no_answers
+
+    def predict(
+        self,
+        query: str,
+        documents: list[HS_Document],
+        top_k: Optional[int] = None
+    ) -> dict:
+        answers = []
+        for doc in documents:
+            sentences = list(_SENTENCE_PATTERN.finditer(doc.content))
+            if not sentences:
+                continue
+            best = max(
+                sentences,
+                key=lambda match: _overlap_score(query, match.group())
+            )
+            answers.append(Answer(
+                answer=best.group().strip(),
+                type="extractive",
+                score=_overlap_score(query, best.group()),
+                context=doc.content,
+                offsets_in_document=[Span(start=best.start(), end=best.end())],
+                offsets_in_context=[Span(start=best.start(), end=best.end())],
+                document_ids=[doc.id]
+            ))
+        answers.sort(key=lambda answer: answer.score, reverse=True)
+        return {"query": query, "no_ans_gap": 0.0, "answers": answers[:top_k]}
+
+    def predict_batch(
+        self,
+        queries: list[str],
+        documents: Union[list[HS_Document], list[list[HS_Document]]],
+        top_k: Optional[int] = None,
+        batch_size: Optional[int] = None
+    ) -> dict:
+        # Like FARMReader: lists of documents pair up with the queries (or
+        # all go with a single query); a flat list goes with every query.
+        if documents and isinstance(documents[0], list):
+            if len(queries) == 1:
+                queries = queries * len(documents)
+            pairs = list(zip(queries, documents))
+        else:
+            pairs = [(query, documents) for query in queries]
+        results = [
+            self.predict(query=query, documents=docs, top_k=top_k)
+            for query, docs in pairs
+        ]
+        return {
+            "queries": queries,
+            "answers": [result["answers"] for result in results],
+            "no_ans_gaps": [result["no_ans_gap"] for result in results]
+        }
+
+
+class StubLLM(LLM):
+    """
+    LLM that answers with the last `max_tokens` words of its prompt.
+    """
+
+    max_tokens: int = 32
+    streaming: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def get_num_tokens(self, text: str) -> int:
+        return len(text.split())
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[Any] = None,
+        **kwargs
+    ) -> str:
+        words = prompt.split()[-self.max_tokens:]
+        if self.streaming and run_manager is not None:
+            for word in words:
+                run_manager.on_llm_new_token(word + " ")
+        return " ".join(words)
@@ -3,9 +3,17 @@ Purpose: Utilities for apps subpackage of docs2chat.
 """
 
 
+from haystack.schema import Answer
+from haystack.schema import Document as HS_Document
+import json
+from langchain.docstore.document import Document
+from typing import Optional, Union
+
+
 from docs2chat.config import Config
-from docs2chat.chat import get_conversation_chain
+from docs2chat.chat import GenerativePipeline, get_conversation_chain
 from docs2chat.extract import ExtractivePipeline
+from docs2chat.preprocessing import ShardedIndex, SharedIndex
 
 
 class ChainFactory:
@@ -16,7 +24,8 @@ class ChainFactory:
         docs_dir: str,
         config_obj: Config = None,
         num_return_docs: int = None,
-        return_threshold: float = None
+        return_threshold: float = None,
+        index: Optional[Union[ShardedIndex, SharedIndex]] = None
     ):
         if chain_type == "generative":
             if config_obj is None:
@@ -24,10 +33,14 @@ class ChainFactory:
                     "When `chain_type` is `generative` "
                     "a config_obj must be provided!"
                 )
-            chain = get_conversation_chain(
+            chain = GenerativePipeline(chain=get_conversation_chain(
                 docs_dir=docs_dir,
-                config_obj=config_obj
-            )
+                config_obj=config_obj,
+                retriever=(
+                    index.as_langchain_retriever()
+                    if index is not None else None
+                )
+            ))
         elif chain_type in ["search", "snip"]:
             for kwarg in [num_return_docs, return_threshold]:
                 if kwarg is None:
@@ -39,7 +52,8 @@ class ChainFactory:
                 chain_type=chain_type,
                 content=docs_dir,
                 num_return_docs=num_return_docs,
-                return_threshold=return_threshold
+                return_threshold=return_threshold,
+                retriever=index.retriever if index is not None else None
             )
         else:
             raise ValueError(
@@ -50,10 +64,30 @@ class ChainFactory:
         return (chain, format_func)
 
 
+def update_chain_index(chain, index: Union[ShardedIndex, SharedIndex]):
+    """
+    Point a chain from ChainFactory at a new index snapshot.
+    """
+    # Look through wrappers such as AnsweringChain to the pipeline.
+    if isinstance(getattr(chain, "pipeline", chain), GenerativePipeline):
+        chain.update_retriever(index.as_langchain_retriever())
+    else:
+        chain.update_retriever(index.retriever)
+
+
+def document_sources(meta: dict) -> list[str]:
+    """
+    The files a chunk came from: its `source`, or the `sources` of all
+    near-duplicate chunks it was merged with.
+    """
+    return meta.get("sources", [meta["source"]])
+
+
 def format_conversation_chain_output(output):
     sources = list({
-        source_doc.metadata["source"]
+        source
         for source_doc in output["source_documents"]
+        for source in document_sources(source_doc.metadata)
     })
     print(
         f"\nAI Answer: {output['answer']}"
@@ -67,7 +101,7 @@ def format_search_pipeline_output(output):
         print(
             f"\nDocument {idx + 1} -- Score: {doc.score}\n"
             f"Content: {doc.content}\n"
-            f"Source: {doc.meta['source']}"
+            f"Sources: {document_sources(doc.meta)}"
         )
     return
 
@@ -78,7 +112,7 @@ def format_snip_pipeline_output(output):
             f"\nSnippet: {idx + 1} -- Score: {doc.score}\n"
             f"Content: {doc.answer}\n"
             f"context: {doc.context}\n"
-            f"Source: {doc.meta['source']}"
+            f"Sources: {document_sources(doc.meta)}"
         )
     return
 
@@ -90,6 +124,95 @@ FORMAT_FUNC_FACTORY = {
 }
 
 
+def serialize_conversation_chain_output(output):
+    source_documents = output["source_documents"]
+    return {
+        "answer": output["answer"],
+        "sources": list({
+            source
+            for source_doc in source_documents
+            for source in document_sources(source_doc.metadata)
+        }),
+        "source_documents": [
+            {"content": doc.page_content, "meta": doc.metadata}
+            for doc in source_documents
+        ]
+    }
+
+
+def serialize_search_pipeline_output(output):
+    return [
+        {
+            "content": doc.content,
+            "score": doc.score,
+            "sources": document_sources(doc.meta),
+            "meta": doc.meta
+        }
+        for doc in output
+    ]
+
+
+def serialize_snip_pipeline_output(output):
+    return [
+        {
+            "answer": doc.answer,
+            "score": doc.score,
+            "context": doc.context,
+            "sources": document_sources(doc.meta),
+            "meta": doc.meta
+        }
+        for doc in output
+    ]
+
+
+SERIALIZE_FUNC_FACTORY = {
+    "generative": serialize_conversation_chain_output,
+    "search": serialize_search_pipeline_output,
+    "snip": serialize_snip_pipeline_output
+}
+
+
+def deserialize_conversation_chain_output(payload, query=None):
+    return {
+        "question": query,
+        "chat_history": [],
+        "answer": payload["answer"],
+        "source_documents": [
+            Document(page_content=doc["content"], metadata=doc["meta"])
+            for doc in payload["source_documents"]
+        ]
+    }
+
+
+def deserialize_search_pipeline_output(payload, query=None):
+    return [
+        HS_Document(
+            content=doc["content"], score=doc["score"], meta=doc["meta"]
+        )
+        for doc in payload
+    ]
+
+
+def deserialize_snip_pipeline_output(payload, query=None):
+    return [
+        Answer(
+            answer=doc["answer"],
+            type="extractive",
+            score=doc["score"],
+            context=doc["context"],
+            meta=doc["meta"]
+        )
+        for doc in payload
+    ]
+
+
+DESERIALIZE_FUNC_FACTORY = {
+    "generative": deserialize_conversation_chain_output,
+    "search": deserialize_search_pipeline_output,
+    "snip": deserialize_snip_pipeline_output
+}
+
+
 def load_bool(value):
     if value.lower() == "true":
         return True
@@ -99,4 +222,23 @@ def load_bool(value):
 def load_none_or_str(value):
     if value == "None":
         return None
-    return value
\ No newline at end of file
+    return value
+
+
+def load_none_or_float(value):
+    if value == "None":
+        return None
+    return float(value)
+
+
+def load_none_or_list(value):
+    if value == "None":
+        return None
+    return [ele.strip() for ele in value.split(",") if ele.strip()]
+
+
+def load_none_or_json(value):
+    if value == "None":
+        return None
+    return json.loads(value)
+
@@ -3,4 +3,4 @@ Purpose: Initialize the chat subpackage of docs2chat.
 """
 
 
-from docs2chat.chat.chat import get_conversation_chain
\ No newline at end of file
+from docs2chat.chat.chat import GenerativePipeline, get_conversation_chain
\ No newline at end of file
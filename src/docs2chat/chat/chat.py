@@ -3,16 +3,38 @@ Purpose: Conversational (generative) QA functionality.
 """
 
 
+import asyncio
+from dataclasses import dataclass, field
 from langchain.chains import ConversationalRetrievalChain
 from langchain.llms import LlamaCpp
+from langchain.llms.base import BaseLLM
 from langchain.memory import ConversationBufferMemory
 from langchain.prompts import PromptTemplate
+from langchain.schema import BaseRetriever
 import logging
 import sys
+import threading
+from typing import AsyncIterator, Optional, Union
 
 
+from docs2chat.chat.utils import (
+    GenerationBudgetCallbackHandler,
+    GenerationBudgetExceeded,
+    ProfilingCallbackHandler,
+    TokenStreamCallbackHandler
+)
+from docs2chat.concurrency import (
+    BoundedExecutor,
+    current_deadline,
+    Deadline
+)
 from docs2chat.config import Config, config
 from docs2chat.preprocessing import PreProcessor
+from docs2chat.preprocessing.filters import (
+    FilteredFAISSRetriever,
+    use_filters
+)
+from docs2chat.profiling import profiler
 
 
 _logger = logging.getLogger(__name__)
@@ -43,27 +65,178 @@ PROMPT = PromptTemplate(
 def get_conversation_chain(
     docs_dir: str,
     config_obj: Config = config,
+    preprocessor: Optional[PreProcessor] = None,
+    llm: Optional[BaseLLM] = None,
+    retriever: Optional[BaseRetriever] = None
 ) -> ConversationalRetrievalChain:
-    preprocessor = PreProcessor(chain_type="generative", content=docs_dir)
-    vectorstore = preprocessor.preprocess(show_progress=False)
-    _logger.info(
-        f"Loading LLM from {config_obj.MODEL_PATH}."
-    )
+    if retriever is None:
+        if preprocessor is None:
+            preprocessor = PreProcessor(
+                chain_type="generative", content=docs_dir
+            )
+        vectorstore = preprocessor.preprocess(show_progress=False)
+        retriever = FilteredFAISSRetriever(vectorstore=vectorstore)
     memory = ConversationBufferMemory(
         memory_key="chat_history",
         return_messages=True,
         output_key="answer"
     )
-    llm = LlamaCpp(
-        model_path=config_obj.MODEL_PATH,
-        n_ctx=2048,
-        input={"temperature": 0.75, "max_length": 2000, "top_p": 1},
-        verbose=False
-    )
+    if llm is None:
+        _logger.info(
+            f"Loading LLM from {config_obj.MODEL_PATH}."
+        )
+        llm = LlamaCpp(
+            model_path=config_obj.MODEL_PATH,
+            n_ctx=2048,
+            input={"temperature": 0.75, "max_length": 2000, "top_p": 1},
+            verbose=False
+        )
     return ConversationalRetrievalChain.from_llm(
         llm=llm,
-        retriever=vectorstore.as_retriever(),
+        retriever=retriever,
         memory=memory, 
         return_source_documents=True,
         combine_docs_chain_kwargs={"prompt": PROMPT}
-    )
\ No newline at end of file
+    )
+
+
+@dataclass
+class GenerativePipeline:
+    """
+    Run a conversation chain synchronously or from asyncio code.
+
+    The chain's memory and LLM are not safe to share between threads, so
+    one query runs at a time. The async APIs run it on `executor`, which
+    defaults to a single-worker BoundedExecutor; queries wait for it on
+    the event loop without holding a thread.
+    """
+
+    chain: ConversationalRetrievalChain
+    executor: Optional[BoundedExecutor] = field(default=None)
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    def __post_init__(self):
+        if self.executor is None:
+            executor = BoundedExecutor(
+                max_workers=1, thread_name_prefix="docs2chat-generate"
+            )
+            setattr(self, "executor", executor)
+
+    @property
+    def llm(self) -> Optional[BaseLLM]:
+        llm_chain = getattr(self.chain.combine_docs_chain, "llm_chain", None)
+        return getattr(llm_chain, "llm", None)
+
+    def update_retriever(self, retriever: BaseRetriever):
+        """
+        Swap in a retriever over a new index snapshot.
+
+        Queries already running keep the retriever they started with.
+        """
+        self.chain.retriever = retriever
+
+    def __call__(self, query: str, filters: Optional[dict] = None):
+        return self.run(query=query, filters=filters)
+
+    def _can_condense(self, deadline: Deadline, query: str) -> bool:
+        """
+        Whether condensing `query` against the chat history, which
+        generates about as many tokens as the question has, is expected
+        to finish before `deadline`.
+        """
+        if deadline.expired():
+            return False
+        llm = self.llm
+        num_tokens = (
+            llm.get_num_tokens(query) if llm is not None
+            else len(query.split())
+        )
+        return deadline.can_afford("chat.token", num_tokens)
+
+    def run(
+        self,
+        query: str,
+        filters: Optional[dict] = None,
+        callbacks: Optional[list] = None
+    ) -> dict:
+        """
+        Answer `query`. Under a deadline (see `use_deadline`), generation
+        stops in time and the partial answer is returned. A follow-up
+        question is searched for as asked, rather than first condensed
+        against the chat history, when the deadline leaves no time for
+        that; the check is made once any queued query has finished.
+        """
+        callbacks = list(callbacks or [])
+        if profiler.enabled:
+            callbacks.append(ProfilingCallbackHandler(llm=self.llm))
+        budget = None
+        deadline = current_deadline()
+        if deadline is not None:
+            budget = GenerationBudgetCallbackHandler(deadline=deadline)
+            callbacks.append(budget)
+        with self._lock, use_filters(filters):
+            memory = self.chain.memory
+            chat_history = list(memory.chat_memory.messages) if memory else []
+            get_chat_history = self.chain.get_chat_history
+            skip_condense = (
+                bool(chat_history) and deadline is not None
+                and not self._can_condense(deadline, query)
+            )
+            if skip_condense:
+                deadline.degrade("chat.condense_skipped")
+                # The chain only condenses when the history is non-empty.
+                self.chain.get_chat_history = lambda history: ""
+            try:
+                return self.chain(query, callbacks=callbacks or None)
+            except GenerationBudgetExceeded:
+                output = {
+                    "question": query,
+                    "chat_history": chat_history,
+                    "answer": budget.text,
+                    "source_documents": budget.documents
+                }
+                if memory is not None:
+                    memory.save_context(
+                        {"question": query}, {"answer": output["answer"]}
+                    )
+                return output
+            finally:
+                self.chain.get_chat_history = get_chat_history
+
+    async def arun(self, query: str, filters: Optional[dict] = None) -> dict:
+        output = None
+        async for output in self.astream(query=query, filters=filters):
+            pass
+        return output
+
+    async def astream(
+        self,
+        query: str,
+        filters: Optional[dict] = None
+    ) -> AsyncIterator[Union[str, dict]]:
+        """
+        Yield answer tokens as they are generated, then the chain output.
+
+        Tokens are only streamed by LLMs that stream (e.g. LlamaCpp with
+        `streaming=True`); for others just the output is yielded. Closing
+        the iterator or cancelling the task consuming it stops generation
+        at the next token.
+        """
+        handler = TokenStreamCallbackHandler(loop=asyncio.get_running_loop())
+        task = asyncio.ensure_future(self.executor.run(
+            self.run, query=query, filters=filters, callbacks=[handler]
+        ))
+        task.add_done_callback(lambda _: handler.close())
+        try:
+            while True:
+                token = await handler.queue.get()
+                if token is None:
+                    break
+                yield token
+            yield await task
+        finally:
+            if not task.done():
+                handler.cancel()
+                task.cancel()
@@ -0,0 +1,265 @@
+"""
+Purpose: Utilities for chat subpackage of docs2chat.
+"""
+
+
+import asyncio
+from langchain.callbacks.base import BaseCallbackHandler
+import threading
+import time
+from typing import Any, Optional
+from uuid import UUID
+
+
+from docs2chat.concurrency import Deadline
+from docs2chat.profiling import profiler
+
+
+class ProfilingCallbackHandler(BaseCallbackHandler):
+    """
+    Record conversation-chain stages as profiler spans.
+
+    Sub-chains started directly by the conversation chain are named after
+    their role: the question generator (`LLMChain`) condenses the question
+    against the chat history and the combine-documents chain generates the
+    answer. Retriever runs are recorded as `chat.retrieve`. Prompt and
+    completion token counts use `llm.get_num_tokens` when an LLM is given.
+    """
+
+    STAGE_NAMES = {
+        "LLMChain": "chat.condense",
+        "StuffDocumentsChain": "chat.generate",
+        "MapReduceDocumentsChain": "chat.generate",
+        "RefineDocumentsChain": "chat.generate",
+        "MapRerankDocumentsChain": "chat.generate"
+    }
+
+    def __init__(self, llm: Optional[Any] = None):
+        self.llm = llm
+        self._root_run_id = None
+        self._spans = {}
+
+    def _count_tokens(self, name: str, text: str):
+        if self.llm is None:
+            return
+        profiler.count(name, self.llm.get_num_tokens(text))
+
+    def on_chain_start(
+        self,
+        serialized: dict[str, Any],
+        inputs: dict[str, Any],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any
+    ):
+        if parent_run_id is None:
+            self._root_run_id = run_id
+            return
+        if parent_run_id != self._root_run_id:
+            return
+        class_name = (serialized or {}).get("id", ["chain"])[-1]
+        stage = self.STAGE_NAMES.get(class_name, f"chat.{class_name.lower()}")
+        self._spans[run_id] = profiler.start_span(stage)
+
+    def on_chain_end(self, outputs: dict[str, Any], *, run_id: UUID, **kwargs):
+        profiler.end_span(self._spans.pop(run_id, None))
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        profiler.end_span(self._spans.pop(run_id, None))
+
+    def on_retriever_start(
+        self,
+        serialized: dict[str, Any],
+        query: str,
+        *,
+        run_id: UUID,
+        **kwargs: Any
+    ):
+        self._spans[run_id] = profiler.start_span("chat.retrieve")
+
+    def on_retriever_end(self, documents, *, run_id: UUID, **kwargs: Any):
+        profiler.end_span(self._spans.pop(run_id, None))
+        profiler.count("chat.candidates", len(documents))
+
+    def on_retriever_error(
+        self,
+        error: BaseException,
+        *,
+        run_id: UUID,
+        **kwargs: Any
+    ):
+        profiler.end_span(self._spans.pop(run_id, None))
+
+    def on_llm_start(
+        self,
+        serialized: dict[str, Any],
+        prompts: list[str],
+        **kwargs: Any
+    ):
+        for prompt in prompts:
+            self._count_tokens("chat.prompt_tokens", prompt)
+
+    def on_llm_end(self, response, **kwargs: Any):
+        for generations in response.generations:
+            for generation in generations:
+                self._count_tokens("chat.completion_tokens", generation.text)
+
+
+class GenerationCancelled(Exception):
+    pass
+
+
+class GenerationBudgetExceeded(GenerationCancelled):
+    pass
+
+
+class GenerateRunCallbackHandler(BaseCallbackHandler):
+    """
+    Track which chain and LLM runs generate the answer.
+
+    Those are runs under the combine-documents chain, not those of the
+    question generator; `is_generate_run` tells them apart.
+    """
+
+    GENERATE_CHAINS = {
+        class_name
+        for class_name, stage in ProfilingCallbackHandler.STAGE_NAMES.items()
+        if stage == "chat.generate"
+    }
+
+    def __init__(self):
+        self._generate_runs = set()
+
+    def is_generate_run(self, run_id: UUID) -> bool:
+        return run_id in self._generate_runs
+
+    def on_chain_start(
+        self,
+        serialized: dict[str, Any],
+        inputs: dict[str, Any],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any
+    ):
+        class_name = (serialized or {}).get("id", ["chain"])[-1]
+        if (
+            class_name in self.GENERATE_CHAINS
+            or parent_run_id in self._generate_runs
+        ):
+            self._generate_runs.add(run_id)
+
+    def on_llm_start(
+        self,
+        serialized: dict[str, Any],
+        prompts: list[str],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any
+    ):
+        if parent_run_id in self._generate_runs:
+            self._generate_runs.add(run_id)
+
+
+class TokenStreamCallbackHandler(GenerateRunCallbackHandler):
+    """
+    Forward answer tokens from a chain running in another thread to an
+    asyncio queue.
+
+    Only tokens generated under the combine-documents chain are forwarded,
+    not those of the question generator. `close` puts `None` on the queue
+    to mark the end of the stream. After `cancel`, the next callback raises
+    `GenerationCancelled`, which aborts the chain run.
+    """
+
+    raise_error = True
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        super().__init__()
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def close(self):
+        self.queue.put_nowait(None)
+
+    def _check_cancelled(self):
+        if self._cancelled.is_set():
+            raise GenerationCancelled("Generation was cancelled.")
+
+    def on_chain_start(self, *args, **kwargs):
+        self._check_cancelled()
+        super().on_chain_start(*args, **kwargs)
+
+    def on_llm_start(self, *args, **kwargs):
+        self._check_cancelled()
+        super().on_llm_start(*args, **kwargs)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any):
+        self._check_cancelled()
+        if self.is_generate_run(run_id):
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, token)
+
+
+class GenerationBudgetCallbackHandler(GenerateRunCallbackHandler):
+    """
+    Stop answer generation at `deadline`, or after its `max_tokens`.
+
+    Generation stops before the next token is expected to overrun the
+    deadline, going by the time tokens have taken so far, and does not
+    start if the deadline has already passed. Stopping raises
+    `GenerationBudgetExceeded` to abort the chain run; `text` then holds
+    the partial answer and `documents` the retrieved sources. Only LLMs
+    that stream tokens (e.g. LlamaCpp) can be stopped mid-answer.
+    """
+
+    raise_error = True
+
+    def __init__(self, deadline: Deadline):
+        super().__init__()
+        self.deadline = deadline
+        self.tokens = []
+        self.documents = []
+        self._last_token_time = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.tokens).strip()
+
+    def _stop(self, degradation: str):
+        self.deadline.degrade(degradation)
+        raise GenerationBudgetExceeded(
+            f"Generation stopped ({degradation})."
+        )
+
+    def on_retriever_end(self, documents, **kwargs: Any):
+        self.documents = list(documents)
+
+    def on_llm_start(self, *args, run_id: UUID, **kwargs):
+        super().on_llm_start(*args, run_id=run_id, **kwargs)
+        if self.is_generate_run(run_id):
+            if self.deadline.expired():
+                self._stop("chat.generate_skipped")
+            self._last_token_time = time.perf_counter()
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any):
+        if not self.is_generate_run(run_id):
+            return
+        now = time.perf_counter()
+        # The first token also waits for the prompt to be evaluated.
+        if self.tokens:
+            self.deadline.estimator.observe(
+                "chat.token", now - self._last_token_time
+            )
+        self._last_token_time = now
+        self.tokens.append(token)
+        max_tokens = self.deadline.max_tokens
+        if max_tokens is not None and len(self.tokens) >= max_tokens:
+            self._stop("chat.tokens_capped")
+        if not self.deadline.can_afford("chat.token"):
+            self._stop("chat.time_capped")
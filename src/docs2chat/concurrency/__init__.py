@@ -0,0 +1,16 @@
+"""
+Purpose: Initialize the concurrency subpackage of docs2chat.
+"""
+
+
+from docs2chat.concurrency.deadline import (
+    current_deadline,
+    Deadline,
+    LatencyEstimator,
+    stage_latency,
+    use_deadline
+)
+from docs2chat.concurrency.executor import (
+    BoundedExecutor,
+    inference_executor
+)
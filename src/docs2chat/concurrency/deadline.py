@@ -0,0 +1,149 @@
+"""
+Purpose: Per-request deadlines that pipeline stages degrade to meet.
+"""
+
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import math
+import threading
+import time
+from typing import Iterator, Optional
+
+
+from docs2chat.config import config
+from docs2chat.profiling import profiler
+
+
+_deadline = ContextVar("docs2chat_deadline", default=None)
+
+
+class LatencyEstimator:
+    """
+    Moving averages of the seconds each stage takes per item.
+
+    Pipelines time their stages with `measure` whether or not a deadline
+    is set, so estimates exist by the time one is.
+    """
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self._per_item = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float, num_items: int = 1):
+        per_item = seconds / max(num_items, 1)
+        with self._lock:
+            previous = self._per_item.get(stage)
+            if previous is None:
+                self._per_item[stage] = per_item
+            else:
+                self._per_item[stage] = (
+                    self.alpha * per_item + (1 - self.alpha) * previous
+                )
+
+    def estimate(self, stage: str, num_items: int = 1) -> Optional[float]:
+        """
+        Return the expected seconds for `num_items`, or None if `stage`
+        was never observed.
+        """
+        per_item = self._per_item.get(stage)
+        if per_item is None:
+            return None
+        return per_item * num_items
+
+    @contextmanager
+    def measure(self, stage: str, num_items: int = 1) -> Iterator[None]:
+        start = time.perf_counter()
+        yield
+        self.observe(stage, time.perf_counter() - start, num_items)
+
+
+stage_latency = LatencyEstimator()
+
+
+@dataclass
+class Deadline:
+    """
+    Time left to answer one request, and what was given up to meet it.
+
+    Stages ask how much work fits in the remaining time (going by
+    `estimator`) and degrade when it does not; each degradation is named
+    in `degradations`. `max_tokens` caps generated answer tokens
+    (`config.DEADLINE_MAX_TOKENS` by default).
+    """
+
+    seconds: float
+    max_tokens: Optional[int] = field(default=None)
+    start: float = field(default_factory=time.monotonic)
+    degradations: list[str] = field(default_factory=list)
+    estimator: LatencyEstimator = field(default=stage_latency, repr=False)
+
+    def __post_init__(self):
+        if self.max_tokens is None:
+            setattr(self, "max_tokens", config.DEADLINE_MAX_TOKENS)
+
+    @classmethod
+    def from_ms(cls, milliseconds: Optional[float]) -> Optional["Deadline"]:
+        if milliseconds is None:
+            return None
+        return cls(seconds=milliseconds / 1000)
+
+    def remaining(self) -> float:
+        return self.seconds - (time.monotonic() - self.start)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def degrade(self, name: str):
+        if name not in self.degradations:
+            self.degradations.append(name)
+            profiler.count(f"deadline.{name}")
+
+    def can_afford(
+        self,
+        stage: str,
+        num_items: int = 1,
+        reserve: float = 0
+    ) -> bool:
+        """
+        Whether `num_items` of `stage` are expected to finish in time,
+        leaving `reserve` seconds over.
+        """
+        remaining = self.remaining() - reserve
+        if remaining <= 0:
+            return False
+        estimate = self.estimator.estimate(stage, num_items)
+        return estimate is None or estimate <= remaining
+
+    def affordable_items(
+        self,
+        stage: str,
+        num_items: int,
+        min_items: int = 1,
+        reserve: float = 0
+    ) -> int:
+        """
+        The most items, up to `num_items` and at least `min_items`, that
+        `stage` is expected to process in time.
+        """
+        per_item = self.estimator.estimate(stage)
+        if not per_item:
+            return num_items
+        remaining = self.remaining() - reserve
+        fits = math.floor(remaining / per_item) if remaining > 0 else 0
+        return max(min_items, min(num_items, fits))
+
+
+@contextmanager
+def use_deadline(deadline: Optional[Deadline]) -> Iterator[None]:
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _deadline.get()
@@ -0,0 +1,104 @@
+"""
+Purpose: Run blocking model inference from asyncio code.
+"""
+
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+import os
+import threading
+from typing import Any, Callable, Optional
+import weakref
+
+
+from docs2chat.config import config
+
+
+def _release(loop, semaphore, future):
+    if not loop.is_closed():
+        loop.call_soon_threadsafe(semaphore.release)
+
+
+class BoundedExecutor:
+    """
+    Offload blocking calls from the event loop to a bounded thread pool.
+
+    At most `max_workers` calls run at once (`config.INFERENCE_WORKERS`
+    by default, or one per core when that is `null`). Further calls wait
+    on the event loop rather than in the pool's queue, so cancelling a
+    waiting call frees it immediately; a call that has already started
+    runs to completion in its thread and its result is discarded. Each
+    call runs in a copy of the caller's context, so the active profiler
+    trace and `use_filters` filters carry over to the worker thread.
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        thread_name_prefix: str = "docs2chat-inference"
+    ):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._executor = None
+        self._lock = threading.Lock()
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    @property
+    def num_workers(self) -> int:
+        if self.max_workers is not None:
+            return self.max_workers
+        return config.INFERENCE_WORKERS or os.cpu_count() or 1
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.num_workers,
+                    thread_name_prefix=self.thread_name_prefix
+                )
+            return self._executor
+
+    def _get_semaphore(self, loop) -> asyncio.Semaphore:
+        # asyncio primitives belong to one event loop, so keep one per loop.
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.num_workers)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Call `func(*args, **kwargs)` in a worker thread and await it.
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = self._get_semaphore(loop)
+        await semaphore.acquire()
+        context = contextvars.copy_context()
+        try:
+            future = self._get_executor().submit(
+                context.run, functools.partial(func, *args, **kwargs)
+            )
+        except BaseException:
+            semaphore.release()
+            raise
+        # Hold the slot until the thread is done, even if the caller is
+        # cancelled first, so the bound applies to threads actually busy.
+        future.add_done_callback(
+            functools.partial(_release, loop, semaphore)
+        )
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+inference_executor = BoundedExecutor()
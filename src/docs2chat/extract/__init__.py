@@ -3,6 +3,13 @@ Purpose: Initialize the extract subpackage of docs2chat.
 """
 
 
+from docs2chat.extract.cache import (
+    CachingRanker,
+    QueryEmbeddingCache,
+    RankScoreCache,
+    query_embedding_cache,
+    rank_score_cache
+)
 from docs2chat.extract.extract import (
     ExtractivePipeline,
     SearchExtractivePipeline,
@@ -0,0 +1,317 @@
+"""
+Purpose: Query-embedding and ranker-score caches for extractive QA.
+"""
+
+
+from collections import OrderedDict
+from copy import copy
+import functools
+from haystack.nodes import BaseRanker
+from haystack.schema import Document as HS_Document
+import numpy as np
+import re
+import sys
+import threading
+from typing import Any, Hashable, Optional, Union
+
+
+from docs2chat.concurrency import stage_latency
+from docs2chat.config import config
+from docs2chat.profiling import profiler
+
+
+# Bytes charged per entry for the key tuple and the LRU's bookkeeping.
+ENTRY_OVERHEAD_BYTES = 200
+
+
+def normalize_query(query: str) -> str:
+    """
+    Strip and collapse whitespace, which tokenizers ignore anyway.
+    """
+    return re.sub(r"\s+", " ", query).strip()
+
+
+def model_id(component: Any) -> str:
+    """
+    Name the model behind a Haystack retriever or ranker.
+    """
+    params = getattr(component, "_component_config", {}).get("params", {})
+    for key in ("model_name_or_path", "embedding_model"):
+        value = params.get(key) or getattr(component, key, None)
+        if value:
+            return str(value)
+    return type(component).__name__
+
+
+class MemoryBoundedLRU:
+    """
+    Thread-safe LRU mapping that evicts once entries exceed `max_bytes`.
+
+    `max_bytes` falls back to `config[config_key]` when it is None, read
+    on use so a config reset after import takes effect. A bound of 0
+    disables the cache.
+    """
+
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        config_key: Optional[str] = None
+    ):
+        self.max_bytes = max_bytes
+        self.config_key = config_key
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self) -> int:
+        if self.max_bytes is not None:
+            return self.max_bytes
+        if self.config_key is not None:
+            return getattr(config, self.config_key, None) or 0
+        return 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, num_bytes: int):
+        capacity = self.capacity
+        num_bytes += ENTRY_OVERHEAD_BYTES
+        if num_bytes > capacity:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.num_bytes -= previous[1]
+            self._entries[key] = (value, num_bytes)
+            self.num_bytes += num_bytes
+            while self.num_bytes > capacity:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.num_bytes -= evicted_bytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.num_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+class QueryEmbeddingCache(MemoryBoundedLRU):
+    """
+    Query embeddings keyed by (normalized query, model).
+
+    `attach` wraps a retriever's `embed_queries`, which every retriever in
+    docs2chat (Haystack's EmbeddingRetriever, ShardedRetriever) calls from
+    `retrieve` and `retrieve_batch`, so only queries missing from the
+    cache reach the encoder.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        super().__init__(
+            max_bytes=max_bytes, config_key="QUERY_EMBEDDING_CACHE_BYTES"
+        )
+
+    def embed_queries(
+        self,
+        embed_func,
+        model: str,
+        queries: list[str]
+    ) -> np.ndarray:
+        if self.capacity <= 0:
+            return embed_func(queries)
+        keys = [(normalize_query(query), model) for query in queries]
+        embeddings = {}
+        for key in keys:
+            embedding = self.get(key)
+            if embedding is not None:
+                embeddings[key] = embedding
+        missing = list(dict.fromkeys(
+            key for key in keys if key not in embeddings
+        ))
+        profiler.count(
+            "extract.embedding_cache_hits", len(keys) - len(missing)
+        )
+        if missing:
+            new_embeddings = embed_func([query for query, _ in missing])
+            for key, embedding in zip(missing, new_embeddings):
+                embedding = np.array(embedding)
+                embedding.setflags(write=False)
+                embeddings[key] = embedding
+                self.put(
+                    key,
+                    embedding,
+                    embedding.nbytes + sys.getsizeof(key[0])
+                )
+        return np.stack([embeddings[key] for key in keys])
+
+    def attach(self, retriever: Any) -> Any:
+        """
+        Route `retriever.embed_queries` through this cache, in place.
+        """
+        embed_func = getattr(retriever, "embed_queries", None)
+        if embed_func is None or getattr(embed_func, "cache", None) is self:
+            return retriever
+        # Re-attaching (e.g. another cache) wraps the original method.
+        embed_func = getattr(embed_func, "embed_func", embed_func)
+        wrapper = functools.partial(
+            self.embed_queries, embed_func, model_id(retriever)
+        )
+        wrapper.cache = self
+        wrapper.embed_func = embed_func
+        retriever.embed_queries = wrapper
+        return retriever
+
+
+class RankScoreCache(MemoryBoundedLRU):
+    """
+    Ranker scores keyed by (normalized query, document id, model).
+
+    Haystack document ids hash the document content, so a chunk edited
+    in a new index snapshot gets a new id rather than a stale score.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        super().__init__(
+            max_bytes=max_bytes, config_key="RANK_SCORE_CACHE_BYTES"
+        )
+
+
+class CachingRanker(BaseRanker):
+    """
+    Ranker that scores only (query, document) pairs missing from `cache`.
+
+    Unseen pairs are scored together in one call to the wrapped
+    `ranker`, across all queries of a `predict_batch`; each query's
+    documents are then sorted by score as it would. That call is timed
+    as `stage` in `stage_latency` per pair scored, so cache hits do not
+    lower the estimate deadlines go by.
+    """
+
+    def __init__(
+        self,
+        ranker: BaseRanker,
+        cache: Optional[RankScoreCache] = None,
+        stage: str = "extract.rank"
+    ):
+        super().__init__()
+        self.ranker = ranker
+        self.cache = rank_score_cache if cache is None else cache
+        self.model = model_id(ranker)
+        self.stage = stage
+
+    def predict(
+        self,
+        query: str,
+        documents: list[HS_Document],
+        top_k: Optional[int] = None
+    ) -> list[HS_Document]:
+        if top_k is None:
+            top_k = getattr(self.ranker, "top_k", None)
+        if self.cache.capacity <= 0:
+            with stage_latency.measure(self.stage, len(documents)):
+                return self.ranker.predict(
+                    query=query, documents=documents, top_k=top_k
+                )
+        return self._rank([query], [documents], top_k)[0]
+
+    def predict_batch(
+        self,
+        queries: list[str],
+        documents: Union[list[HS_Document], list[list[HS_Document]]],
+        top_k: Optional[int] = None,
+        batch_size: Optional[int] = None
+    ) -> Union[list[HS_Document], list[list[HS_Document]]]:
+        if top_k is None:
+            top_k = getattr(self.ranker, "top_k", None)
+        if documents and isinstance(documents[0], list):
+            if len(queries) == 1:
+                queries = queries * len(documents)
+            documents_per_query = list(documents)
+        else:
+            documents_per_query = [documents] * len(queries)
+        if self.cache.capacity <= 0:
+            return [
+                self.predict(query=query, documents=docs, top_k=top_k)
+                for query, docs in zip(queries, documents_per_query)
+            ]
+        return self._rank(queries, documents_per_query, top_k, batch_size)
+
+    def _rank(
+        self,
+        queries: list[str],
+        documents_per_query: list[list[HS_Document]],
+        top_k: Optional[int],
+        batch_size: Optional[int] = None
+    ) -> list[list[HS_Document]]:
+        query_keys = [normalize_query(query) for query in queries]
+        scores = {}
+        # Pairs to score, grouped by query: {query_key: (query, {id: doc})}.
+        missing = {}
+        num_hits = 0
+        for query, query_key, docs in zip(
+            queries, query_keys, documents_per_query
+        ):
+            for doc in docs:
+                if (query_key, doc.id) in scores:
+                    continue
+                score = self.cache.get((query_key, doc.id, self.model))
+                if score is not None:
+                    scores[(query_key, doc.id)] = score
+                    num_hits += 1
+                else:
+                    _, query_missing = missing.setdefault(
+                        query_key, (query, {})
+                    )
+                    query_missing.setdefault(doc.id, doc)
+        profiler.count("extract.rank_cache_hits", num_hits)
+        if missing:
+            groups = list(missing.items())
+            num_pairs = sum(len(docs) for _, (_, docs) in groups)
+            with stage_latency.measure(self.stage, num_pairs):
+                scored = self.ranker.predict_batch(
+                    queries=[query for _, (query, _) in groups],
+                    documents=[
+                        [copy(doc) for doc in docs.values()]
+                        for _, (_, docs) in groups
+                    ],
+                    top_k=max(len(docs) for _, (_, docs) in groups),
+                    batch_size=batch_size
+                )
+            for (query_key, _), scored_docs in zip(groups, scored):
+                for doc in scored_docs:
+                    scores[(query_key, doc.id)] = doc.score
+                    self.cache.put(
+                        (query_key, doc.id, self.model),
+                        doc.score,
+                        sys.getsizeof(query_key) + sys.getsizeof(doc.id)
+                    )
+        results = []
+        for query_key, docs in zip(query_keys, documents_per_query):
+            ranked = []
+            for doc in docs:
+                score = scores.get((query_key, doc.id))
+                if score is None:
+                    continue
+                doc = copy(doc)
+                doc.score = score
+                ranked.append(doc)
+            ranked.sort(key=lambda doc: doc.score, reverse=True)
+            results.append(ranked[:top_k])
+        return results
+
+
+query_embedding_cache = QueryEmbeddingCache()
+rank_score_cache = RankScoreCache()
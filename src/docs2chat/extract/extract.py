@@ -10,6 +10,7 @@ from haystack.nodes import (
     SentenceTransformersRanker
 )
 from haystack.pipelines import ExtractiveQAPipeline, Pipeline
+from haystack.schema import Answer
 from langchain.docstore.document import Document
 import logging
 import math
@@ -17,8 +18,23 @@ import sys
 from typing import Literal, Optional, Union
 
 
+from docs2chat.concurrency import (
+    BoundedExecutor,
+    current_deadline,
+    Deadline,
+    inference_executor,
+    stage_latency
+)
 from docs2chat.config import config
+from docs2chat.extract.cache import (
+    CachingRanker,
+    QueryEmbeddingCache,
+    query_embedding_cache,
+    rank_score_cache,
+    RankScoreCache
+)
 from docs2chat.preprocessing import PreProcessor
+from docs2chat.profiling import profiler
 from docs2chat.extract.utils import (
     _RankerReaderProtocol,
     _HaystackPipelineProtocol,
@@ -36,10 +52,47 @@ _console_handler.setFormatter(_formatter)
 _logger.addHandler(_console_handler)
 
 
+def _fit_candidates(
+    deadline: Optional[Deadline],
+    stage: str,
+    top_k: int,
+    min_k: int
+) -> int:
+    """
+    Shrink the number of candidates to retrieve so that `stage` is
+    expected to process them before `deadline`.
+    """
+    if deadline is None:
+        return top_k
+    reserve = deadline.estimator.estimate("extract.retrieve") or 0
+    fitted = deadline.affordable_items(
+        stage, top_k, min_items=min_k, reserve=reserve
+    )
+    if fitted < top_k:
+        deadline.degrade("extract.fewer_candidates")
+    return fitted
+
+
+def _answers_from_documents(documents: list) -> list[Answer]:
+    return [
+        Answer(
+            answer=doc.content,
+            type="other",
+            score=doc.score,
+            context=doc.content,
+            document_ids=[doc.id],
+            meta=dict(doc.meta)
+        )
+        for doc in documents
+    ]
+
+
 @dataclass
 class SnipExtractivePipeline:
 
     content: InitVar[Optional[str]] = field(default=None)
+    embedding_cache: Optional[QueryEmbeddingCache] = field(default=None)
+    executor: Optional[BoundedExecutor] = field(default=None)
     hs_pipeline: Optional[_HaystackPipelineProtocol] = field(default=None)
     preprocessor: Optional[PreProcessor] = field(default=None)
     num_return_docs: int = field(default=4)
@@ -48,27 +101,33 @@ class SnipExtractivePipeline:
     return_threshold: float = field(default=0)
 
     def __post_init__(self, content):
+        if self.embedding_cache is None:
+            setattr(self, "embedding_cache", query_embedding_cache)
+        if self.executor is None:
+            setattr(self, "executor", inference_executor)
         if self.hs_pipeline is None:
-            if self.preprocessor is None:
-                _logger.info(
-                    "PreProcessor was not passed. "
-                    "Initializing a PreProcessor object."
-                )
-                preprocessor = PreProcessor(
-                    chain_type="snip",
-                    content=content
-                )
-                setattr(self, "preprocessor", preprocessor)
-            if not hasattr(self.preprocessor, "vectorstore"):
-                _logger.info(
-                    "No vectorstore detected."
-                )
-                self.preprocessor.preprocess(
-                    return_vectorstore=False,
-                    show_progress=False,
-                    store_vectorstore=True
-                )
+            # A retriever over an existing index (e.g. a SharedIndex) needs
+            # no preprocessing of its own.
             if self.retriever is None:
+                if self.preprocessor is None:
+                    _logger.info(
+                        "PreProcessor was not passed. "
+                        "Initializing a PreProcessor object."
+                    )
+                    preprocessor = PreProcessor(
+                        chain_type="snip",
+                        content=content
+                    )
+                    setattr(self, "preprocessor", preprocessor)
+                if not hasattr(self.preprocessor, "vectorstore"):
+                    _logger.info(
+                        "No vectorstore detected."
+                    )
+                    self.preprocessor.preprocess(
+                        return_vectorstore=False,
+                        show_progress=False,
+                        store_vectorstore=True
+                    )
                 _logger.info(
                     "Generating a HS Retriever."
                 )
@@ -77,7 +136,9 @@ class SnipExtractivePipeline:
                     embedding_model=config.EMBEDDING_DIR
                 )
                 setattr(self, "retriever", retriever)
-                self.preprocessor.vectorstore.update_embeddings(retriever)
+                self.preprocessor.vectorstore.update_embeddings(
+                    retriever, update_existing_embeddings=False
+                )
             if self.reader is None:
                 _logger.info(
                     "Generating a HS Reader."
@@ -90,25 +151,128 @@ class SnipExtractivePipeline:
             _logger.info(
                 "Constructing snip pipeline."
             )
-            hs_pipeline = ExtractiveQAPipeline(reader, retriever)
+            hs_pipeline = ExtractiveQAPipeline(self.reader, self.retriever)
             setattr(self, "hs_pipeline", hs_pipeline)
+        if self.retriever is not None:
+            self.embedding_cache.attach(self.retriever)
+
+    def update_retriever(self, retriever: _HaystackRetrieverProtocol):
+        """
+        Swap in a retriever over a new index snapshot.
+
+        Queries already running keep the retriever they started with.
+        """
+        self.embedding_cache.attach(retriever)
+        hs_pipeline = ExtractiveQAPipeline(self.reader, retriever)
+        self.hs_pipeline = hs_pipeline
+        self.retriever = retriever
     
-    def __call__(self, query: str):
-        return self.run(query=query)
+    def __call__(self, query: str, filters: Optional[dict] = None):
+        return self.run(query=query, filters=filters)
+
+    async def arun(
+        self,
+        query: str,
+        filters: Optional[dict] = None
+    ) -> list:
+        """
+        Run the pipeline on `executor` without blocking the event loop.
+        """
+        return await self.executor.run(self.run, query=query, filters=filters)
     
-    def run(self, query: str) -> tuple[Document, float]:
-        results = self.hs_pipeline.run(
-            query=query,
-            params={
-                "Retriever": {
-                    "top_k": min(100, math.floor((1.5 * self.num_return_docs)))
-                },
-                "Reader": {"top_k": self.num_return_docs}
-            }
-        )
+    def run(
+        self,
+        query: str,
+        filters: Optional[dict] = None
+    ) -> tuple[Document, float]:
+        top_k_retriever = min(100, math.floor((1.5 * self.num_return_docs)))
+        # Read once, so a concurrent index swap cannot mix snapshots.
+        retriever = self.retriever
+        read_skipped = False
+        if retriever is None or self.reader is None:
+            with profiler.span("extract.pipeline"):
+                answers = self.hs_pipeline.run(
+                    query=query,
+                    params={
+                        "Retriever": {
+                            "top_k": top_k_retriever,
+                            "filters": filters
+                        },
+                        "Reader": {"top_k": self.num_return_docs}
+                    }
+                )["answers"]
+        else:
+            deadline = current_deadline()
+            top_k_retriever = _fit_candidates(
+                deadline, "extract.read", top_k_retriever, self.num_return_docs
+            )
+            with stage_latency.measure("extract.retrieve"):
+                with profiler.span("extract.retrieve"):
+                    candidates = retriever.retrieve(
+                        query=query, top_k=top_k_retriever, filters=filters
+                    )
+            profiler.count("extract.candidates", len(candidates))
+            if deadline is not None and not deadline.can_afford(
+                "extract.read", len(candidates)
+            ):
+                # Answer with whole passages, in retriever order.
+                deadline.degrade("extract.read_skipped")
+                read_skipped = True
+                answers = _answers_from_documents(
+                    candidates[:self.num_return_docs]
+                )
+            else:
+                with stage_latency.measure("extract.read", len(candidates)):
+                    with profiler.span("extract.read"):
+                        answers = self.reader.run(
+                            query=query,
+                            documents=candidates,
+                            top_k=self.num_return_docs
+                        )[0]["answers"]
+        if read_skipped:
+            # Retriever scores are not on the reader's scale, so
+            # `return_threshold` does not apply to them.
+            results = answers
+        else:
+            results = [
+                result for result in answers
+                if result.score >= self.return_threshold
+            ]
+        profiler.count("extract.results", len(results))
+        return results
+
+    def run_batch(
+        self,
+        queries: list[str],
+        filters: Optional[dict] = None
+    ) -> list[list]:
+        """
+        Answer several queries, embedding and reading them in batches.
+        """
+        retriever = self.retriever
+        if retriever is None or self.reader is None:
+            return [
+                self.run(query=query, filters=filters) for query in queries
+            ]
+        top_k_retriever = min(100, math.floor((1.5 * self.num_return_docs)))
+        with profiler.span("extract.retrieve"):
+            candidates = retriever.retrieve_batch(
+                queries=queries, top_k=top_k_retriever, filters=filters
+            )
+        # `run_batch`, unlike `predict_batch`, copies each document's meta
+        # onto its answers, as `run` does.
+        with profiler.span("extract.read"):
+            answers = self.reader.run_batch(
+                queries=queries,
+                documents=candidates,
+                top_k=self.num_return_docs
+            )[0]["answers"]
         return [
-            result for result in results["answers"]
-            if result.score >= self.return_threshold
+            [
+                result for result in query_answers
+                if result.score >= self.return_threshold
+            ]
+            for query_answers in answers
         ]
 
 
@@ -116,35 +280,44 @@ class SnipExtractivePipeline:
 class SearchExtractivePipeline:
     
     content: InitVar[Optional[str]] = field(default=None)
+    embedding_cache: Optional[QueryEmbeddingCache] = field(default=None)
+    executor: Optional[BoundedExecutor] = field(default=None)
     hs_pipeline: Optional[_HaystackPipelineProtocol] = field(default=None)
     preprocessor: Optional[PreProcessor] = field(default=None)
     num_return_docs: int = field(default=4)
     ranker: Optional[_RankerReaderProtocol] = field(default=None)
     retriever: Optional[_HaystackRetrieverProtocol] = field(default=None)
     return_threshold: float = field(default=0)
+    score_cache: Optional[RankScoreCache] = field(default=None)
 
     def __post_init__(self, content):
+        if self.embedding_cache is None:
+            setattr(self, "embedding_cache", query_embedding_cache)
+        if self.executor is None:
+            setattr(self, "executor", inference_executor)
         if self.hs_pipeline is None:
-            if self.preprocessor is None:
-                _logger.info(
-                    "PreProcessor was not passed. "
-                    "Initializing a PreProcessor object."
-                )
-                preprocessor = PreProcessor(
-                    chain_type="search",
-                    content=content
-                )
-                setattr(self, "preprocessor", preprocessor)
-            if not hasattr(self.preprocessor, "vectorstore"):
-                _logger.info(
-                    "No vectorstore detected."
-                )
-                self.preprocessor.preprocess(
-                    return_vectorstore=False,
-                    show_progress=False,
-                    store_vectorstore=True
-                )
+            # A retriever over an existing index (e.g. a SharedIndex) needs
+            # no preprocessing of its own.
             if self.retriever is None:
+                if self.preprocessor is None:
+                    _logger.info(
+                        "PreProcessor was not passed. "
+                        "Initializing a PreProcessor object."
+                    )
+                    preprocessor = PreProcessor(
+                        chain_type="search",
+                        content=content
+                    )
+                    setattr(self, "preprocessor", preprocessor)
+                if not hasattr(self.preprocessor, "vectorstore"):
+                    _logger.info(
+                        "No vectorstore detected."
+                    )
+                    self.preprocessor.preprocess(
+                        return_vectorstore=False,
+                        show_progress=False,
+                        store_vectorstore=True
+                    )
                 _logger.info(
                     "Generating a HS Retriever."
                 )
@@ -153,7 +326,9 @@ class SearchExtractivePipeline:
                     embedding_model=config.EMBEDDING_DIR
                 )
                 setattr(self, "retriever", retriever)
-                self.preprocessor.vectorstore.update_embeddings(retriever)
+                self.preprocessor.vectorstore.update_embeddings(
+                    retriever, update_existing_embeddings=False
+                )
             if self.ranker is None:
                 _logger.info(
                     "Generating a HS Ranker."
@@ -166,29 +341,139 @@ class SearchExtractivePipeline:
             _logger.info(
                 "Constructing search pipeline."
             )
-            hs_pipeline = Pipeline()
-            hs_pipeline.add_node(
-                component=self.retriever, name="Retriever", inputs=["Query"])
-            hs_pipeline.add_node(
-                component=self.ranker, name="Ranker", inputs=["Retriever"])
+        if self.score_cache is None:
+            setattr(self, "score_cache", rank_score_cache)
+        if self.ranker is not None and not isinstance(
+            self.ranker, CachingRanker
+        ):
+            ranker = CachingRanker(ranker=self.ranker, cache=self.score_cache)
+            setattr(self, "ranker", ranker)
+        if self.hs_pipeline is None:
+            hs_pipeline = self._build_hs_pipeline(self.retriever)
             setattr(self, "hs_pipeline", hs_pipeline)
+        if self.retriever is not None:
+            self.embedding_cache.attach(self.retriever)
+
+    def _build_hs_pipeline(self, retriever):
+        hs_pipeline = Pipeline()
+        hs_pipeline.add_node(
+            component=retriever, name="Retriever", inputs=["Query"])
+        hs_pipeline.add_node(
+            component=self.ranker, name="Ranker", inputs=["Retriever"])
+        return hs_pipeline
+
+    def update_retriever(self, retriever: _HaystackRetrieverProtocol):
+        """
+        Swap in a retriever over a new index snapshot.
+
+        Queries already running keep the retriever they started with.
+        """
+        self.embedding_cache.attach(retriever)
+        self.hs_pipeline = self._build_hs_pipeline(retriever)
+        self.retriever = retriever
     
-    def __call__(self, query: str):
-        return self.run(query=query)
+    def __call__(self, query: str, filters: Optional[dict] = None):
+        return self.run(query=query, filters=filters)
+
+    async def arun(
+        self,
+        query: str,
+        filters: Optional[dict] = None
+    ) -> list:
+        """
+        Run the pipeline on `executor` without blocking the event loop.
+        """
+        return await self.executor.run(self.run, query=query, filters=filters)
     
-    def run(self, query: str) -> tuple[Document, float]:
-        results = self.hs_pipeline.run(
-            query=query,
-            params={
-                "Retriever": {
-                    "top_k": min(100, math.floor((1.5 * self.num_return_docs)))
-                },
-                "Ranker": {"top_k": self.num_return_docs}
-            }
-        )
+    def run(
+        self,
+        query: str,
+        filters: Optional[dict] = None
+    ) -> tuple[Document, float]:
+        top_k_retriever = min(100, math.floor((1.5 * self.num_return_docs)))
+        # Read once, so a concurrent index swap cannot mix snapshots.
+        retriever = self.retriever
+        rank_skipped = False
+        if retriever is None or self.ranker is None:
+            with profiler.span("extract.pipeline"):
+                documents = self.hs_pipeline.run(
+                    query=query,
+                    params={
+                        "Retriever": {
+                            "top_k": top_k_retriever,
+                            "filters": filters
+                        },
+                        "Ranker": {"top_k": self.num_return_docs}
+                    }
+                )["documents"]
+        else:
+            deadline = current_deadline()
+            top_k_retriever = _fit_candidates(
+                deadline, "extract.rank", top_k_retriever, self.num_return_docs
+            )
+            with stage_latency.measure("extract.retrieve"):
+                with profiler.span("extract.retrieve"):
+                    candidates = retriever.retrieve(
+                        query=query, top_k=top_k_retriever, filters=filters
+                    )
+            profiler.count("extract.candidates", len(candidates))
+            if deadline is not None and not deadline.can_afford(
+                "extract.rank", len(candidates)
+            ):
+                deadline.degrade("extract.rank_skipped")
+                rank_skipped = True
+                documents = candidates[:self.num_return_docs]
+            else:
+                # The ranker times the pairs it scores itself: cached
+                # scores cost next to nothing.
+                with profiler.span("extract.rank"):
+                    documents = self.ranker.run(
+                        query=query,
+                        documents=candidates,
+                        top_k=self.num_return_docs
+                    )[0]["documents"]
+        if rank_skipped:
+            # Retriever scores are not on the ranker's scale, so
+            # `return_threshold` does not apply to them.
+            results = documents
+        else:
+            results = [
+                result for result in documents
+                if result.score >= self.return_threshold
+            ]
+        profiler.count("extract.results", len(results))
+        return results
+
+    def run_batch(
+        self,
+        queries: list[str],
+        filters: Optional[dict] = None
+    ) -> list[list]:
+        """
+        Answer several queries, embedding and ranking them in batches.
+        """
+        retriever = self.retriever
+        if retriever is None or self.ranker is None:
+            return [
+                self.run(query=query, filters=filters) for query in queries
+            ]
+        top_k_retriever = min(100, math.floor((1.5 * self.num_return_docs)))
+        with profiler.span("extract.retrieve"):
+            candidates = retriever.retrieve_batch(
+                queries=queries, top_k=top_k_retriever, filters=filters
+            )
+        with profiler.span("extract.rank"):
+            documents = self.ranker.predict_batch(
+                queries=queries,
+                documents=candidates,
+                top_k=self.num_return_docs
+            )
         return [
-            result for result in results["documents"]
-            if result.score >= self.return_threshold
+            [
+                result for result in query_documents
+                if result.score >= self.return_threshold
+            ]
+            for query_documents in documents
         ]
 
 
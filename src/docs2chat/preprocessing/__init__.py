@@ -3,4 +3,11 @@ Purpose: Initialize pipeline subpackge of docs2chat.
 """
 
 
-from docs2chat.preprocessing.preprocessing import PreProcessor
\ No newline at end of file
+from docs2chat.preprocessing.dedup import MinHashDeduplicator
+from docs2chat.preprocessing.docstore import NumpyDocumentStore
+from docs2chat.preprocessing.embedding import CorpusEmbedder
+from docs2chat.preprocessing.index import SharedIndex
+from docs2chat.preprocessing.preprocessing import PreProcessor
+from docs2chat.preprocessing.shards import ShardedIndex
+from docs2chat.preprocessing.text_splitter import TokenTextSplitter
+from docs2chat.preprocessing.watcher import IndexWatcher
\ No newline at end of file
@@ -0,0 +1,208 @@
+"""
+Purpose: Near-duplicate chunk elimination for preprocessing subpackage.
+"""
+
+
+from dataclasses import dataclass, field
+from langchain.docstore.document import Document
+import logging
+import numpy as np
+import sys
+import zlib
+
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.INFO)
+_formatter = logging.Formatter(
+    "%(asctime)s:%(levelname)s:%(module)s: %(message)s"
+)
+_console_handler = logging.StreamHandler(sys.stdout)
+_console_handler.setFormatter(_formatter)
+_logger.addHandler(_console_handler)
+
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+@dataclass
+class DedupStats:
+    """
+    Index and embedding-work reduction achieved by deduplication.
+    """
+
+    num_chunks_in: int = field(default=0)
+    num_chunks_out: int = field(default=0)
+    num_chars_in: int = field(default=0)
+    num_chars_out: int = field(default=0)
+
+    def summary(self) -> str:
+        removed = self.num_chunks_in - self.num_chunks_out
+        chunk_pct = 100 * removed / max(self.num_chunks_in, 1)
+        char_pct = (
+            100 * (self.num_chars_in - self.num_chars_out)
+            / max(self.num_chars_in, 1)
+        )
+        return (
+            f"Collapsed {removed} near-duplicate chunks: index shrank from "
+            f"{self.num_chunks_in} to {self.num_chunks_out} chunks "
+            f"(-{chunk_pct:.1f}%), embedding work from {self.num_chars_in} "
+            f"to {self.num_chars_out} characters (-{char_pct:.1f}%)."
+        )
+
+
+class _UnionFind:
+
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, idx: int) -> int:
+        while self.parent[idx] != idx:
+            self.parent[idx] = self.parent[self.parent[idx]]
+            idx = self.parent[idx]
+        return idx
+
+    def union(self, idx: int, other: int):
+        root, other_root = self.find(idx), self.find(other)
+        # Keep the earliest chunk as the root so it becomes the survivor.
+        if root < other_root:
+            self.parent[other_root] = root
+        elif other_root < root:
+            self.parent[root] = other_root
+
+
+@dataclass
+class MinHashDeduplicator:
+    """
+    Collapse near-duplicate chunks using MinHash signatures and LSH.
+
+    Chunks are shingled into overlapping word n-grams and summarized by
+    `num_perm` MinHash values. Signatures are split into `num_bands` LSH
+    bands and only chunks sharing a band bucket are compared; pairs whose
+    estimated Jaccard similarity reaches `threshold` are merged. The first
+    chunk of each group is kept, with the sources of every copy recorded
+    under its `sources` metadata key.
+    """
+
+    threshold: float = field(default=0.8)
+    num_perm: int = field(default=128)
+    num_bands: int = field(default=32)
+    shingle_size: int = field(default=5)
+    seed: int = field(default=1)
+    stats: DedupStats = field(default_factory=DedupStats)
+
+    def __post_init__(self):
+        if self.num_perm % self.num_bands:
+            raise ValueError(
+                "`num_perm` must be divisible by `num_bands`."
+            )
+        if not 0 < self.threshold <= 1:
+            raise ValueError("`threshold` must be in (0, 1].")
+        generator = np.random.RandomState(self.seed)
+        setattr(self, "_perm_a", generator.randint(
+            1, _MERSENNE_PRIME, size=self.num_perm, dtype=np.uint64
+        ))
+        setattr(self, "_perm_b", generator.randint(
+            0, _MERSENNE_PRIME, size=self.num_perm, dtype=np.uint64
+        ))
+
+    def _shingle_hashes(self, text: str) -> np.ndarray:
+        words = text.lower().split()
+        if len(words) <= self.shingle_size:
+            shingles = {" ".join(words)}
+        else:
+            shingles = {
+                " ".join(words[idx:idx + self.shingle_size])
+                for idx in range(len(words) - self.shingle_size + 1)
+            }
+        return np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+            dtype=np.uint64,
+            count=len(shingles)
+        )
+
+    def signatures(self, texts: list[str]) -> np.ndarray:
+        """
+        Return a (len(texts), num_perm) array of MinHash signatures.
+        """
+        signatures = np.empty((len(texts), self.num_perm), dtype=np.uint64)
+        for idx, text in enumerate(texts):
+            hashes = self._shingle_hashes(text)
+            # Overflow in the multiply is intentional (as in datasketch).
+            with np.errstate(over="ignore"):
+                permuted = (
+                    (np.outer(hashes, self._perm_a) + self._perm_b)
+                    % _MERSENNE_PRIME
+                ) & _MAX_HASH
+            signatures[idx] = permuted.min(axis=0)
+        return signatures
+
+    def find_duplicates(self, texts: list[str]) -> list[int]:
+        """
+        Return, for every text, the index of the text it collapses into.
+        """
+        signatures = self.signatures(texts)
+        rows = self.num_perm // self.num_bands
+        union_find = _UnionFind(len(texts))
+        for band in range(self.num_bands):
+            band_values = signatures[:, band * rows:(band + 1) * rows]
+            buckets = {}
+            for idx, key in enumerate(map(bytes, band_values)):
+                buckets.setdefault(key, []).append(idx)
+            for members in buckets.values():
+                if len(members) < 2:
+                    continue
+                # Compare against one representative per cluster found in
+                # the bucket, so large boilerplate buckets stay linear.
+                representatives = [members[0]]
+                for other in members[1:]:
+                    for representative in representatives:
+                        if union_find.find(representative) == (
+                            union_find.find(other)
+                        ):
+                            break
+                        similarity = np.mean(
+                            signatures[representative] == signatures[other]
+                        )
+                        if similarity >= self.threshold:
+                            union_find.union(representative, other)
+                            break
+                    else:
+                        representatives.append(other)
+        return [union_find.find(idx) for idx in range(len(texts))]
+
+    def deduplicate(self, docs: list[Document]) -> list[Document]:
+        docs = list(docs)
+        roots = self.find_duplicates([doc.page_content for doc in docs])
+        groups = {}
+        for idx, root in enumerate(roots):
+            groups.setdefault(root, []).append(idx)
+
+        deduped = []
+        for root, members in groups.items():
+            doc = docs[root]
+            if len(members) > 1:
+                sources = []
+                for idx in members:
+                    source = docs[idx].metadata.get("source")
+                    if source is not None and source not in sources:
+                        sources.append(source)
+                metadata = {
+                    **doc.metadata,
+                    "sources": sources,
+                    "num_duplicates": len(members) - 1
+                }
+                doc = Document(page_content=doc.page_content, metadata=metadata)
+            deduped.append(doc)
+
+        self.stats.num_chunks_in += len(docs)
+        self.stats.num_chunks_out += len(deduped)
+        self.stats.num_chars_in += sum(len(doc.page_content) for doc in docs)
+        self.stats.num_chars_out += sum(
+            len(doc.page_content) for doc in deduped
+        )
+        _logger.info(self.stats.summary())
+        return deduped
+
+    def reset_stats(self):
+        setattr(self, "stats", DedupStats())
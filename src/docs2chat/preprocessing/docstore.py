@@ -0,0 +1,752 @@
+"""
+Purpose: In-memory NumPy document store for small and medium corpora.
+"""
+
+
+from haystack.document_stores import BaseDocumentStore
+from haystack.errors import DocumentStoreError, DuplicateDocumentError
+from haystack.schema import Document as HS_Document
+import json
+import logging
+import numpy as np
+import os
+from pathlib import Path
+import sys
+import threading
+from typing import Any, Iterable, Iterator, Optional, Union
+import zipfile
+
+
+from docs2chat.preprocessing.filters import MetadataFilterIndex
+
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.INFO)
+_formatter = logging.Formatter(
+    "%(asctime)s:%(levelname)s:%(module)s: %(message)s"
+)
+_console_handler = logging.StreamHandler(sys.stdout)
+_console_handler.setFormatter(_formatter)
+_logger.addHandler(_console_handler)
+
+
+_MISSING = object()
+
+
+class StringColumn:
+    """
+    A column of strings stored as one UTF-8 buffer plus offsets.
+
+    Strings appended or replaced after construction are kept aside until
+    `pack` merges them into the buffer. Items are decoded on access, so a
+    column loaded from a memory-mapped buffer costs no Python objects.
+    """
+
+    def __init__(
+        self,
+        buffer: Optional[np.ndarray] = None,
+        offsets: Optional[np.ndarray] = None
+    ):
+        self.buffer = (
+            np.zeros(0, dtype=np.uint8) if buffer is None else buffer
+        )
+        self.offsets = (
+            np.zeros(1, dtype=np.int64) if offsets is None else offsets
+        )
+        self._tail = []
+        self._replaced = {}
+
+    @classmethod
+    def from_strings(cls, strings: Iterable[str]) -> "StringColumn":
+        column = cls()
+        column.extend(strings)
+        column.pack()
+        return column
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1 + len(self._tail)
+
+    def __getitem__(self, position: int) -> str:
+        num_packed = len(self.offsets) - 1
+        if position >= num_packed:
+            return self._tail[position - num_packed]
+        if position in self._replaced:
+            return self._replaced[position]
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return self.buffer[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for position in range(len(self)):
+            yield self[position]
+
+    def extend(self, strings: Iterable[str]):
+        self._tail.extend(strings)
+
+    def set(self, position: int, value: str):
+        num_packed = len(self.offsets) - 1
+        if position >= num_packed:
+            self._tail[position - num_packed] = value
+        else:
+            self._replaced[int(position)] = value
+
+    def pack(self):
+        if self._replaced:
+            packed = StringColumn.from_strings(list(self))
+            self.buffer, self.offsets = packed.buffer, packed.offsets
+            self._tail, self._replaced = [], {}
+            return
+        if not self._tail:
+            return
+        encoded = [string.encode("utf-8") for string in self._tail]
+        lengths = np.fromiter(
+            (len(ele) for ele in encoded), dtype=np.int64, count=len(encoded)
+        )
+        self.offsets = np.concatenate(
+            [self.offsets, self.offsets[-1] + np.cumsum(lengths)]
+        )
+        self.buffer = np.concatenate([
+            self.buffer, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        ])
+        self._tail = []
+
+    def take(self, positions: Iterable[int]) -> "StringColumn":
+        return StringColumn.from_strings(self[idx] for idx in positions)
+
+
+def _mmap_npz_member(path: Path, name: str) -> np.ndarray:
+    """
+    Memory-map one array of an uncompressed `.npz` file.
+    """
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(f"{name}.npy")
+        if info.compress_type != zipfile.ZIP_STORED:
+            raise ValueError(f"`{name}` in {path} is compressed.")
+    with open(path, "rb") as f:
+        f.seek(info.header_offset)
+        local_header = f.read(30)
+        name_length = int.from_bytes(local_header[26:28], "little")
+        extra_length = int.from_bytes(local_header[28:30], "little")
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(f)
+        else:
+            header = np.lib.format.read_array_header_2_0(f)
+        shape, fortran_order, dtype = header
+        offset = f.tell()
+    if not shape or 0 in shape:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(
+        path,
+        dtype=dtype,
+        mode="r",
+        offset=offset,
+        shape=shape,
+        order="F" if fortran_order else "C"
+    )
+
+
+class NumpyDocumentStore(BaseDocumentStore):
+    """
+    Document store holding a corpus in NumPy arrays, for corpora of up to a
+    few hundred thousand chunks.
+
+    Embeddings live in one contiguous float32 matrix (normalized when
+    `similarity` is `cosine`), so a query is a single matrix-vector product
+    plus `argpartition`, and `query_by_embedding_batch` answers many
+    queries with one matrix product. Ids and contents are StringColumns
+    and metadata is kept as one list per key, so results are assembled
+    without any database round-trip. Filters are evaluated by a
+    MetadataFilterIndex over row positions, rebuilt lazily after writes.
+
+    `save` writes everything to a single uncompressed `.npz` file; `load`
+    memory-maps its arrays, so opening a large store reads only what
+    queries touch. Holds a single index: the `index` arguments of the
+    Haystack API are accepted and ignored. Labels are not supported:
+    `write_labels` raises a DocumentStoreError.
+    """
+
+    def __init__(
+        self,
+        embedding_dim: int = 384,
+        similarity: str = "cosine",
+        return_embedding: bool = False,
+        duplicate_documents: str = "overwrite",
+        index: str = "document",
+        progress_bar: bool = False
+    ):
+        super().__init__()
+        if similarity not in ("cosine", "dot_product"):
+            raise ValueError(
+                "`similarity` must be one of `cosine` or `dot_product`."
+            )
+        if duplicate_documents not in ("skip", "overwrite", "fail"):
+            raise ValueError(
+                "`duplicate_documents` must be one of `skip`, `overwrite` "
+                "or `fail`."
+            )
+        self.embedding_dim = embedding_dim
+        self.similarity = similarity
+        self.return_embedding = return_embedding
+        self.duplicate_documents = duplicate_documents
+        self.index = index
+        self.progress_bar = progress_bar
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self._count = 0
+        self._embeddings = np.zeros((0, self.embedding_dim), dtype=np.float32)
+        self._has_embedding = np.zeros(0, dtype=bool)
+        self._ids = StringColumn()
+        self._contents = StringColumn()
+        self._meta = {}
+        self._positions = None
+        self._filter_index = None
+
+    def _prepare_embedding(self, embedding) -> np.ndarray:
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if embedding.shape[0] != self.embedding_dim:
+            raise ValueError(
+                f"Embedding dimension {embedding.shape[0]} does not match "
+                f"the store's `embedding_dim` of {self.embedding_dim}."
+            )
+        if self.similarity == "cosine":
+            norm = np.linalg.norm(embedding)
+            if norm > 0:
+                embedding = embedding / norm
+        return embedding
+
+    def _reserve(self, num_rows: int):
+        capacity = self._embeddings.shape[0]
+        if num_rows <= capacity and self._embeddings.flags.writeable:
+            return
+        new_capacity = max(num_rows, 2 * capacity, 1024)
+        embeddings = np.zeros(
+            (new_capacity, self.embedding_dim), dtype=np.float32
+        )
+        embeddings[:self._count] = self._embeddings[:self._count]
+        has_embedding = np.zeros(new_capacity, dtype=bool)
+        has_embedding[:self._count] = self._has_embedding[:self._count]
+        self._embeddings = embeddings
+        self._has_embedding = has_embedding
+
+    def _get_positions(self) -> dict[str, int]:
+        positions = self._positions
+        if positions is None:
+            positions = {
+                doc_id: position for position, doc_id in enumerate(self._ids)
+            }
+            self._positions = positions
+        return positions
+
+    def _get_meta(self, position: int) -> dict:
+        return {
+            key: column[position]
+            for key, column in self._meta.items()
+            if column[position] is not _MISSING
+        }
+
+    def _set_meta(self, position: int, meta: dict):
+        for key, column in self._meta.items():
+            column[position] = meta.get(key, _MISSING)
+        for key, value in meta.items():
+            if key not in self._meta:
+                column = [_MISSING] * self._count
+                column[position] = value
+                self._meta[key] = column
+
+    def _get_document(
+        self,
+        position: int,
+        return_embedding: bool = False,
+        score: Optional[float] = None
+    ) -> HS_Document:
+        embedding = None
+        if return_embedding and self._has_embedding[position]:
+            embedding = np.array(self._embeddings[position])
+        return HS_Document(
+            content=self._contents[position],
+            id=self._ids[position],
+            meta=self._get_meta(position),
+            embedding=embedding,
+            score=score
+        )
+
+    def _get_filter_index(self) -> MetadataFilterIndex:
+        with self._lock:
+            filter_index = self._filter_index
+            if filter_index is None:
+                filter_index = MetadataFilterIndex(
+                    (self._get_meta(position) for position in
+                     range(self._count)),
+                    num_positions=self._count
+                )
+                self._filter_index = filter_index
+        return filter_index
+
+    def _filter_mask(self, filters: Optional[dict]) -> np.ndarray:
+        if not filters:
+            return np.ones(self._count, dtype=bool)
+        return self._get_filter_index().mask(filters)
+
+    def _invalidate(self):
+        self._filter_index = None
+
+    def write_documents(
+        self,
+        documents: Union[list[dict], list[HS_Document]],
+        index: Optional[str] = None,
+        batch_size: int = 10_000,
+        duplicate_documents: Optional[str] = None,
+        headers: Optional[dict] = None
+    ):
+        duplicate_documents = duplicate_documents or self.duplicate_documents
+        documents = [
+            HS_Document.from_dict(doc) if isinstance(doc, dict) else doc
+            for doc in documents
+        ]
+        with self._lock:
+            positions = self._get_positions()
+            new_docs = {}
+            for doc in documents:
+                if doc.id in positions or doc.id in new_docs:
+                    if duplicate_documents == "fail":
+                        raise DuplicateDocumentError(
+                            f"Document with id '{doc.id}' already exists."
+                        )
+                    if duplicate_documents == "skip":
+                        continue
+                if doc.id in positions:
+                    self._overwrite(positions[doc.id], doc)
+                else:
+                    new_docs[doc.id] = doc
+            self._append(list(new_docs.values()))
+            self._invalidate()
+
+    def _overwrite(self, position: int, doc: HS_Document):
+        self._reserve(self._count)
+        self._contents.set(position, doc.content)
+        self._set_meta(position, doc.meta or {})
+        if doc.embedding is not None:
+            self._embeddings[position] = self._prepare_embedding(
+                doc.embedding
+            )
+            self._has_embedding[position] = True
+        else:
+            self._embeddings[position] = 0
+            self._has_embedding[position] = False
+
+    def _append(self, docs: list[HS_Document]):
+        if not docs:
+            return
+        start = self._count
+        self._reserve(start + len(docs))
+        for offset, doc in enumerate(docs):
+            if doc.embedding is not None:
+                self._embeddings[start + offset] = self._prepare_embedding(
+                    doc.embedding
+                )
+                self._has_embedding[start + offset] = True
+        self._ids.extend(doc.id for doc in docs)
+        self._contents.extend(doc.content for doc in docs)
+        self._ids.pack()
+        self._contents.pack()
+        for column in self._meta.values():
+            column.extend([_MISSING] * len(docs))
+        self._count = start + len(docs)
+        positions = self._get_positions()
+        for offset, doc in enumerate(docs):
+            positions[doc.id] = start + offset
+            self._set_meta(start + offset, doc.meta or {})
+
+    def update_embeddings(
+        self,
+        retriever,
+        index: Optional[str] = None,
+        update_existing_embeddings: bool = True,
+        filters: Optional[dict] = None,
+        batch_size: int = 10_000
+    ):
+        """
+        Embed documents with `retriever.embed_documents`.
+
+        Only documents without an embedding are embedded unless
+        `update_existing_embeddings` is set.
+        """
+        with self._lock:
+            mask = self._filter_mask(filters)
+            if not update_existing_embeddings:
+                mask &= ~self._has_embedding[:self._count]
+            positions = np.flatnonzero(mask)
+            if len(positions) == 0:
+                return
+            _logger.info(
+                f"Updating embeddings for {len(positions)} docs."
+            )
+            self._reserve(self._count)
+            for idx in range(0, len(positions), batch_size):
+                batch = positions[idx:idx + batch_size]
+                embeddings = retriever.embed_documents(
+                    [self._get_document(position) for position in batch]
+                )
+                for position, embedding in zip(batch, embeddings):
+                    self._embeddings[position] = self._prepare_embedding(
+                        embedding
+                    )
+                self._has_embedding[batch] = True
+
+    def update_document_meta(
+        self,
+        id: str,
+        meta: dict[str, Any],
+        index: Optional[str] = None,
+        headers: Optional[dict] = None
+    ):
+        with self._lock:
+            position = self._get_positions()[id]
+            new_meta = self._get_meta(position)
+            new_meta.update(meta)
+            self._set_meta(position, new_meta)
+            self._invalidate()
+
+    def get_document_count(
+        self,
+        filters: Optional[dict] = None,
+        index: Optional[str] = None,
+        only_documents_without_embedding: bool = False,
+        headers: Optional[dict] = None
+    ) -> int:
+        mask = self._filter_mask(filters)
+        if only_documents_without_embedding:
+            mask &= ~self._has_embedding[:self._count]
+        return int(mask.sum())
+
+    def get_embedding_count(
+        self,
+        index: Optional[str] = None,
+        filters: Optional[dict] = None
+    ) -> int:
+        return int(
+            (self._filter_mask(filters)
+             & self._has_embedding[:self._count]).sum()
+        )
+
+    def get_all_documents_generator(
+        self,
+        index: Optional[str] = None,
+        filters: Optional[dict] = None,
+        return_embedding: Optional[bool] = None,
+        batch_size: int = 10_000,
+        headers: Optional[dict] = None
+    ) -> Iterator[HS_Document]:
+        if return_embedding is None:
+            return_embedding = self.return_embedding
+        for position in np.flatnonzero(self._filter_mask(filters)):
+            yield self._get_document(position, return_embedding)
+
+    def get_all_documents(
+        self,
+        index: Optional[str] = None,
+        filters: Optional[dict] = None,
+        return_embedding: Optional[bool] = None,
+        batch_size: int = 10_000,
+        headers: Optional[dict] = None
+    ) -> list[HS_Document]:
+        return list(self.get_all_documents_generator(
+            index=index, filters=filters, return_embedding=return_embedding
+        ))
+
+    def get_documents_by_id(
+        self,
+        ids: list[str],
+        index: Optional[str] = None,
+        batch_size: int = 10_000,
+        headers: Optional[dict] = None
+    ) -> list[HS_Document]:
+        positions = self._get_positions()
+        return [
+            self._get_document(positions[doc_id], self.return_embedding)
+            for doc_id in ids if doc_id in positions
+        ]
+
+    def get_document_by_id(
+        self,
+        id: str,
+        index: Optional[str] = None,
+        headers: Optional[dict] = None
+    ) -> Optional[HS_Document]:
+        documents = self.get_documents_by_id([id])
+        return documents[0] if documents else None
+
+    def _top_k(
+        self,
+        scores: np.ndarray,
+        top_k: int,
+        return_embedding: bool,
+        scale_score: bool
+    ) -> list[HS_Document]:
+        num_candidates = int(np.isfinite(scores).sum())
+        top_k = min(top_k, num_candidates)
+        if top_k <= 0:
+            return []
+        if top_k < len(scores):
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        documents = []
+        for position in top:
+            score = float(scores[position])
+            if scale_score:
+                score = self.scale_to_unit_interval(score, self.similarity)
+            documents.append(self._get_document(
+                position, return_embedding, score=score
+            ))
+        return documents
+
+    def query_by_embedding(
+        self,
+        query_emb: np.ndarray,
+        filters: Optional[dict] = None,
+        top_k: int = 10,
+        index: Optional[str] = None,
+        return_embedding: Optional[bool] = None,
+        headers: Optional[dict] = None,
+        scale_score: bool = True
+    ) -> list[HS_Document]:
+        return self.query_by_embedding_batch(
+            [query_emb],
+            filters=filters,
+            top_k=top_k,
+            return_embedding=return_embedding,
+            scale_score=scale_score
+        )[0]
+
+    def query_by_embedding_batch(
+        self,
+        query_embs: Union[list[np.ndarray], np.ndarray],
+        filters: Optional[Union[dict, list[Optional[dict]]]] = None,
+        top_k: int = 10,
+        index: Optional[str] = None,
+        return_embedding: Optional[bool] = None,
+        headers: Optional[dict] = None,
+        scale_score: bool = True
+    ) -> list[list[HS_Document]]:
+        if return_embedding is None:
+            return_embedding = self.return_embedding
+        if isinstance(filters, list):
+            if len(filters) != len(query_embs):
+                raise ValueError(
+                    "Pass one filter per query embedding or a single filter."
+                )
+        else:
+            filters = [filters] * len(query_embs)
+        count = self._count
+        query_matrix = np.stack([
+            self._prepare_embedding(query_emb) for query_emb in query_embs
+        ])
+        # One matrix product scores every query against every document.
+        score_matrix = (self._embeddings[:count] @ query_matrix.T).T
+        valid = self._has_embedding[:count]
+        results = []
+        for scores, query_filters in zip(score_matrix, filters):
+            mask = valid & self._filter_mask(query_filters)[:count]
+            scores = np.where(mask, scores, -np.inf)
+            results.append(
+                self._top_k(scores, top_k, return_embedding, scale_score)
+            )
+        return results
+
+    def delete_documents(
+        self,
+        index: Optional[str] = None,
+        ids: Optional[list[str]] = None,
+        filters: Optional[dict] = None,
+        headers: Optional[dict] = None
+    ):
+        with self._lock:
+            delete = self._filter_mask(filters)
+            if ids is not None:
+                id_mask = np.zeros(self._count, dtype=bool)
+                positions = self._get_positions()
+                id_mask[[
+                    positions[doc_id] for doc_id in ids if doc_id in positions
+                ]] = True
+                delete &= id_mask
+            keep = np.flatnonzero(~delete)
+            self._embeddings = self._embeddings[keep]
+            self._has_embedding = self._has_embedding[keep]
+            self._ids = self._ids.take(keep)
+            self._contents = self._contents.take(keep)
+            self._meta = {
+                key: [column[position] for position in keep]
+                for key, column in self._meta.items()
+            }
+            self._count = len(keep)
+            self._positions = None
+            self._invalidate()
+
+    def delete_index(self, index: str):
+        with self._lock:
+            self._clear()
+
+    def get_all_labels(
+        self,
+        index: Optional[str] = None,
+        filters: Optional[dict] = None,
+        headers: Optional[dict] = None
+    ) -> list:
+        return []
+
+    def get_label_count(
+        self,
+        index: Optional[str] = None,
+        headers: Optional[dict] = None
+    ) -> int:
+        return 0
+
+    def write_labels(
+        self,
+        labels,
+        index: Optional[str] = None,
+        headers: Optional[dict] = None
+    ):
+        raise DocumentStoreError(
+            "NumpyDocumentStore does not store labels."
+        )
+
+    def delete_labels(
+        self,
+        index: Optional[str] = None,
+        ids: Optional[list[str]] = None,
+        filters: Optional[dict] = None,
+        headers: Optional[dict] = None
+    ):
+        return
+
+    def _create_document_field_map(self) -> dict:
+        return {}
+
+    def copy(self) -> "NumpyDocumentStore":
+        """
+        Return a new store holding a copy of this store's documents and
+        vectors.
+
+        The packed id and content buffers are shared rather than copied,
+        since neither store ever writes into them; the embeddings and
+        metadata columns are copied.
+        """
+        with self._lock:
+            self._ids.pack()
+            self._contents.pack()
+            document_store = NumpyDocumentStore(
+                embedding_dim=self.embedding_dim,
+                similarity=self.similarity,
+                return_embedding=self.return_embedding,
+                duplicate_documents=self.duplicate_documents,
+                index=self.index,
+                progress_bar=self.progress_bar
+            )
+            document_store._count = self._count
+            document_store._embeddings = np.array(
+                self._embeddings[:self._count]
+            )
+            document_store._has_embedding = np.array(
+                self._has_embedding[:self._count]
+            )
+            document_store._ids = StringColumn(
+                self._ids.buffer, self._ids.offsets
+            )
+            document_store._contents = StringColumn(
+                self._contents.buffer, self._contents.offsets
+            )
+            document_store._meta = {
+                key: list(column) for key, column in self._meta.items()
+            }
+        return document_store
+
+    def save(self, path: Union[str, Path]):
+        """
+        Write the store to a single uncompressed `.npz` file.
+        """
+        path = Path(path)
+        with self._lock:
+            self._ids.pack()
+            self._contents.pack()
+            meta = {
+                key: [
+                    {"value": value} if value is not _MISSING else None
+                    for value in column
+                ]
+                for key, column in self._meta.items()
+            }
+            store_config = {
+                "embedding_dim": self.embedding_dim,
+                "similarity": self.similarity,
+                "return_embedding": self.return_embedding,
+                "duplicate_documents": self.duplicate_documents,
+                "index": self.index
+            }
+            arrays = {
+                "embeddings": np.ascontiguousarray(
+                    self._embeddings[:self._count]
+                ),
+                "has_embedding": self._has_embedding[:self._count],
+                "ids_buffer": self._ids.buffer,
+                "ids_offsets": self._ids.offsets,
+                "contents_buffer": self._contents.buffer,
+                "contents_offsets": self._contents.offsets,
+                "meta": np.frombuffer(
+                    json.dumps(meta, default=str).encode("utf-8"),
+                    dtype=np.uint8
+                ),
+                "config": np.frombuffer(
+                    json.dumps(store_config).encode("utf-8"), dtype=np.uint8
+                )
+            }
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(
+        cls,
+        path: Union[str, Path],
+        mmap: bool = True
+    ) -> "NumpyDocumentStore":
+        """
+        Load a store written by `save`, memory-mapping its arrays.
+
+        A memory-mapped store is copied into memory on its first write.
+        """
+        path = Path(path)
+        if mmap:
+            def read(name):
+                return _mmap_npz_member(path, name)
+        else:
+            arrays = np.load(path)
+
+            def read(name):
+                return arrays[name]
+        store_config = json.loads(read("config").tobytes().decode("utf-8"))
+        document_store = cls(**store_config)
+        document_store._embeddings = read("embeddings")
+        document_store._has_embedding = read("has_embedding")
+        document_store._count = len(document_store._has_embedding)
+        document_store._ids = StringColumn(
+            read("ids_buffer"), read("ids_offsets")
+        )
+        document_store._contents = StringColumn(
+            read("contents_buffer"), read("contents_offsets")
+        )
+        meta = json.loads(read("meta").tobytes().decode("utf-8"))
+        document_store._meta = {
+            key: [
+                value["value"] if value is not None else _MISSING
+                for value in column
+            ]
+            for key, column in meta.items()
+        }
+        return document_store
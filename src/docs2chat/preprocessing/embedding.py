@@ -0,0 +1,295 @@
+"""
+Purpose: Length-sorted, multi-process corpus embedding for preprocessing.
+"""
+
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import logging
+import multiprocessing
+import numpy as np
+import os
+import sys
+import time
+from transformers import AutoTokenizer
+from typing import Any, Optional
+
+
+from docs2chat.config import config
+from docs2chat.preprocessing.utils import load_max_seq_length
+
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.INFO)
+_formatter = logging.Formatter(
+    "%(asctime)s:%(levelname)s:%(module)s: %(message)s"
+)
+_console_handler = logging.StreamHandler(sys.stdout)
+_console_handler.setFormatter(_formatter)
+_logger.addHandler(_console_handler)
+
+
+# Tokens (batch size x padded length) per forward pass. Larger batches stop
+# paying off on CPU well before they do on GPU.
+CPU_TOKENS_PER_BATCH = 8192
+GPU_TOKENS_PER_BATCH_PER_GIB = 4096
+
+_WORKER_MODEL = None
+
+
+def _load_model(model_dir: str, device: Optional[str] = None):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_dir, device=device)
+
+
+def _init_worker(model_dir: str, device: Optional[str], num_threads: int):
+    import torch
+    global _WORKER_MODEL
+    torch.set_num_threads(num_threads)
+    _WORKER_MODEL = _load_model(model_dir, device=device)
+
+
+def _encode_batch(texts: list[str]) -> np.ndarray:
+    return _WORKER_MODEL.encode(
+        texts,
+        batch_size=len(texts),
+        convert_to_numpy=True,
+        show_progress_bar=False
+    )
+
+
+def retriever_model(retriever: Any) -> Optional[Any]:
+    """
+    Return the SentenceTransformer a Haystack EmbeddingRetriever embeds
+    queries with, or None if it has none.
+    """
+    encoder = getattr(retriever, "embedding_encoder", None)
+    model = getattr(encoder, "embedding_model", None)
+    if not hasattr(model, "encode") or not hasattr(model, "tokenizer"):
+        return None
+    return model
+
+
+def _detect_device() -> tuple[str, int]:
+    """
+    Return the device to encode on and its tokens-per-batch budget.
+    """
+    import torch
+    if torch.cuda.is_available():
+        total_gib = torch.cuda.get_device_properties(0).total_memory / 2 ** 30
+        return "cuda", int(GPU_TOKENS_PER_BATCH_PER_GIB * total_gib)
+    return "cpu", CPU_TOKENS_PER_BATCH
+
+
+@dataclass
+class EmbeddingStats:
+    num_chunks: int = field(default=0)
+    num_batches: int = field(default=0)
+    seconds: float = field(default=0.0)
+    num_tokens: int = field(default=0)
+    num_padded_tokens: int = field(default=0)
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.num_chunks / max(self.seconds, 1e-12)
+
+    def summary(self) -> str:
+        padding_pct = 100 * (
+            1 - self.num_tokens / max(self.num_padded_tokens, 1)
+        )
+        return (
+            f"Embedded {self.num_chunks} chunks in {self.num_batches} batches "
+            f"in {self.seconds:.1f}s ({self.chunks_per_second:.1f} "
+            f"chunks/sec, {padding_pct:.1f}% padding)."
+        )
+
+
+@dataclass
+class CorpusEmbedder:
+    """
+    Embed a corpus of chunks in length-sorted batches across processes.
+
+    Chunks are sorted by token length so each batch pads to a similar
+    length, and batch sizes are chosen to fill a tokens-per-batch budget
+    sized for the device. With `num_workers` > 1 the batches are spread
+    over a pool of spawned processes, each holding its own copy of the
+    model; vectors are returned in the original chunk order. Implements
+    the LangChain embeddings interface.
+    """
+
+    model_dir: str = field(default=config.EMBEDDING_DIR)
+    num_workers: int = field(default=1)
+    device: Optional[str] = field(default=None)
+    tokens_per_batch: Optional[int] = field(default=None)
+    max_batch_size: int = field(default=256)
+    model: Optional[Any] = field(default=None)
+    tokenizer: Optional[Any] = field(default=None)
+    max_seq_length: Optional[int] = field(default=None)
+    stats: EmbeddingStats = field(default_factory=EmbeddingStats)
+
+    def __post_init__(self):
+        if self.num_workers < 1:
+            raise ValueError("`num_workers` must be at least 1.")
+        if self.device is None or self.tokens_per_batch is None:
+            device, tokens_per_batch = _detect_device()
+            if self.device is None:
+                setattr(self, "device", device)
+            if self.tokens_per_batch is None:
+                setattr(self, "tokens_per_batch", tokens_per_batch)
+        if self.tokenizer is None:
+            if self.model is not None:
+                setattr(self, "tokenizer", self.model.tokenizer)
+            else:
+                tokenizer = AutoTokenizer.from_pretrained(
+                    self.model_dir, use_fast=True
+                )
+                setattr(self, "tokenizer", tokenizer)
+        if self.max_seq_length is None:
+            if self.model is not None:
+                max_seq_length = self.model.max_seq_length
+            else:
+                max_seq_length = load_max_seq_length(
+                    self.model_dir, self.tokenizer
+                )
+            setattr(self, "max_seq_length", max_seq_length)
+
+    def _get_model(self):
+        if self.model is None:
+            _logger.info(
+                f"Loading embedding model from {self.model_dir}."
+            )
+            setattr(self, "model", _load_model(self.model_dir, self.device))
+        return self.model
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Kept across calls so workers load the model once per ingest.
+        executor = getattr(self, "_executor", None)
+        if executor is None:
+            num_threads = max(1, (os.cpu_count() or 1) // self.num_workers)
+            executor = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_dir, self.device, num_threads)
+            )
+            setattr(self, "_executor", executor)
+        return executor
+
+    def close(self):
+        """
+        Shut down the worker processes, if any.
+        """
+        executor = getattr(self, "_executor", None)
+        if executor is not None:
+            executor.shutdown()
+            setattr(self, "_executor", None)
+
+    def release(self):
+        """
+        Shut down the worker processes and drop the model, which is
+        loaded again if the embedder is used again.
+        """
+        self.close()
+        setattr(self, "model", None)
+
+    def token_lengths(self, texts: list[str]) -> np.ndarray:
+        input_ids = self.tokenizer(
+            texts,
+            truncation=True,
+            max_length=self.max_seq_length,
+            return_attention_mask=False,
+            return_token_type_ids=False
+        )["input_ids"]
+        return np.fromiter(
+            (len(ids) for ids in input_ids), dtype=np.int64, count=len(texts)
+        )
+
+    def plan_batches(self, lengths: np.ndarray) -> list[np.ndarray]:
+        """
+        Group chunk indices, sorted by length, into padding-efficient batches.
+        """
+        order = np.argsort(-lengths, kind="stable")
+        sorted_lengths = -lengths[order]
+        batches = []
+        start = 0
+        while start < len(order):
+            # The longest chunk of a sorted run sets its padded length.
+            padded_length = max(int(lengths[order[start]]), 1)
+            batch_size = max(
+                1,
+                min(self.max_batch_size, self.tokens_per_batch // padded_length)
+            )
+            # Close the batch early rather than pad chunks to over twice
+            # their length.
+            end = np.searchsorted(
+                sorted_lengths, -(padded_length // 2), side="left"
+            )
+            end = max(start + 1, min(start + batch_size, int(end)))
+            batches.append(order[start:end])
+            start = end
+        return batches
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """
+        Return a (len(texts), dim) float32 array of embeddings.
+        """
+        texts = list(texts)
+        if not texts:
+            dim = self._get_model().get_sentence_embedding_dimension()
+            return np.zeros((0, dim), dtype=np.float32)
+        start_time = time.perf_counter()
+        lengths = self.token_lengths(texts)
+        batches = self.plan_batches(lengths)
+        batch_texts = [[texts[idx] for idx in batch] for batch in batches]
+
+        if self.num_workers == 1:
+            model = self._get_model()
+            results = [
+                model.encode(
+                    texts_,
+                    batch_size=len(texts_),
+                    convert_to_numpy=True,
+                    show_progress_bar=False
+                )
+                for texts_ in batch_texts
+            ]
+        else:
+            results = list(
+                self._get_executor().map(_encode_batch, batch_texts)
+            )
+
+        embeddings = np.empty(
+            (len(texts), results[0].shape[1]), dtype=np.float32
+        )
+        for batch, result in zip(batches, results):
+            embeddings[batch] = result
+
+        self.stats.num_chunks += len(texts)
+        self.stats.num_batches += len(batches)
+        self.stats.seconds += time.perf_counter() - start_time
+        self.stats.num_tokens += int(lengths.sum())
+        self.stats.num_padded_tokens += sum(
+            len(batch) * int(lengths[batch].max()) for batch in batches
+        )
+        _logger.info(self.stats.summary())
+        return embeddings
+
+    def embed_haystack_documents(self, docs: list) -> list:
+        """
+        Set the `embedding` of each Haystack document in place.
+        """
+        embeddings = self.embed([doc.content for doc in docs])
+        for doc, embedding in zip(docs, embeddings):
+            doc.embedding = embedding
+        return docs
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embed(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._get_model().encode(
+            text, convert_to_numpy=True, show_progress_bar=False
+        ).tolist()
+
+    def reset_stats(self):
+        setattr(self, "stats", EmbeddingStats())
@@ -0,0 +1,726 @@
+"""
+Purpose: Metadata filters evaluated against precomputed id sets and pushed
+down into FAISS searches.
+"""
+
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from copy import copy
+import faiss
+from haystack.document_stores import FAISSDocumentStore
+from haystack.schema import Document as HS_Document
+import inspect
+import json
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.docstore.document import Document
+from langchain.schema import BaseRetriever
+import numpy as np
+from pathlib import Path
+from pydantic import PrivateAttr
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+import threading
+from typing import Any, Iterable, Optional, Union
+import uuid
+import weakref
+
+
+from docs2chat.preprocessing.utils import restore_file_metadata
+
+
+# Filters for the query being handled, read by LangChain retrievers, which
+# cannot take per-call arguments through a chain.
+_query_filters = ContextVar("docs2chat_query_filters", default=None)
+
+
+@contextmanager
+def use_filters(filters: Optional[dict]):
+    token = _query_filters.set(filters)
+    try:
+        yield
+    finally:
+        _query_filters.reset(token)
+
+
+def current_filters() -> Optional[dict]:
+    return _query_filters.get()
+
+
+# Metadata key naming the fields FilteredFAISSDocumentStore wrote to SQL as
+# JSON strings.
+JSON_META_FIELDS_KEY = "_json_fields"
+
+
+def encode_sql_meta(meta: dict) -> dict:
+    """
+    JSON-encode the list and dict values of `meta`, which Haystack's SQL
+    document store may drop, naming them under JSON_META_FIELDS_KEY.
+    """
+    json_fields = [
+        key for key, value in meta.items() if isinstance(value, (list, dict))
+    ]
+    if not json_fields:
+        return dict(meta)
+    meta = {
+        key: json.dumps(value) if key in json_fields else value
+        for key, value in meta.items()
+    }
+    meta[JSON_META_FIELDS_KEY] = json.dumps(json_fields)
+    return meta
+
+
+def decode_sql_meta(meta: dict) -> dict:
+    """
+    Undo `encode_sql_meta`.
+    """
+    json_fields = meta.get(JSON_META_FIELDS_KEY)
+    if json_fields is None:
+        return meta
+    meta = dict(meta)
+    del meta[JSON_META_FIELDS_KEY]
+    for key in json.loads(json_fields):
+        if isinstance(meta.get(key), str):
+            meta[key] = json.loads(meta[key])
+    return meta
+
+
+# Every FilteredFAISSDocumentStore, so their SQL connections can be handled
+# around os.fork().
+_document_stores = weakref.WeakSet()
+
+
+def prepare_stores_for_fork(directory: Union[str, Path]):
+    """
+    Close the SQL connections of every FilteredFAISSDocumentStore before
+    forking, moving in-memory databases to files in `directory`.
+    """
+    for document_store in list(_document_stores):
+        document_store.prepare_fork(directory)
+
+
+def reopen_stores_after_fork():
+    """
+    Drop the SQL connections every FilteredFAISSDocumentStore inherited
+    across fork, so the child opens its own.
+    """
+    for document_store in list(_document_stores):
+        document_store.reopen_after_fork()
+
+
+def _hashable(value):
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+class MetadataFilterIndex:
+    """
+    Precomputed id sets over the metadata of a FAISS index's vectors.
+
+    Built from one metadata dict per FAISS position. Every scalar (or list
+    element) metadata value maps to the sorted positions holding it, and
+    numeric fields are also kept as a dense column for range comparisons.
+    `bitmap` evaluates a filter to a packed little-endian bitmap that
+    `search_params` wraps in a FAISS IDSelectorBitmap, so the search only
+    visits matching vectors. Evaluated bitmaps are cached per filter.
+
+    Filters follow the Haystack syntax: a dict is an AND over its keys;
+    `$and`, `$or` and `$not` combine sub-filters; a field maps to a value
+    (equality), a list (any of) or a dict of `$eq`, `$ne`, `$in`, `$nin`,
+    `$gt`, `$gte`, `$lt` and `$lte` comparisons.
+    """
+
+    def __init__(
+        self,
+        metadata: Iterable[Optional[dict]],
+        num_positions: Optional[int] = None,
+        cache_size: int = 128
+    ):
+        metadata = list(metadata)
+        self.num_positions = (
+            len(metadata) if num_positions is None else num_positions
+        )
+        self.cache_size = cache_size
+        id_lists = {}
+        numeric_lists = {}
+        valid = np.zeros(self.num_positions, dtype=bool)
+        for position, meta in enumerate(metadata):
+            if meta is None:
+                continue
+            valid[position] = True
+            for key, value in meta.items():
+                values = value if isinstance(value, list) else [value]
+                for ele in values:
+                    if isinstance(ele, dict):
+                        continue
+                    id_lists.setdefault(key, {}).setdefault(
+                        _hashable(ele), []
+                    ).append(position)
+                if (
+                    isinstance(value, (int, float))
+                    and not isinstance(value, bool)
+                ):
+                    numeric_lists.setdefault(key, {})[position] = value
+        self._valid = valid
+        self._id_sets = {
+            key: {
+                value: np.asarray(positions, dtype=np.int64)
+                for value, positions in values.items()
+            }
+            for key, values in id_lists.items()
+        }
+        self._numeric = {}
+        for key, values in numeric_lists.items():
+            column = np.full(self.num_positions, np.nan)
+            column[list(values)] = list(values.values())
+            self._numeric[key] = column
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _eq_mask(self, key: str, value) -> np.ndarray:
+        mask = np.zeros(self.num_positions, dtype=bool)
+        positions = self._id_sets.get(key, {}).get(_hashable(value))
+        if positions is not None:
+            mask[positions] = True
+        return mask
+
+    def _in_mask(self, key: str, values: list) -> np.ndarray:
+        mask = np.zeros(self.num_positions, dtype=bool)
+        for value in values:
+            positions = self._id_sets.get(key, {}).get(_hashable(value))
+            if positions is not None:
+                mask[positions] = True
+        return mask
+
+    def _range_mask(self, key: str, operator: str, value) -> np.ndarray:
+        column = self._numeric.get(key)
+        if column is None:
+            return np.zeros(self.num_positions, dtype=bool)
+        with np.errstate(invalid="ignore"):
+            if operator == "$gt":
+                return column > value
+            if operator == "$gte":
+                return column >= value
+            if operator == "$lt":
+                return column < value
+            return column <= value
+
+    def _field_mask(self, key: str, condition) -> np.ndarray:
+        if isinstance(condition, list):
+            return self._in_mask(key, condition)
+        if not isinstance(condition, dict):
+            return self._eq_mask(key, condition)
+        mask = self._valid.copy()
+        for operator, value in condition.items():
+            if operator == "$eq":
+                mask &= self._eq_mask(key, value)
+            elif operator == "$ne":
+                mask &= ~self._eq_mask(key, value)
+            elif operator == "$in":
+                mask &= self._in_mask(key, value)
+            elif operator == "$nin":
+                mask &= ~self._in_mask(key, value)
+            elif operator in ("$gt", "$gte", "$lt", "$lte"):
+                mask &= self._range_mask(key, operator, value)
+            else:
+                raise ValueError(f"Unsupported filter operator `{operator}`.")
+        return mask
+
+    def mask(self, filters) -> np.ndarray:
+        """
+        Return a boolean mask over FAISS positions matching `filters`.
+        """
+        if isinstance(filters, list):
+            mask = self._valid.copy()
+            for sub_filters in filters:
+                mask &= self.mask(sub_filters)
+            return mask
+        mask = self._valid.copy()
+        for key, condition in filters.items():
+            if key == "$and":
+                mask &= self.mask(condition)
+            elif key == "$or":
+                sub_filters = (
+                    condition if isinstance(condition, list)
+                    else [{k: v} for k, v in condition.items()]
+                )
+                any_mask = np.zeros(self.num_positions, dtype=bool)
+                for sub_filter in sub_filters:
+                    any_mask |= self.mask(sub_filter)
+                mask &= any_mask
+            elif key == "$not":
+                mask &= ~self.mask(condition)
+            else:
+                mask &= self._field_mask(key, condition)
+        return mask
+
+    def bitmap(self, filters: dict) -> np.ndarray:
+        """
+        Return the packed little-endian bitmap of positions matching
+        `filters`, as expected by `faiss.IDSelectorBitmap`.
+        """
+        cache_key = json.dumps(filters, sort_keys=True, default=str)
+        with self._lock:
+            bitmap = self._cache.get(cache_key)
+            if bitmap is not None:
+                self._cache.move_to_end(cache_key)
+                return bitmap
+        bitmap = np.packbits(self.mask(filters), bitorder="little")
+        with self._lock:
+            self._cache[cache_key] = bitmap
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return bitmap
+
+    def search_params(self, index, filters: dict):
+        """
+        Return FAISS search parameters restricting `index` to `filters`,
+        or None when nothing matches.
+        """
+        bitmap = self.bitmap(filters)
+        if not bitmap.any():
+            return None
+        selector = faiss.IDSelectorBitmap(
+            self.num_positions, faiss.swig_ptr(bitmap)
+        )
+        # The selector does not own the bitmap; keep it alive with it.
+        selector.bitmap_ref = bitmap
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            params = faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+        else:
+            params = faiss.SearchParameters(sel=selector)
+        params.selector_ref = selector
+        return params
+
+
+class FilteredFAISSDocumentStore(FAISSDocumentStore):
+    """
+    FAISSDocumentStore whose `query_by_embedding` honors metadata filters.
+
+    Filters are evaluated by a MetadataFilterIndex over vector ids and
+    passed to the FAISS search as an id selector, rather than over-fetching
+    and filtering the results. The filter index is rebuilt lazily after
+    documents or embeddings change, from the metadata of documents as they
+    were written rather than as read back from SQL, which may not keep
+    numeric values. Documents this store did not write (e.g. of a loaded
+    snapshot) have their file metadata types restored instead. List and
+    dict values (e.g. `folders`, or `sources` of deduplicated chunks) are
+    written to SQL as JSON strings and decoded when documents are read.
+
+    The store can be queried from several threads at once: each thread
+    gets its own SQL session, and an in-memory SQLite database is opened
+    in shared-cache mode so every thread's connection sees the same data.
+
+    SQLite connections must not be used on both sides of os.fork(): the
+    child would share the parent's file descriptors and locks, and an
+    in-memory database exists only in the process that opened it. A
+    pre-fork server calls `prepare_fork` in the parent, which moves an
+    in-memory database to a file and closes every connection, and
+    `reopen_after_fork` in each child, which discards any connection the
+    child inherited. Each process then opens its own connections to the
+    file, whose pages the OS shares between them.
+    """
+
+    MEMORY_SQL_URLS = ("sqlite://", "sqlite:///", "sqlite:///:memory:")
+
+    def __init__(self, *args, **kwargs):
+        if kwargs.get("sql_url") in self.MEMORY_SQL_URLS:
+            kwargs["sql_url"] = (
+                f"sqlite:///file:docs2chat-{uuid.uuid4().hex}"
+                "?mode=memory&cache=shared&uri=true"
+            )
+        super().__init__(*args, **kwargs)
+        engine = self.session.get_bind()
+        self.session.close()
+        self.session = scoped_session(sessionmaker(bind=engine))
+        self._filter_indexes = {}
+        self._filter_lock = threading.Lock()
+        self._written_meta = {}
+        _document_stores.add(self)
+
+    # Haystack reads the component config from the `__init__` signature.
+    __init__.__signature__ = inspect.signature(FAISSDocumentStore.__init__)
+
+    def prepare_fork(self, directory: Union[str, Path]):
+        """
+        Close this store's SQL connections ahead of os.fork(), first
+        backing an in-memory database up to a file in `directory`.
+        """
+        engine = self.session.get_bind()
+        self.session.remove()
+        if engine.url.query.get("mode") == "memory":
+            path = Path(directory) / f"{engine.url.database[5:]}.db"
+            file_engine = create_engine(f"sqlite:///{path.absolute()}")
+            source = engine.raw_connection()
+            target = file_engine.raw_connection()
+            try:
+                source.connection.backup(target.connection)
+            finally:
+                target.close()
+                source.close()
+            engine.dispose()
+            engine = file_engine
+        engine.dispose()
+        self.session = scoped_session(sessionmaker(bind=engine))
+
+    def reopen_after_fork(self):
+        """
+        Forget the SQL connections inherited from the parent, without
+        closing them under it, so this process opens its own.
+        """
+        engine = self.session.get_bind()
+        engine.dispose(close=False)
+        self.session = scoped_session(sessionmaker(bind=engine))
+
+    def _invalidate_filter_index(self, index: Optional[str] = None):
+        with self._filter_lock:
+            self._filter_indexes.pop(index or self.index, None)
+
+    def filter_index(self, index: Optional[str] = None) -> MetadataFilterIndex:
+        index = index or self.index
+        with self._filter_lock:
+            filter_index = self._filter_indexes.get(index)
+            if filter_index is None:
+                written_meta = self._written_meta.get(index, {})
+                num_positions = self.faiss_indexes[index].ntotal
+                metadata = [None] * num_positions
+                live_meta = {}
+                for doc in self.get_all_documents(
+                    index=index, return_embedding=False
+                ):
+                    vector_id = doc.meta.get("vector_id")
+                    if vector_id is None:
+                        continue
+                    meta = written_meta.get(doc.id)
+                    if meta is None:
+                        meta = restore_file_metadata(dict(doc.meta))
+                        meta.pop("vector_id")
+                    else:
+                        live_meta[doc.id] = meta
+                    metadata[int(vector_id)] = meta
+                self._written_meta[index] = live_meta
+                filter_index = MetadataFilterIndex(
+                    metadata, num_positions=num_positions
+                )
+                self._filter_indexes[index] = filter_index
+        return filter_index
+
+    def write_documents(
+        self,
+        documents: list,
+        index: Optional[str] = None,
+        **kwargs
+    ):
+        duplicate_documents = (
+            kwargs.get("duplicate_documents") or self.duplicate_documents
+        )
+        if duplicate_documents == "overwrite" and all(
+            isinstance(doc, HS_Document) and doc.embedding is not None
+            for doc in documents
+        ):
+            # Haystack would add a second vector for a document written
+            # twice and leave the first one in FAISS without a document.
+            documents = list({doc.id: doc for doc in documents}.values())
+            existing = self.get_documents_by_id(
+                [doc.id for doc in documents], index=index
+            )
+            if existing:
+                self.delete_documents(
+                    index=index, ids=[doc.id for doc in existing]
+                )
+        # Haystack pops `vector_id` out of the metadata it writes, and
+        # the SQL table may not keep the other values' types; keep a copy.
+        written_meta = {}
+        sql_documents = []
+        for doc in documents:
+            if isinstance(doc, dict):
+                doc = HS_Document.from_dict(doc)
+            meta = dict(doc.meta or {})
+            meta.pop("vector_id", None)
+            if meta:
+                written_meta[doc.id] = meta
+            sql_doc = copy(doc)
+            sql_doc.meta = encode_sql_meta(doc.meta or {})
+            sql_documents.append(sql_doc)
+        super().write_documents(sql_documents, index=index, **kwargs)
+        for doc, sql_doc in zip(documents, sql_documents):
+            if isinstance(doc, HS_Document) and "vector_id" in sql_doc.meta:
+                doc.meta["vector_id"] = sql_doc.meta["vector_id"]
+        with self._filter_lock:
+            self._written_meta.setdefault(
+                index or self.index, {}
+            ).update(written_meta)
+        self._invalidate_filter_index(index)
+
+    def _convert_sql_row_to_document(self, row) -> HS_Document:
+        document = super()._convert_sql_row_to_document(row)
+        document.meta = decode_sql_meta(document.meta)
+        return document
+
+    def _get_documents_meta(self, documents_map: dict) -> dict:
+        documents_map = super()._get_documents_meta(documents_map)
+        for document in documents_map.values():
+            document.meta = decode_sql_meta(document.meta)
+        return documents_map
+
+    def update_embeddings(self, *args, index: Optional[str] = None, **kwargs):
+        super().update_embeddings(*args, index=index, **kwargs)
+        self._invalidate_filter_index(index)
+
+    def update_document_meta(
+        self,
+        id: str,
+        meta: dict,
+        index: Optional[str] = None
+    ):
+        super().update_document_meta(id, encode_sql_meta(meta), index=index)
+        with self._filter_lock:
+            written_meta = self._written_meta.get(index or self.index, {})
+            if id in written_meta:
+                meta = dict(meta)
+                meta.pop("vector_id", None)
+                written_meta[id] = meta
+        self._invalidate_filter_index(index)
+
+    def delete_documents(
+        self,
+        index: Optional[str] = None,
+        ids: Optional[list[str]] = None,
+        filters: Optional[dict] = None,
+        headers: Optional[dict] = None
+    ):
+        """
+        Delete documents and their vectors.
+
+        FAISS compacts a flat index on `remove_ids`, which would shift the
+        vector ids of every later document out of sync with SQL. Instead,
+        the vectors at the end of the index are moved into the freed
+        positions and the index is truncated, so only the moved documents
+        get new vector ids.
+        """
+        index = index or self.index
+        faiss_index = self.faiss_indexes.get(index)
+        if (
+            not (ids or filters)
+            or faiss_index is None
+            or not hasattr(faiss.downcast_index(faiss_index), "get_xb")
+        ):
+            super().delete_documents(
+                index=index, ids=ids, filters=filters, headers=headers
+            )
+            self._invalidate_filter_index(index)
+            return
+        if filters:
+            docs = self.get_all_documents(
+                index=index, filters=filters, return_embedding=False
+            )
+            if ids:
+                id_set = set(ids)
+                docs = [doc for doc in docs if doc.id in id_set]
+        else:
+            docs = self.get_documents_by_id(ids, index=index)
+        if not docs:
+            return
+        removed = sorted({
+            int(doc.meta["vector_id"]) for doc in docs
+            if doc.meta.get("vector_id") is not None
+        })
+        super(FAISSDocumentStore, self).delete_documents(
+            index=index, ids=[doc.id for doc in docs]
+        )
+        if removed:
+            self._compact(index, removed)
+        self._invalidate_filter_index(index)
+
+    def _compact(self, index: str, removed: list[int]):
+        flat_index = faiss.downcast_index(self.faiss_indexes[index])
+        num_vectors = flat_index.ntotal
+        num_kept = num_vectors - len(removed)
+        removed_set = set(removed)
+        holes = [position for position in removed if position < num_kept]
+        movers = [
+            position for position in range(num_kept, num_vectors)
+            if position not in removed_set
+        ]
+        if holes:
+            vectors = faiss.rev_swig_ptr(
+                flat_index.get_xb(), num_vectors * flat_index.d
+            ).reshape(num_vectors, flat_index.d)
+            vectors[holes] = vectors[movers]
+            moved_docs = self.get_documents_by_vector_ids(
+                [str(position) for position in movers], index=index
+            )
+            new_vector_ids = dict(zip(movers, holes))
+            self.update_vector_ids(
+                {
+                    doc.id: str(new_vector_ids[int(doc.meta["vector_id"])])
+                    for doc in moved_docs
+                },
+                index=index
+            )
+        flat_index.remove_ids(faiss.IDSelectorRange(num_kept, num_vectors))
+
+    def copy(
+        self,
+        sql_url: str = "sqlite:///"
+    ) -> "FilteredFAISSDocumentStore":
+        """
+        Return a new store holding a copy of this store's documents and
+        vectors, in an SQLite database at `sql_url` (in memory by default).
+
+        The SQL tables are copied page by page with SQLite's backup API
+        and the FAISS indexes with `clone_index`, so building a changed
+        snapshot of a store needs no per-document SQL writes.
+        """
+        source_engine = self.session.get_bind()
+        if source_engine.dialect.name != "sqlite":
+            raise ValueError("Only stores backed by SQLite can be copied.")
+        faiss_indexes = {
+            name: faiss.clone_index(faiss_index)
+            for name, faiss_index in self.faiss_indexes.items()
+        }
+        document_store = FilteredFAISSDocumentStore(
+            sql_url=sql_url,
+            embedding_dim=self.embedding_dim,
+            faiss_index_factory_str=self.faiss_index_factory_str,
+            faiss_index=faiss_indexes[self.index],
+            return_embedding=self.return_embedding,
+            index=self.index,
+            similarity=self.similarity,
+            embedding_field=self.embedding_field,
+            progress_bar=self.progress_bar,
+            duplicate_documents=self.duplicate_documents,
+            validate_index_sync=False
+        )
+        document_store.faiss_indexes.update(faiss_indexes)
+        self.session.commit()
+        source = source_engine.raw_connection()
+        target = document_store.session.get_bind().raw_connection()
+        try:
+            source.connection.backup(target.connection)
+        finally:
+            target.close()
+            source.close()
+        with self._filter_lock:
+            document_store._written_meta = {
+                name: dict(written_meta)
+                for name, written_meta in self._written_meta.items()
+            }
+        return document_store
+
+    def query_by_embedding(
+        self,
+        query_emb: np.ndarray,
+        filters: Optional[dict] = None,
+        top_k: int = 10,
+        index: Optional[str] = None,
+        return_embedding: Optional[bool] = None,
+        headers: Optional[dict] = None,
+        scale_score: bool = True
+    ) -> list[HS_Document]:
+        if not filters:
+            return super().query_by_embedding(
+                query_emb,
+                top_k=top_k,
+                index=index,
+                return_embedding=return_embedding,
+                headers=headers,
+                scale_score=scale_score
+            )
+        index = index or self.index
+        if not self.faiss_indexes.get(index):
+            raise Exception(
+                f"Index named '{index}' does not exists. "
+                "Use 'update_embeddings()' to create an index."
+            )
+        if return_embedding is None:
+            return_embedding = self.return_embedding
+        faiss_index = self.faiss_indexes[index]
+        params = self.filter_index(index).search_params(faiss_index, filters)
+        if params is None:
+            return []
+
+        query_emb = query_emb.reshape(1, -1).astype(np.float32)
+        if self.similarity == "cosine":
+            self.normalize_embedding(query_emb)
+        score_matrix, vector_id_matrix = faiss_index.search(
+            query_emb, top_k, params=params
+        )
+        scores_for_vector_ids = {
+            str(vector_id): score
+            for vector_id, score in zip(vector_id_matrix[0], score_matrix[0])
+            if vector_id != -1
+        }
+        documents = self.get_documents_by_vector_ids(
+            list(scores_for_vector_ids), index=index
+        )
+        for doc in documents:
+            score = scores_for_vector_ids[doc.meta["vector_id"]]
+            if scale_score:
+                score = self.scale_to_unit_interval(score, self.similarity)
+            doc.score = score
+            if return_embedding is True:
+                doc.embedding = faiss_index.reconstruct(
+                    int(doc.meta["vector_id"])
+                )
+        return documents
+
+
+class FilteredFAISSRetriever(BaseRetriever):
+    """
+    LangChain retriever over a LangChain FAISS vectorstore that honors
+    metadata filters.
+
+    `filters` applies to every query; filters set with `use_filters` for
+    the current query are combined with it.
+    """
+
+    vectorstore: Any
+    k: int = 4
+    filters: Optional[dict] = None
+    _filter_index: Optional[MetadataFilterIndex] = PrivateAttr(default=None)
+
+    def _get_filter_index(self) -> MetadataFilterIndex:
+        filter_index = self._filter_index
+        num_positions = self.vectorstore.index.ntotal
+        if filter_index is None or filter_index.num_positions != num_positions:
+            docstore = self.vectorstore.docstore
+            metadata = [None] * num_positions
+            for position, docstore_id in (
+                self.vectorstore.index_to_docstore_id.items()
+            ):
+                metadata[position] = docstore.search(docstore_id).metadata
+            filter_index = MetadataFilterIndex(
+                metadata, num_positions=num_positions
+            )
+            self._filter_index = filter_index
+        return filter_index
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        filters = [
+            ele for ele in (self.filters, current_filters()) if ele
+        ]
+        if not filters:
+            return self.vectorstore.similarity_search(query, k=self.k)
+        index = self.vectorstore.index
+        params = self._get_filter_index().search_params(index, filters)
+        if params is None:
+            return []
+        query_emb = np.asarray(
+            [self.vectorstore.embedding_function(query)], dtype=np.float32
+        )
+        _, positions = index.search(query_emb, self.k, params=params)
+        return [
+            self.vectorstore.docstore.search(
+                self.vectorstore.index_to_docstore_id[position]
+            )
+            for position in positions[0] if position != -1
+        ]
@@ -0,0 +1,155 @@
+"""
+Purpose: A single embedded index shared by the generative and extractive
+pipelines.
+"""
+
+
+from dataclasses import dataclass, field, InitVar
+from haystack.nodes import EmbeddingRetriever
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun
+)
+from langchain.docstore.document import Document
+from langchain.schema import BaseRetriever
+import logging
+import sys
+from typing import Any, Optional
+
+
+from docs2chat.concurrency import inference_executor
+from docs2chat.config import config
+from docs2chat.preprocessing.embedding import CorpusEmbedder, retriever_model
+from docs2chat.preprocessing.filters import current_filters
+from docs2chat.preprocessing.preprocessing import PreProcessor
+from docs2chat.preprocessing.utils import haystack_to_langchain_docs
+
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.INFO)
+_formatter = logging.Formatter(
+    "%(asctime)s:%(levelname)s:%(module)s: %(message)s"
+)
+_console_handler = logging.StreamHandler(sys.stdout)
+_console_handler.setFormatter(_formatter)
+_logger.addHandler(_console_handler)
+
+
+class HaystackRetrieverAdapter(BaseRetriever):
+    """
+    Expose a Haystack retriever through the LangChain retriever interface.
+
+    Retrieved documents keep their Haystack metadata, plus their `id` and
+    `score`. `filters` applies to every query; filters set with
+    `use_filters` for the current query are combined with it.
+    """
+
+    retriever: Any
+    top_k: int = 4
+    filters: Optional[dict] = None
+
+    def _retrieve(self, query: str, filters: Optional[dict]):
+        filters = [ele for ele in (self.filters, filters) if ele]
+        return self.retriever.retrieve(
+            query=query,
+            top_k=self.top_k,
+            filters={"$and": filters} if filters else None
+        )
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        docs = self._retrieve(query, current_filters())
+        return haystack_to_langchain_docs(docs)
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        docs = await inference_executor.run(
+            self._retrieve, query, current_filters()
+        )
+        return haystack_to_langchain_docs(docs)
+
+
+@dataclass
+class SharedIndex:
+    """
+    Embed a corpus once and serve it to every chain type.
+
+    The chunks are embedded and written to a single Haystack document
+    store. `retriever` queries that store for the search and
+    snip pipelines, and `as_langchain_retriever` wraps the same retriever
+    for the generative chain, so all three share one copy of the vectors
+    and document ids. Unless a preprocessor is passed, the corpus is
+    embedded with the retriever's own model, so one copy of the embedding
+    model stays loaded; a passed preprocessor's embedder is released once
+    indexing finishes.
+    """
+
+    content: InitVar[Optional[str]] = field(default=None)
+    document_store: Optional[Any] = field(default=None)
+    preprocessor: Optional[PreProcessor] = field(default=None)
+    retriever: Optional[Any] = field(default=None)
+
+    def __post_init__(self, content):
+        embed_missing = self.retriever is None or self.document_store is None
+        if self.retriever is None:
+            _logger.info(
+                "Generating a HS Retriever."
+            )
+            retriever = EmbeddingRetriever(
+                document_store=self.document_store,
+                embedding_model=config.EMBEDDING_DIR
+            )
+            setattr(self, "retriever", retriever)
+        if self.document_store is None:
+            model = retriever_model(self.retriever)
+            if self.preprocessor is None:
+                _logger.info(
+                    "PreProcessor was not passed. "
+                    "Initializing a PreProcessor object."
+                )
+                embeddings = None
+                if model is not None:
+                    embeddings = CorpusEmbedder(
+                        model_dir=config.EMBEDDING_DIR,
+                        num_workers=config.EMBEDDING_WORKERS,
+                        model=model
+                    )
+                preprocessor = PreProcessor(
+                    chain_type="search",
+                    content=content,
+                    embeddings=embeddings
+                )
+                setattr(self, "preprocessor", preprocessor)
+            document_store = self.preprocessor.preprocess(
+                show_progress=False,
+                store_vectorstore=True
+            )
+            setattr(self, "document_store", document_store)
+            setattr(self.retriever, "document_store", document_store)
+            embeddings = self.preprocessor.embeddings
+            if (
+                hasattr(embeddings, "release")
+                and getattr(embeddings, "model", None) is not model
+            ):
+                embeddings.release()
+        if embed_missing:
+            self.document_store.update_embeddings(
+                self.retriever, update_existing_embeddings=False
+            )
+
+    def as_langchain_retriever(
+        self,
+        top_k: int = 4,
+        filters: Optional[dict] = None
+    ) -> BaseRetriever:
+        return HaystackRetrieverAdapter(
+            retriever=self.retriever, top_k=top_k, filters=filters
+        )
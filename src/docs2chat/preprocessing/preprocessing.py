@@ -4,25 +4,36 @@ Langchain LLM pipeline for generative QA pipeline.
 
 
 from dataclasses import dataclass, field, InitVar
-from haystack.document_stores import FAISSDocumentStore
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.text_splitter import CharacterTextSplitter
+import functools
+import itertools
 import logging
+import numpy as np
 from pathlib import Path
 import sys
 from typing import Iterable, Literal, Optional, Union
 
 
 from docs2chat.config import Config, config
+from docs2chat.preprocessing.dedup import MinHashDeduplicator
+from docs2chat.preprocessing.docstore import NumpyDocumentStore
+from docs2chat.preprocessing.embedding import CorpusEmbedder
+from docs2chat.preprocessing.filters import FilteredFAISSDocumentStore
+from docs2chat.preprocessing.text_splitter import (
+    log_split_stats,
+    TokenTextSplitter
+)
 from docs2chat.preprocessing.utils import (
     create_vectorstore,
+    iter_load_and_split_from_dir,
     langchain_to_haystack_docs,
     load_and_split_from_dir,
     load_and_split_from_str,
+    _DeduplicatorProtocol,
     _EmbeddingsProtocol,
     _RetrieverProtocol,
     _TextSplitterProtocol
 )
+from docs2chat.profiling import profiler
 
 
 _logger = logging.getLogger(__name__)
@@ -42,9 +53,21 @@ class ExtractivePreProcessor:
         "text": load_and_split_from_str,
         "dir": load_and_split_from_dir
     }
+    STREAM_LOADER_FACTORY = {
+        "text": load_and_split_from_str,
+        "dir": iter_load_and_split_from_dir
+    }
+    DOCUMENT_STORE_FACTORY = {
+        "faiss": functools.partial(
+            FilteredFAISSDocumentStore, sql_url="sqlite:///"
+        ),
+        "numpy": NumpyDocumentStore
+    }
     
     content: Union[str, list[str]] = field(default=config.DOCUMENTS_DIR)
+    deduplicator: Optional[_DeduplicatorProtocol] = field(default=None)
     docs: Optional[list] = field(default=None)
+    embeddings: Optional[_EmbeddingsProtocol] = field(default=None)
     load_from_type: str = field(default="dir")
     text_splitter: Optional[_TextSplitterProtocol] = field(default=None)
 
@@ -57,30 +80,96 @@ class ExtractivePreProcessor:
             _logger.info(
                 "Generating text splitter."
             )
-            text_splitter = CharacterTextSplitter(        
-                separator="\n",
-                chunk_size=1000,
-                chunk_overlap=200,
-                length_function=len,
+            text_splitter = TokenTextSplitter(
+                model_dir=config.EMBEDDING_DIR,
+                chunk_size=config.CHUNK_SIZE_TOKENS,
+                chunk_overlap=config.CHUNK_OVERLAP_TOKENS
             )
             setattr(self, "text_splitter", text_splitter)
+        if self.deduplicator is None and config.DEDUPLICATE:
+            _logger.info(
+                "Generating near-duplicate chunk filter."
+            )
+            deduplicator = MinHashDeduplicator(
+                threshold=config.DEDUP_THRESHOLD
+            )
+            setattr(self, "deduplicator", deduplicator)
+        if self.embeddings is None:
+            _logger.info(
+                "Generating corpus embedder."
+            )
+            embeddings = CorpusEmbedder(
+                model_dir=config.EMBEDDING_DIR,
+                num_workers=config.EMBEDDING_WORKERS
+            )
+            setattr(self, "embeddings", embeddings)
     
     def load_and_split(self, show_progress=True, store=False):
         load_func = ExtractivePreProcessor.LOADER_FACTORY[self.load_from_type]
-        docs = langchain_to_haystack_docs(load_func(
+        with profiler.span("preprocessing.load_and_split"):
+            docs = load_func(
+                content=self.content,
+                text_splitter=self.text_splitter,
+                show_progress=show_progress
+            )
+        log_split_stats(self.text_splitter)
+        if self.deduplicator is not None:
+            with profiler.span("preprocessing.deduplicate"):
+                docs = self.deduplicator.deduplicate(docs)
+        profiler.count("preprocessing.chunks", len(docs))
+        docs = langchain_to_haystack_docs(docs)
+        if store:
+            setattr(self, "docs", docs)
+        return docs
+
+    def iter_batches(self, show_progress=True, batch_size=None):
+        """
+        Yield split chunks as Haystack documents, `batch_size` at a time.
+
+        Chunks are loaded and split lazily, so memory does not grow with
+        the corpus. Deduplication needs every chunk at once; with a
+        deduplicator set the whole corpus is split first.
+        """
+        if batch_size is None:
+            batch_size = config.INGEST_BATCH_SIZE
+        if self.deduplicator is not None:
+            docs = self.load_and_split(show_progress=show_progress)
+            for idx in range(0, len(docs), batch_size):
+                yield docs[idx:idx + batch_size]
+            return
+        load_func = self.STREAM_LOADER_FACTORY[self.load_from_type]
+        chunks = iter(load_func(
             content=self.content,
             text_splitter=self.text_splitter,
             show_progress=show_progress
         ))
-        if store:
-            setattr(self, "docs", docs)
-        return docs
+        while True:
+            with profiler.span("preprocessing.load_and_split"):
+                batch = list(itertools.islice(chunks, batch_size))
+            if not batch:
+                break
+            profiler.count("preprocessing.chunks", len(batch))
+            yield langchain_to_haystack_docs(batch)
+        log_split_stats(self.text_splitter)
     
-    def create_vectorstore(self, store=False):
-        vectorstore = FAISSDocumentStore(
-            sql_url="sqlite:///",
-            embedding_dim=384
+    def embed(self, docs):
+        """
+        Set the embedding of each Haystack document in place.
+        """
+        embed_func = getattr(
+            self.embeddings, "embed", self.embeddings.embed_documents
         )
+        with profiler.span("preprocessing.embed"):
+            embeddings = embed_func([doc.content for doc in docs])
+        for doc, embedding in zip(docs, embeddings):
+            doc.embedding = np.asarray(embedding, dtype=np.float32)
+        return docs
+
+    def create_vectorstore(self, store=False, embedding_dim=384):
+        document_store_cls = self.DOCUMENT_STORE_FACTORY[
+            config.DOCUMENT_STORE
+        ]
+        vectorstore = document_store_cls(embedding_dim=embedding_dim)
         if store:
             setattr(self, "vectorstore", vectorstore)
         return vectorstore
@@ -96,14 +185,24 @@ class ExtractivePreProcessor:
             "Loading documents into vectorstore. "
             "This may take a few mquitinutes ..."
         )
-        docs = self.load_and_split(
-            show_progress=show_progress,
-            store=store_docs
-        )
-        vectorstore = self.create_vectorstore(
-            store=store_vectorstore
-        )
-        vectorstore.write_documents(docs)
+        vectorstore = None
+        stored_docs = []
+        for docs in self.iter_batches(show_progress=show_progress):
+            self.embed(docs)
+            if vectorstore is None:
+                vectorstore = self.create_vectorstore(
+                    embedding_dim=len(docs[0].embedding)
+                )
+            with profiler.span("preprocessing.write_documents"):
+                vectorstore.write_documents(docs)
+            if store_docs:
+                stored_docs.extend(docs)
+        if hasattr(self.embeddings, "close"):
+            self.embeddings.close()
+        if vectorstore is None:
+            vectorstore = self.create_vectorstore()
+        if store_docs:
+            setattr(self, "docs", stored_docs)
         if store_vectorstore:
             setattr(self, "vectorstore", vectorstore)
         if return_vectorstore:
@@ -118,8 +217,13 @@ class GenerativePreProcessor:
         "text": load_and_split_from_str,
         "dir": load_and_split_from_dir
     }
+    STREAM_LOADER_FACTORY = {
+        "text": load_and_split_from_str,
+        "dir": iter_load_and_split_from_dir
+    }
     
     content: Union[str, list[str]] = field(default=config.DOCUMENTS_DIR)
+    deduplicator: Optional[_DeduplicatorProtocol] = field(default=None)
     docs: Optional[list] = field(default=None)
     embeddings: Optional[_EmbeddingsProtocol] = field(default=None)
     load_from_type: str = field(default="dir")
@@ -134,38 +238,83 @@ class GenerativePreProcessor:
             _logger.info(
                 "Generating text splitter."
             )
-            text_splitter = CharacterTextSplitter(        
-                separator="\n",
-                chunk_size=1000,
-                chunk_overlap=200,
-                length_function=len,
+            text_splitter = TokenTextSplitter(
+                model_dir=config.EMBEDDING_DIR,
+                chunk_size=config.CHUNK_SIZE_TOKENS,
+                chunk_overlap=config.CHUNK_OVERLAP_TOKENS
             )
             setattr(self, "text_splitter", text_splitter)
+        if self.deduplicator is None and config.DEDUPLICATE:
+            _logger.info(
+                "Generating near-duplicate chunk filter."
+            )
+            deduplicator = MinHashDeduplicator(
+                threshold=config.DEDUP_THRESHOLD
+            )
+            setattr(self, "deduplicator", deduplicator)
         if self.embeddings is None:
             _logger.info(
-                f"Loading embedding model from {config.EMBEDDING_DIR}."
+                "Generating corpus embedder."
             )
-            embeddings = HuggingFaceEmbeddings(
-                model_name=config.EMBEDDING_DIR
+            embeddings = CorpusEmbedder(
+                model_dir=config.EMBEDDING_DIR,
+                num_workers=config.EMBEDDING_WORKERS
             )
             setattr(self, "embeddings", embeddings)
     
     def load_and_split(self, show_progress=True, store=False):
         load_func = GenerativePreProcessor.LOADER_FACTORY[self.load_from_type]
-        docs = load_func(
-            content=self.content,
-            text_splitter=self.text_splitter,
-            show_progress=show_progress
-        )
+        with profiler.span("preprocessing.load_and_split"):
+            docs = load_func(
+                content=self.content,
+                text_splitter=self.text_splitter,
+                show_progress=show_progress
+            )
+        log_split_stats(self.text_splitter)
+        if self.deduplicator is not None:
+            with profiler.span("preprocessing.deduplicate"):
+                docs = self.deduplicator.deduplicate(docs)
+        profiler.count("preprocessing.chunks", len(docs))
         if store:
             setattr(self, "docs", docs)
         return docs
+
+    def iter_batches(self, show_progress=True, batch_size=None):
+        """
+        Yield split chunks, `batch_size` at a time.
+
+        Chunks are loaded and split lazily, so memory does not grow with
+        the corpus. Deduplication needs every chunk at once; with a
+        deduplicator set the whole corpus is split first.
+        """
+        if batch_size is None:
+            batch_size = config.INGEST_BATCH_SIZE
+        if self.deduplicator is not None:
+            docs = self.load_and_split(show_progress=show_progress)
+            for idx in range(0, len(docs), batch_size):
+                yield docs[idx:idx + batch_size]
+            return
+        load_func = self.STREAM_LOADER_FACTORY[self.load_from_type]
+        chunks = iter(load_func(
+            content=self.content,
+            text_splitter=self.text_splitter,
+            show_progress=show_progress
+        ))
+        while True:
+            with profiler.span("preprocessing.load_and_split"):
+                batch = list(itertools.islice(chunks, batch_size))
+            if not batch:
+                break
+            profiler.count("preprocessing.chunks", len(batch))
+            yield batch
+        log_split_stats(self.text_splitter)
     
     def create_vectorstore(self, docs, store=False):
-        vectorstore = create_vectorstore(
-            docs=docs,
-            embeddings=self.embeddings
-        )
+        with profiler.span("preprocessing.create_vectorstore"):
+            vectorstore = create_vectorstore(
+                docs=docs,
+                embeddings=self.embeddings
+            )
         if store:
             setattr(self, "vectorstore", vectorstore)
         return vectorstore
@@ -180,14 +329,24 @@ class GenerativePreProcessor:
         _logger.info(
             "Loading documents into vectorstore. This may take a few minutes ..."
         )
-        docs = self.load_and_split(
-            show_progress=show_progress,
-            store=store_docs
-        )
-        vectorstore = self.create_vectorstore(
-            docs=docs,
-            store=store_vectorstore
-        )
+        vectorstore = None
+        stored_docs = []
+        for docs in self.iter_batches(show_progress=show_progress):
+            if vectorstore is None:
+                vectorstore = self.create_vectorstore(docs=docs)
+            else:
+                with profiler.span("preprocessing.create_vectorstore"):
+                    vectorstore.add_documents(docs)
+            if store_docs:
+                stored_docs.extend(docs)
+        if hasattr(self.embeddings, "close"):
+            self.embeddings.close()
+        if vectorstore is None:
+            vectorstore = self.create_vectorstore(docs=[])
+        if store_docs:
+            setattr(self, "docs", stored_docs)
+        if store_vectorstore:
+            setattr(self, "vectorstore", vectorstore)
         if return_vectorstore:
             return vectorstore
         return
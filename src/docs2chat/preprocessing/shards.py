@@ -0,0 +1,365 @@
+"""
+Purpose: Multi-corpus index of independently built, persisted shards with
+parallel fan-out search.
+"""
+
+
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from dataclasses import dataclass, field
+from haystack.nodes import EmbeddingRetriever
+from haystack.nodes.retriever import BaseRetriever
+from haystack.schema import Document as HS_Document
+import heapq
+import logging
+import numpy as np
+import os
+from pathlib import Path
+import shutil
+import sys
+import threading
+import time
+from typing import Any, Optional
+
+
+from docs2chat.config import config
+from docs2chat.preprocessing.docstore import NumpyDocumentStore
+from docs2chat.preprocessing.filters import FilteredFAISSDocumentStore
+from docs2chat.preprocessing.index import HaystackRetrieverAdapter
+from docs2chat.preprocessing.preprocessing import (
+    ExtractivePreProcessor,
+    PreProcessor
+)
+from docs2chat.profiling import profiler
+
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.INFO)
+_formatter = logging.Formatter(
+    "%(asctime)s:%(levelname)s:%(module)s: %(message)s"
+)
+_console_handler = logging.StreamHandler(sys.stdout)
+_console_handler.setFormatter(_formatter)
+_logger.addHandler(_console_handler)
+
+
+CURRENT_FILE = "CURRENT"
+FAISS_INDEX_FILE = "faiss.index"
+FAISS_CONFIG_FILE = "faiss.json"
+SQL_FILE = "documents.db"
+NUMPY_FILE = "documents.npz"
+
+
+def _version_dir(corpus_dir: Path) -> Optional[Path]:
+    current_path = corpus_dir / CURRENT_FILE
+    if not current_path.is_file():
+        return None
+    return corpus_dir / current_path.read_text().strip()
+
+
+def create_shard(version_dir: Path, embedding_dim: int):
+    """
+    Create an empty store of the configured `DOCUMENT_STORE` type for a
+    new corpus version.
+    """
+    document_store_cls = ExtractivePreProcessor.DOCUMENT_STORE_FACTORY[
+        config.DOCUMENT_STORE
+    ]
+    kwargs = {}
+    if config.DOCUMENT_STORE == "faiss":
+        # Keep the SQL database beside the FAISS index it belongs to.
+        kwargs["sql_url"] = (
+            f"sqlite:///{(version_dir / SQL_FILE).absolute()}"
+        )
+    return document_store_cls(embedding_dim=embedding_dim, **kwargs)
+
+
+def save_shard(document_store: Any, version_dir: Path):
+    if isinstance(document_store, NumpyDocumentStore):
+        document_store.save(version_dir / NUMPY_FILE)
+        return
+    document_store.save(
+        index_path=version_dir / FAISS_INDEX_FILE,
+        config_path=version_dir / FAISS_CONFIG_FILE
+    )
+
+
+def load_shard(version_dir: Path) -> Any:
+    """
+    Load a corpus version as the store type it was saved with.
+    """
+    if (version_dir / NUMPY_FILE).is_file():
+        return NumpyDocumentStore.load(version_dir / NUMPY_FILE)
+    return FilteredFAISSDocumentStore.load(
+        index_path=version_dir / FAISS_INDEX_FILE,
+        config_path=version_dir / FAISS_CONFIG_FILE
+    )
+
+
+@dataclass
+class ShardedIndex:
+    """
+    A set of named corpora, each built, persisted and swapped on its own.
+
+    Every corpus is a document store of the `DOCUMENT_STORE` type saved
+    under `index_dir/<corpus>/<version>/`, with `index_dir/<corpus>/CURRENT`
+    naming the live version. Rebuilding a corpus writes a new version and
+    swaps it in without touching the others; queries already running keep
+    the store they started with. `retriever` embeds each query once and
+    searches the selected corpora in parallel on a shared thread pool,
+    merging the top-k by score. Offers the same `retriever` and
+    `as_langchain_retriever` views as SharedIndex.
+    """
+
+    index_dir: str = field(default=config.INDEX_DIR)
+    corpora: Optional[list[str]] = field(default=None)
+    max_workers: Optional[int] = field(default=None)
+    query_encoder: Optional[Any] = field(default=None)
+    shards: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        setattr(self, "index_dir", Path(self.index_dir))
+        if self.max_workers is None:
+            max_workers = config.SHARD_WORKERS or os.cpu_count() or 1
+            setattr(self, "max_workers", max_workers)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="docs2chat-shard"
+        )
+        names = self.corpora
+        if names is None:
+            names = self.list_corpora()
+        for name in names:
+            if name not in self.shards:
+                self.load_corpus(name)
+
+    def list_corpora(self) -> list[str]:
+        if not self.index_dir.is_dir():
+            return []
+        return sorted(
+            path.name for path in self.index_dir.iterdir()
+            if _version_dir(path) is not None
+        )
+
+    def load_corpus(self, name: str) -> Any:
+        version_dir = _version_dir(self.index_dir / name)
+        if version_dir is None:
+            raise ValueError(
+                f"No built corpus named `{name}` in {self.index_dir}."
+            )
+        _logger.info(
+            f"Loading corpus `{name}` from {version_dir}."
+        )
+        document_store = load_shard(version_dir)
+        self.swap_corpus(name, document_store)
+        return document_store
+
+    def build_corpus(
+        self,
+        name: str,
+        content: str,
+        preprocessor: Optional[PreProcessor] = None,
+        keep_versions: int = 2
+    ) -> Any:
+        """
+        Build, persist and swap in a new version of one corpus.
+        """
+        if preprocessor is None:
+            preprocessor = PreProcessor(chain_type="search", content=content)
+        corpus_dir = self.index_dir / name
+        version = str(time.time_ns())
+        version_dir = corpus_dir / version
+        version_dir.mkdir(parents=True, exist_ok=False)
+        _logger.info(
+            f"Building corpus `{name}` in {version_dir}."
+        )
+        document_store = None
+        for docs in preprocessor.iter_batches(show_progress=False):
+            for doc in docs:
+                doc.meta["corpus"] = name
+            preprocessor.embed(docs)
+            if document_store is None:
+                document_store = create_shard(
+                    version_dir, embedding_dim=len(docs[0].embedding)
+                )
+            with profiler.span("preprocessing.write_documents"):
+                document_store.write_documents(docs)
+        if hasattr(preprocessor.embeddings, "close"):
+            preprocessor.embeddings.close()
+        if document_store is None:
+            raise ValueError(f"No documents found for corpus `{name}`.")
+        save_shard(document_store, version_dir)
+        # Point CURRENT at the new version atomically.
+        tmp_path = corpus_dir / f"{CURRENT_FILE}.tmp"
+        tmp_path.write_text(version)
+        os.replace(tmp_path, corpus_dir / CURRENT_FILE)
+        self.swap_corpus(name, document_store)
+        self._prune_versions(corpus_dir, keep_versions=keep_versions)
+        return document_store
+
+    def _prune_versions(self, corpus_dir: Path, keep_versions: int):
+        versions = sorted(
+            path for path in corpus_dir.iterdir() if path.is_dir()
+        )
+        for path in versions[:-keep_versions]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def swap_corpus(
+        self,
+        name: str,
+        document_store: Any
+    ):
+        with self._lock:
+            shards = dict(self.shards)
+            shards[name] = document_store
+            self.shards = shards
+
+    def drop_corpus(self, name: str):
+        with self._lock:
+            shards = dict(self.shards)
+            shards.pop(name, None)
+            self.shards = shards
+
+    def query_by_embedding(
+        self,
+        query_emb: np.ndarray,
+        top_k: int = 10,
+        corpora: Optional[list[str]] = None,
+        **kwargs
+    ) -> list[HS_Document]:
+        """
+        Search the selected corpora in parallel and merge by score.
+        """
+        shards = self.shards
+        if corpora is None:
+            corpora = self.corpora or list(shards)
+        stores = [shards[name] for name in corpora if name in shards]
+        if len(stores) == 1:
+            return stores[0].query_by_embedding(
+                query_emb, top_k=top_k, **kwargs
+            )
+        # Each shard search runs in its own copy of the caller's context,
+        # so its spans land in the caller's profile at the right depth.
+        contexts = [contextvars.copy_context() for _ in stores]
+        results = self._executor.map(
+            lambda context, store: context.run(
+                store.query_by_embedding, query_emb, top_k=top_k, **kwargs
+            ),
+            contexts,
+            stores
+        )
+        return heapq.nlargest(
+            top_k,
+            (doc for docs in results for doc in docs),
+            key=lambda doc: doc.score
+        )
+
+    @property
+    def retriever(self) -> "ShardedRetriever":
+        if self.query_encoder is None:
+            _logger.info(
+                "Generating a HS query encoder."
+            )
+            query_encoder = EmbeddingRetriever(
+                embedding_model=config.EMBEDDING_DIR,
+                progress_bar=False
+            )
+            setattr(self, "query_encoder", query_encoder)
+        return ShardedRetriever(index=self, query_encoder=self.query_encoder)
+
+    def as_langchain_retriever(
+        self,
+        top_k: int = 4,
+        filters: Optional[dict] = None
+    ):
+        return HaystackRetrieverAdapter(
+            retriever=self.retriever, top_k=top_k, filters=filters
+        )
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class ShardedRetriever(BaseRetriever):
+    """
+    Haystack retriever over a ShardedIndex.
+
+    The query is embedded once by `query_encoder` and the same vector is
+    searched in every selected corpus. As with EmbeddingRetriever,
+    `scale_score` (by default that of `query_encoder`) scales every
+    corpus's scores to the unit interval, so they merge on one scale.
+    """
+
+    def __init__(
+        self,
+        index: ShardedIndex,
+        query_encoder: Any,
+        top_k: int = 10,
+        scale_score: Optional[bool] = None
+    ):
+        super().__init__()
+        self.index = index
+        self.query_encoder = query_encoder
+        self.top_k = top_k
+        if scale_score is None:
+            scale_score = getattr(query_encoder, "scale_score", True)
+        self.scale_score = scale_score
+
+    def embed_queries(self, queries: list[str]) -> np.ndarray:
+        return self.query_encoder.embed_queries(queries)
+
+    def embed_documents(self, documents: list[HS_Document]) -> np.ndarray:
+        return self.query_encoder.embed_documents(documents)
+
+    def retrieve(
+        self,
+        query: str,
+        filters: Optional[dict] = None,
+        top_k: Optional[int] = None,
+        index: Optional[str] = None,
+        headers: Optional[dict] = None,
+        scale_score: Optional[bool] = None,
+        document_store: Optional[Any] = None,
+        corpora: Optional[list[str]] = None
+    ) -> list[HS_Document]:
+        if scale_score is None:
+            scale_score = self.scale_score
+        query_emb = self.embed_queries([query])[0]
+        return self.index.query_by_embedding(
+            query_emb,
+            top_k=top_k or self.top_k,
+            corpora=corpora,
+            filters=filters,
+            index=index,
+            headers=headers,
+            scale_score=scale_score
+        )
+
+    def retrieve_batch(
+        self,
+        queries: list[str],
+        filters: Optional[dict] = None,
+        top_k: Optional[int] = None,
+        index: Optional[str] = None,
+        headers: Optional[dict] = None,
+        batch_size: Optional[int] = None,
+        scale_score: Optional[bool] = None,
+        document_store: Optional[Any] = None,
+        corpora: Optional[list[str]] = None
+    ) -> list[list[HS_Document]]:
+        if scale_score is None:
+            scale_score = self.scale_score
+        query_embs = self.embed_queries(queries)
+        return [
+            self.index.query_by_embedding(
+                query_emb,
+                top_k=top_k or self.top_k,
+                corpora=corpora,
+                filters=filters,
+                index=index,
+                headers=headers,
+                scale_score=scale_score
+            )
+            for query_emb in query_embs
+        ]
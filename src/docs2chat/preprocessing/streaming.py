@@ -0,0 +1,106 @@
+"""
+Purpose: Windowed reading and incremental splitting of large text files.
+"""
+
+
+import codecs
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+
+from docs2chat.config import config
+
+
+_BOUNDARIES = ("\n\n", "\n", " ")
+
+
+def iter_file_windows(
+    path: str,
+    window_bytes: int = config.STREAM_WINDOW_BYTES,
+    encoding: str = "utf-8"
+) -> Iterator[str]:
+    """
+    Yield the text of a file in windows of about `window_bytes` bytes.
+
+    Multi-byte characters split across windows are decoded whole.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(window_bytes)
+            if not data:
+                break
+            text = decoder.decode(data)
+            if text:
+                yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+def _last_boundary(text: str) -> int:
+    """
+    Return the end of the last complete paragraph (or line, or word).
+    """
+    for boundary in _BOUNDARIES:
+        idx = text.rfind(boundary)
+        if idx > 0:
+            return idx
+    return len(text)
+
+
+def split_stream(
+    windows: Iterable[str],
+    split_window: Callable[[str], list[str]],
+    split_final: Optional[Callable[[str], list[str]]] = None
+) -> Iterator[str]:
+    """
+    Split one text arriving in windows, yielding chunks as they complete.
+
+    Each window is cut after its last paragraph break and split; the last
+    chunk and the cut-off remainder are carried into the next window, so
+    no chunk spans a window cut and at most a window plus a chunk is held
+    in memory. Chunk boundaries near a cut can differ from splitting the
+    whole text at once. `split_final` splits the remaining text at the
+    end (defaults to `split_window`).
+    """
+    split_final = split_final or split_window
+    carry = ""
+    for window in windows:
+        text = carry + window
+        cut = _last_boundary(text)
+        head, tail = text[:cut], text[cut:]
+        chunks = split_window(head) if head.strip() else []
+        if not chunks:
+            carry = text
+            continue
+        yield from chunks[:-1]
+        start = head.rfind(chunks[-1])
+        carry = (head[start:] if start >= 0 else chunks[-1]) + tail
+    if carry.strip():
+        yield from split_final(carry)
+
+
+def stream_split_file(
+    path: str,
+    text_splitter,
+    window_bytes: int = config.STREAM_WINDOW_BYTES
+) -> Iterator[str]:
+    """
+    Yield the chunks of a text file without reading it whole.
+    """
+    windows = iter_file_windows(path, window_bytes=window_bytes)
+    if hasattr(text_splitter, "split_stream"):
+        return text_splitter.split_stream(windows)
+    return split_stream(windows, split_window=text_splitter.split_text)
+
+
+def is_streamable(
+    path: Path,
+    min_bytes: int = config.STREAM_MIN_BYTES,
+    extensions: Iterable[str] = config.STREAM_EXTENSIONS
+) -> bool:
+    return (
+        path.suffix.lower() in extensions
+        and path.stat().st_size >= min_bytes
+    )
@@ -0,0 +1,352 @@
+"""
+Purpose: Token-aware text splitting for preprocessing subpackage.
+"""
+
+
+from dataclasses import dataclass, field
+from langchain.docstore.document import Document
+import logging
+import re
+import sys
+from transformers import AutoTokenizer
+from typing import Any, Iterable, Iterator, Optional
+
+
+from docs2chat.config import config
+from docs2chat.preprocessing.streaming import split_stream
+from docs2chat.preprocessing.utils import load_max_seq_length
+
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.INFO)
+_formatter = logging.Formatter(
+    "%(asctime)s:%(levelname)s:%(module)s: %(message)s"
+)
+_console_handler = logging.StreamHandler(sys.stdout)
+_console_handler.setFormatter(_formatter)
+_logger.addHandler(_console_handler)
+
+
+_PARAGRAPH_PATTERN = re.compile(r"\n\s*\n")
+_SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n")
+
+
+@dataclass
+class SplitStats:
+    """
+    Running chunk-count and truncation statistics for a splitter.
+    """
+
+    num_documents: int = field(default=0)
+    num_chunks: int = field(default=0)
+    num_tokens: int = field(default=0)
+    max_chunk_tokens: int = field(default=0)
+    num_hard_splits: int = field(default=0)
+    num_truncated_chunks: int = field(default=0)
+    num_truncated_tokens: int = field(default=0)
+
+    def summary(self) -> str:
+        mean_tokens = self.num_tokens / max(self.num_chunks, 1)
+        return (
+            f"Split {self.num_documents} documents into {self.num_chunks} "
+            f"chunks ({self.num_tokens} tokens, {mean_tokens:.1f} mean / "
+            f"{self.max_chunk_tokens} max tokens per chunk). "
+            f"{self.num_hard_splits} oversized sentences were split on "
+            f"token boundaries; {self.num_truncated_chunks} chunks "
+            f"({self.num_truncated_tokens} tokens) exceed the embedding "
+            "model's max sequence length and will be truncated."
+        )
+
+
+@dataclass
+class TokenTextSplitter:
+    """
+    Split text into chunks sized in embedding-model tokens.
+
+    Chunks are packed from whole sentences, preferring to break at
+    paragraph boundaries, and all sentences of a batch of documents are
+    tokenized in a single call to the (fast) tokenizer. Only sentences
+    longer than `chunk_size` are split mid-sentence, on token offsets.
+    """
+
+    model_dir: str = field(default=config.EMBEDDING_DIR)
+    chunk_size: Optional[int] = field(default=None)
+    chunk_overlap: int = field(default=0)
+    tokenizer: Optional[Any] = field(default=None)
+    max_seq_length: Optional[int] = field(default=None)
+    stats: SplitStats = field(default_factory=SplitStats)
+
+    def __post_init__(self):
+        if self.tokenizer is None:
+            _logger.info(
+                f"Loading tokenizer from {self.model_dir}."
+            )
+            tokenizer = AutoTokenizer.from_pretrained(
+                self.model_dir, use_fast=True
+            )
+            setattr(self, "tokenizer", tokenizer)
+        if self.max_seq_length is None:
+            setattr(
+                self,
+                "max_seq_length",
+                load_max_seq_length(self.model_dir, self.tokenizer)
+            )
+        model_budget = (
+            self.max_seq_length
+            - self.tokenizer.num_special_tokens_to_add(pair=False)
+        )
+        if self.chunk_size is None:
+            setattr(self, "chunk_size", model_budget)
+        if self.chunk_size <= 0:
+            raise ValueError("`chunk_size` must be positive.")
+        if not 0 <= self.chunk_overlap < self.chunk_size:
+            raise ValueError(
+                "`chunk_overlap` must be in [0, `chunk_size`)."
+            )
+        setattr(self, "_model_budget", model_budget)
+        # Whether the next text continues an oversized sentence already
+        # counted in the stats, as split_stream's carry can.
+        setattr(self, "_continues_hard_split", False)
+
+    def reset_stats(self):
+        setattr(self, "stats", SplitStats())
+
+    @staticmethod
+    def _segment(text: str) -> list[tuple[int, int, bool]]:
+        """
+        Return (start, end, starts_paragraph) spans of sentences in text.
+        """
+        spans = []
+        para_start = 0
+        for para_match in [*_PARAGRAPH_PATTERN.finditer(text), None]:
+            para_end = len(text) if para_match is None else para_match.start()
+            sent_start = para_start
+            first = True
+            sent_matches = _SENTENCE_PATTERN.finditer(
+                text, para_start, para_end
+            )
+            for sent_match in [*sent_matches, None]:
+                sent_end = (
+                    para_end if sent_match is None else sent_match.start()
+                )
+                if text[sent_start:sent_end].strip():
+                    spans.append((sent_start, sent_end, first))
+                    first = False
+                if sent_match is not None:
+                    sent_start = sent_match.end()
+            if para_match is not None:
+                para_start = para_match.end()
+        return spans
+
+    def _hard_split(self, text: str, start: int, end: int) -> list[tuple]:
+        """
+        Split an oversized sentence into `chunk_size`-token pieces.
+        """
+        encoding = self.tokenizer(
+            text[start:end],
+            add_special_tokens=False,
+            return_offsets_mapping=True
+        )
+        offsets = encoding["offset_mapping"]
+        pieces = []
+        for idx in range(0, len(offsets), self.chunk_size):
+            window = offsets[idx:idx + self.chunk_size]
+            pieces.append((
+                start + window[0][0],
+                start + window[-1][1],
+                len(window)
+            ))
+        return pieces
+
+    def _pack(
+        self,
+        text: str,
+        spans: list[tuple[int, int, bool]],
+        lengths: list[int],
+        final: bool = True
+    ) -> list[str]:
+        # Units are (start, end, starts_paragraph, length, sentence), with
+        # sentence the start of the oversized sentence a piece came from.
+        units = []
+        for (start, end, para), length in zip(spans, lengths):
+            if length > self.chunk_size:
+                pieces = self._hard_split(text, start, end)
+                units.extend(
+                    (p_start, p_end, para and idx == 0, p_len, start)
+                    for idx, (p_start, p_end, p_len) in enumerate(pieces)
+                )
+            else:
+                units.append((start, end, para, length, None))
+
+        paragraph_lengths = []
+        for unit in units:
+            if unit[2] or not paragraph_lengths:
+                paragraph_lengths.append(0)
+            paragraph_lengths[-1] += unit[3]
+        paragraph_idx = -1
+
+        chunks = []
+        current = []
+        current_tokens = 0
+        for unit in units:
+            _, _, para, length, _ = unit
+            if para or paragraph_idx < 0:
+                paragraph_idx += 1
+            overflow = current_tokens + length > self.chunk_size
+            # Break early rather than split a paragraph that fits whole
+            # in the next chunk, as long as this chunk is half full.
+            paragraph_break = (
+                para
+                and current_tokens >= self.chunk_size // 2
+                and current_tokens + paragraph_lengths[paragraph_idx]
+                > self.chunk_size
+                and paragraph_lengths[paragraph_idx] <= self.chunk_size
+            )
+            if current and (overflow or paragraph_break):
+                chunks.append(current)
+                overlap = []
+                overlap_tokens = 0
+                for prev in reversed(current):
+                    if overlap_tokens + prev[3] > self.chunk_overlap:
+                        break
+                    overlap.insert(0, prev)
+                    overlap_tokens += prev[3]
+                if overlap_tokens + length > self.chunk_size:
+                    overlap, overlap_tokens = [], 0
+                current, current_tokens = overlap, overlap_tokens
+            current.append(unit)
+            current_tokens += length
+        if current:
+            chunks.append(current)
+
+        chunk_texts = []
+        hard_splits = set()
+        continued = (
+            units[0][4] if units and self._continues_hard_split else None
+        )
+        for idx, chunk in enumerate(chunks):
+            chunk_texts.append(text[chunk[0][0]:chunk[-1][1]].strip())
+            # A non-final text's last chunk is re-split with what follows.
+            if not final and idx == len(chunks) - 1:
+                break
+            num_tokens = sum(unit[3] for unit in chunk)
+            hard_splits.update(
+                unit[4] for unit in chunk if unit[4] is not None
+            )
+            self.stats.num_chunks += 1
+            self.stats.num_tokens += num_tokens
+            self.stats.max_chunk_tokens = max(
+                self.stats.max_chunk_tokens, num_tokens
+            )
+            if num_tokens > self._model_budget:
+                self.stats.num_truncated_chunks += 1
+                self.stats.num_truncated_tokens += (
+                    num_tokens - self._model_budget
+                )
+        # Oversized sentences count once, when a chunk holding any of their
+        # pieces is emitted; the last chunk of a non-final text is carried
+        # into the next, possibly starting mid-sentence.
+        self.stats.num_hard_splits += len(hard_splits - {continued})
+        if final:
+            continues_hard_split = False
+        elif chunks and chunks[-1][0] is units[0]:
+            # Nothing emitted: the carry starts where this text did.
+            continues_hard_split = self._continues_hard_split
+        else:
+            next_sentence = chunks[-1][0][4] if chunks else None
+            continues_hard_split = (
+                next_sentence is not None
+                and next_sentence in hard_splits | {continued}
+            )
+        setattr(self, "_continues_hard_split", continues_hard_split)
+        return chunk_texts
+
+    def split_texts(
+        self,
+        texts: Iterable[str],
+        final: bool = True
+    ) -> list[list[str]]:
+        """
+        Split several texts, tokenizing all of their sentences at once.
+
+        With `final` False the texts are windows of longer texts: their
+        last chunks are left out of the stats, and the texts are not
+        counted as documents.
+        """
+        texts = list(texts)
+        spans_list = [self._segment(text) for text in texts]
+        sentences = [
+            text[start:end]
+            for text, spans in zip(texts, spans_list)
+            for start, end, _ in spans
+        ]
+        if sentences:
+            input_ids = self.tokenizer(
+                sentences,
+                add_special_tokens=False,
+                return_attention_mask=False,
+                return_token_type_ids=False
+            )["input_ids"]
+        else:
+            input_ids = []
+        lengths = [len(ids) for ids in input_ids]
+
+        chunks_list = []
+        offset = 0
+        for text, spans in zip(texts, spans_list):
+            chunks_list.append(self._pack(
+                text, spans, lengths[offset:offset + len(spans)], final=final
+            ))
+            offset += len(spans)
+        if final:
+            self.stats.num_documents += len(texts)
+        return chunks_list
+
+    def split_text(self, text: str) -> list[str]:
+        return self.split_texts([text])[0]
+
+    def split_stream(self, windows: Iterable[str]) -> Iterator[str]:
+        """
+        Split one text arriving in windows, yielding chunks as they complete.
+        """
+        return split_stream(
+            windows,
+            split_window=lambda text: self.split_texts([text], final=False)[0],
+            split_final=self.split_text
+        )
+
+    def create_documents(
+        self,
+        texts: list[str],
+        metadatas: Optional[list[dict]] = None
+    ) -> list[Document]:
+        metadatas = metadatas or [{} for _ in texts]
+        return [
+            Document(page_content=chunk, metadata=dict(metadata))
+            for chunks, metadata in zip(self.split_texts(texts), metadatas)
+            for chunk in chunks
+        ]
+
+    def split_documents(self, documents: Iterable[Document]) -> list[Document]:
+        documents = list(documents)
+        return self.create_documents(
+            texts=[doc.page_content for doc in documents],
+            metadatas=[doc.metadata for doc in documents]
+        )
+
+
+def log_split_stats(text_splitter, reset: bool = True):
+    """
+    Log a splitter's chunk statistics, if it keeps any.
+    """
+    stats = getattr(text_splitter, "stats", None)
+    if stats is None:
+        return
+    _logger.info(stats.summary())
+    if stats.num_truncated_chunks:
+        _logger.warning(
+            f"{stats.num_truncated_chunks} chunks are longer than the "
+            "embedding model's max sequence length."
+        )
+    if reset:
+        text_splitter.reset_stats()
@@ -5,11 +5,22 @@ Purpose: Utilities for pipeline module.
 
 from haystack.schema import Document as HS_Document
 from langchain.docstore.document import Document
-from langchain.document_loaders import DirectoryLoader
+from langchain.document_loaders import UnstructuredFileLoader
 from langchain.text_splitter import CharacterTextSplitter
 from langchain.vectorstores import FAISS
+import json
+from pathlib import Path
 import tqdm
-from typing import Protocol, runtime_checkable
+from typing import Iterator, Optional, Protocol, runtime_checkable
+
+
+from docs2chat.preprocessing.streaming import is_streamable, stream_split_file
+
+
+class _DeduplicatorProtocol(Protocol):
+
+    def deduplicate():
+        ...
 
 
 class _EmbeddingsProtocol(Protocol):
@@ -76,13 +87,161 @@ def load_and_split_from_str(
 def load_and_split_from_dir(
     content: str,
     text_splitter,
-    show_progress: bool = True
+    show_progress: bool = True,
+    loader_cls: Optional[type] = None
 ):
     """
     Load and split files in directory into document objects.
     """
-    loader = DirectoryLoader(str(content), show_progress=True)
-    return loader.load_and_split(text_splitter)
+    return list(iter_load_and_split_from_dir(
+        content=content,
+        text_splitter=text_splitter,
+        show_progress=show_progress,
+        loader_cls=loader_cls
+    ))
+
+
+def iter_load_and_split_from_dir(
+    content: str,
+    text_splitter,
+    show_progress: bool = True,
+    loader_cls: Optional[type] = None
+) -> Iterator[Document]:
+    """
+    Lazily load and split files in directory into document objects.
+
+    Large plain-text files are read in windows and split incrementally;
+    other files are loaded whole with `loader_cls`, one at a time.
+    """
+    paths = list_document_paths(content)
+    if show_progress:
+        paths = tqdm.tqdm(paths)
+    for path in paths:
+        yield from iter_load_and_split_file(
+            path=path,
+            root=content,
+            text_splitter=text_splitter,
+            loader_cls=loader_cls
+        )
+
+
+def list_document_paths(content: str) -> list[Path]:
+    """
+    List the files under `content`, skipping hidden files and everything
+    inside hidden folders (e.g. `.git`, `.venv`).
+    """
+    root = Path(content)
+    return [
+        path for path in root.glob("**/*")
+        if path.is_file()
+        and not any(
+            part.startswith(".") for part in path.relative_to(root).parts
+        )
+    ]
+
+
+def iter_load_and_split_file(
+    path: Path,
+    root: str,
+    text_splitter,
+    loader_cls: Optional[type] = None
+) -> Iterator[Document]:
+    """
+    Lazily load and split one file into document objects.
+    """
+    if loader_cls is None:
+        loader_cls = UnstructuredFileLoader
+    if is_streamable(path):
+        metadata = {
+            "source": str(path),
+            **file_metadata(str(path), root=root)
+        }
+        for chunk in stream_split_file(str(path), text_splitter):
+            yield Document(page_content=chunk, metadata=dict(metadata))
+    else:
+        docs = loader_cls(str(path)).load()
+        add_file_metadata(docs, root=root)
+        yield from text_splitter.split_documents(docs)
+
+
+def folder_prefixes(directory: str) -> list[str]:
+    """
+    List `directory` and every enclosing folder, outermost first.
+    """
+    parts = [part for part in directory.split("/") if part]
+    return ["/".join(parts[:idx + 1]) for idx in range(len(parts))]
+
+
+def file_metadata(source: str, root: str) -> dict:
+    """
+    Describe a source file for metadata filtering.
+
+    `directory` is the file's folder relative to `root` and `folders` lists
+    it and every enclosing folder, so a filter on `folders` matches a whole
+    subtree.
+    """
+    path = Path(source)
+    try:
+        rel_path = path.relative_to(root)
+    except ValueError:
+        rel_path = Path(path.name)
+    directory = "/".join(rel_path.parent.parts)
+    return {
+        "file_name": path.name,
+        "extension": path.suffix.lower(),
+        "directory": directory,
+        "folders": folder_prefixes(directory),
+        "mtime": path.stat().st_mtime
+    }
+
+
+def restore_file_metadata(meta: dict) -> dict:
+    """
+    Restore the types of `file_metadata` fields read back from a store
+    that keeps metadata values as strings, in place.
+
+    `mtime` is cast back to a float and `folders` is rebuilt from
+    `directory`.
+    """
+    mtime = meta.get("mtime")
+    if isinstance(mtime, str):
+        try:
+            meta["mtime"] = float(mtime)
+        except ValueError:
+            pass
+    directory = meta.get("directory")
+    if not isinstance(meta.get("folders"), list) and isinstance(directory, str):
+        meta["folders"] = folder_prefixes(directory)
+    return meta
+
+
+def add_file_metadata(docs: list[Document], root: str) -> list[Document]:
+    file_metadata_cache = {}
+    for doc in docs:
+        source = doc.metadata.get("source")
+        if source is None:
+            continue
+        if source not in file_metadata_cache:
+            file_metadata_cache[source] = file_metadata(source, root)
+        doc.metadata.update(file_metadata_cache[source])
+    return docs
+
+
+def load_max_seq_length(model_dir: str, tokenizer) -> int:
+    """
+    Read the sequence length the embedding model actually encodes.
+
+    sentence-transformers models record it in `sentence_bert_config.json`,
+    which is usually shorter than the tokenizer's `model_max_length`.
+    """
+    st_config_path = Path(model_dir) / "sentence_bert_config.json"
+    if st_config_path.is_file():
+        with open(st_config_path, "r") as f:
+            max_seq_length = json.load(f).get("max_seq_length")
+        if max_seq_length is not None:
+            return int(max_seq_length)
+    # Tokenizers without a configured limit report a huge sentinel value.
+    return min(int(tokenizer.model_max_length), 512)
 
 
 def create_vectorstore(
@@ -101,4 +260,16 @@ def langchain_to_haystack_docs(
     return [
         HS_Document(content=doc.page_content, meta=doc.metadata)
         for doc in docs
-    ]
\ No newline at end of file
+    ]
+
+
+def haystack_to_langchain_docs(
+    docs: list[HS_Document]
+) -> list[Document]:
+    return [
+        Document(
+            page_content=doc.content,
+            metadata={**doc.meta, "id": doc.id, "score": doc.score}
+        )
+        for doc in docs
+    ]
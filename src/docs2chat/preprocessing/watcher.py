@@ -0,0 +1,257 @@
+"""
+Purpose: Watch a documents directory and swap rebuilt index snapshots into
+running pipelines.
+"""
+
+
+import copy
+from dataclasses import dataclass, field
+from haystack.nodes import EmbeddingRetriever
+import logging
+from pathlib import Path
+import sys
+import threading
+import time
+from typing import Any, Callable, Optional
+
+
+from docs2chat.config import config
+from docs2chat.preprocessing.index import SharedIndex
+from docs2chat.preprocessing.preprocessing import (
+    ExtractivePreProcessor,
+    PreProcessor
+)
+from docs2chat.preprocessing.text_splitter import log_split_stats
+from docs2chat.preprocessing.utils import (
+    iter_load_and_split_file,
+    langchain_to_haystack_docs,
+    list_document_paths
+)
+from docs2chat.profiling import profiler
+
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.INFO)
+_formatter = logging.Formatter(
+    "%(asctime)s:%(levelname)s:%(module)s: %(message)s"
+)
+_console_handler = logging.StreamHandler(sys.stdout)
+_console_handler.setFormatter(_formatter)
+_logger.addHandler(_console_handler)
+
+
+@dataclass
+class IndexWatcher:
+    """
+    Keep a SharedIndex in sync with a documents directory.
+
+    A background thread polls the directory every `interval` seconds.
+    When files are added, changed or deleted, only those files are split
+    and embedded again. The first snapshot is a store of the
+    `DOCUMENT_STORE` type; each later one is a `copy()` of the current
+    store (a side copy) from which the chunks of those files are
+    deleted and to which their new chunks are added, so the vectors of
+    unchanged files are neither recomputed nor held outside the store. It
+    is published as a new SharedIndex by reassigning `index`, after which
+    every hook is called with it. Queries already running keep the
+    snapshot they started with. Files modified within the last
+    `settle_seconds` are picked up on a later poll, once writes to them
+    have settled.
+    """
+
+    content: str = field(default=config.DOCUMENTS_DIR)
+    interval: float = field(default=config.WATCH_INTERVAL)
+    settle_seconds: float = field(default=1.0)
+    loader_cls: Optional[type] = field(default=None)
+    preprocessor: Optional[PreProcessor] = field(default=None)
+    retriever: Optional[Any] = field(default=None)
+    index: Optional[SharedIndex] = field(default=None)
+
+    def __post_init__(self):
+        if self.preprocessor is None:
+            _logger.info(
+                "PreProcessor was not passed. "
+                "Initializing a PreProcessor object."
+            )
+            preprocessor = PreProcessor(
+                chain_type="search",
+                content=self.content
+            )
+            setattr(self, "preprocessor", preprocessor)
+        self._hooks = []
+        self._file_states = {}
+        self._ids_by_source = {}
+        self._document_store = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        _logger.info(
+            f"Building initial index snapshot of {self.content}."
+        )
+        self.poll(force=True)
+
+    def add_hook(self, hook: Callable[[SharedIndex], None]):
+        self._hooks.append(hook)
+
+    def scan(self) -> dict[str, tuple[int, int]]:
+        file_states = {}
+        for path in list_document_paths(self.content):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            file_states[str(path)] = (stat.st_mtime_ns, stat.st_size)
+        return file_states
+
+    def poll(self, force: bool = False) -> bool:
+        """
+        Re-index changed files and publish a new snapshot if any changed.
+        """
+        file_states = self.scan()
+        settled_before = time.time_ns() - int(self.settle_seconds * 1e9)
+        changed = [
+            source for source, state in file_states.items()
+            if self._file_states.get(source) != state
+            and (force or state[0] <= settled_before)
+        ]
+        deleted = [
+            source for source in self._file_states
+            if source not in file_states
+        ]
+        if not (changed or deleted or force):
+            return False
+        _logger.info(
+            f"Re-indexing {len(changed)} changed and {len(deleted)} "
+            "deleted files."
+        )
+        with profiler.span("watcher.rebuild"):
+            docs_by_source = self._load(changed)
+            document_store = self._write_snapshot(deleted, docs_by_source)
+        profiler.count("watcher.files_changed", len(changed) + len(deleted))
+
+        # Record the states seen before loading, so files changed while
+        # loading are picked up again on the next poll.
+        new_file_states = dict(self._file_states)
+        for source in deleted:
+            new_file_states.pop(source, None)
+        for source in changed:
+            new_file_states[source] = file_states[source]
+        self._file_states = new_file_states
+        ids_by_source = dict(self._ids_by_source)
+        for source in deleted:
+            ids_by_source.pop(source, None)
+        for source, docs in docs_by_source.items():
+            ids_by_source[source] = [doc.id for doc in docs]
+        self._ids_by_source = ids_by_source
+        self._document_store = document_store
+        self._publish(document_store)
+        return True
+
+    def _load(self, sources: list[str]) -> dict[str, list]:
+        """
+        Split and embed the given files, grouped by source.
+        """
+        docs_by_source = {}
+        for source in sources:
+            try:
+                chunks = list(iter_load_and_split_file(
+                    path=Path(source),
+                    root=self.content,
+                    text_splitter=self.preprocessor.text_splitter,
+                    loader_cls=self.loader_cls
+                ))
+            except FileNotFoundError:
+                continue
+            docs_by_source[source] = langchain_to_haystack_docs(chunks)
+        log_split_stats(self.preprocessor.text_splitter)
+        docs = [
+            doc for source_docs in docs_by_source.values()
+            for doc in source_docs
+        ]
+        for idx in range(0, len(docs), config.INGEST_BATCH_SIZE):
+            self.preprocessor.embed(docs[idx:idx + config.INGEST_BATCH_SIZE])
+        if hasattr(self.preprocessor.embeddings, "close"):
+            self.preprocessor.embeddings.close()
+        return docs_by_source
+
+    def _write_snapshot(
+        self,
+        deleted: list[str],
+        docs_by_source: dict[str, list]
+    ):
+        """
+        Copy the current snapshot's store, drop the chunks of the deleted
+        and re-loaded sources and write the re-loaded chunks.
+        """
+        docs = [
+            doc for source_docs in docs_by_source.values()
+            for doc in source_docs
+        ]
+        if self._document_store is None:
+            document_store_cls = ExtractivePreProcessor.DOCUMENT_STORE_FACTORY[
+                config.DOCUMENT_STORE
+            ]
+            document_store = document_store_cls(
+                embedding_dim=(
+                    len(docs[0].embedding) if docs
+                    else getattr(self.retriever, "embedding_dim", 384)
+                )
+            )
+        else:
+            document_store = self._document_store.copy()
+            replaced = set(deleted) | set(docs_by_source)
+            old_ids = set()
+            kept_ids = set()
+            for source, ids in self._ids_by_source.items():
+                old_ids.update(ids)
+                if source not in replaced:
+                    kept_ids.update(ids)
+            # Identical chunks share an id; keep those another file has.
+            stale_ids = old_ids - kept_ids
+            if stale_ids:
+                document_store.delete_documents(ids=list(stale_ids))
+        for idx in range(0, len(docs), config.INGEST_BATCH_SIZE):
+            document_store.write_documents(
+                docs[idx:idx + config.INGEST_BATCH_SIZE]
+            )
+        return document_store
+
+    def _publish(self, document_store):
+        if self.retriever is None:
+            _logger.info(
+                "Generating a HS Retriever."
+            )
+            retriever = EmbeddingRetriever(
+                document_store=document_store,
+                embedding_model=config.EMBEDDING_DIR
+            )
+            setattr(self, "retriever", retriever)
+        retriever = copy.copy(self.retriever)
+        retriever.document_store = document_store
+        index = SharedIndex(document_store=document_store, retriever=retriever)
+        # Reassigning the attribute is the swap: readers see either the
+        # old snapshot or the new one, never a mix.
+        self.index = index
+        for hook in self._hooks:
+            hook(index)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                _logger.exception("Failed to re-index changed documents.")
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="docs2chat-watcher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,11 @@
+"""
+Purpose: Initialize the profiling subpackage of docs2chat.
+"""
+
+
+from docs2chat.profiling.profiling import (
+    MetricsRegistry,
+    Profiler,
+    QueryProfile,
+    profiler
+)
\ No newline at end of file
@@ -0,0 +1,250 @@
+"""
+Purpose: Timing spans, counters and metrics export for docs2chat.
+"""
+
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import threading
+import time
+import tracemalloc
+from typing import Callable, Iterator, Optional
+
+
+DEFAULT_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+    30.0, 60.0
+)
+
+
+@dataclass
+class Span:
+    name: str
+    start: float
+    depth: int = field(default=0)
+    duration: Optional[float] = field(default=None)
+    memory_delta: Optional[int] = field(default=None)
+    _memory_start: Optional[int] = field(default=None, repr=False)
+    _traced: bool = field(default=False, repr=False)
+
+
+@dataclass
+class QueryProfile:
+    """
+    The spans and counters recorded while handling one query.
+    """
+
+    name: str
+    start: float = field(default_factory=time.perf_counter)
+    duration: Optional[float] = field(default=None)
+    spans: list[Span] = field(default_factory=list)
+    counters: dict[str, float] = field(default_factory=dict)
+
+    def stage_seconds(self) -> dict[str, float]:
+        """
+        Return total seconds per span name.
+        """
+        seconds = {}
+        for span in self.spans:
+            if span.duration is not None:
+                seconds[span.name] = seconds.get(span.name, 0) + span.duration
+        return seconds
+
+    def format(self) -> str:
+        total = self.duration or (time.perf_counter() - self.start)
+        lines = [f"Profile for {self.name}: {1000 * total:.1f} ms total"]
+        for span in self.spans:
+            if span.duration is None:
+                continue
+            line = (
+                f"  {'  ' * span.depth}{span.name:<{32 - 2 * span.depth}}"
+                f"{1000 * span.duration:>10.1f} ms"
+                f"{100 * span.duration / max(total, 1e-12):>7.1f}%"
+            )
+            if span.memory_delta is not None:
+                line += f"{span.memory_delta / 2 ** 20:>+10.2f} MiB"
+            lines.append(line)
+        for name, value in self.counters.items():
+            lines.append(f"  {name:<32}{value:>10g}")
+        return "\n".join(lines)
+
+
+class MetricsRegistry:
+    """
+    Process-wide span histograms and counters, exportable to Prometheus.
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = {
+                    "buckets": [0] * len(self.buckets),
+                    "count": 0,
+                    "sum": 0.0
+                }
+                self._histograms[name] = histogram
+            for idx, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram["buckets"][idx] += 1
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+
+    def increment(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._counters = {}
+
+    def to_prometheus(self, prefix: str = "docs2chat") -> str:
+        """
+        Render all metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            histograms = {
+                name: {**value, "buckets": list(value["buckets"])}
+                for name, value in self._histograms.items()
+            }
+            counters = dict(self._counters)
+        lines = []
+        if histograms:
+            metric = f"{prefix}_stage_duration_seconds"
+            lines.append(
+                f"# HELP {metric} Time spent in each pipeline stage."
+            )
+            lines.append(f"# TYPE {metric} histogram")
+            for name, histogram in sorted(histograms.items()):
+                for bound, count in zip(self.buckets, histogram["buckets"]):
+                    lines.append(
+                        f'{metric}_bucket{{stage="{name}",le="{bound}"}} '
+                        f"{count}"
+                    )
+                lines.append(
+                    f'{metric}_bucket{{stage="{name}",le="+Inf"}} '
+                    f"{histogram['count']}"
+                )
+                lines.append(
+                    f'{metric}_sum{{stage="{name}"}} {histogram["sum"]}'
+                )
+                lines.append(
+                    f'{metric}_count{{stage="{name}"}} {histogram["count"]}'
+                )
+        for name, value in sorted(counters.items()):
+            metric = f"{prefix}_{name.replace('.', '_')}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    """
+    Records timing spans and counters for the current query.
+
+    Spans and counters are no-ops until `enable` is called. While enabled,
+    they are aggregated into `registry` and, inside a `trace`, collected
+    into a `QueryProfile` that is passed to every export hook when the
+    trace ends.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.registry = MetricsRegistry()
+        self._export_hooks = []
+        self._current = ContextVar("docs2chat_profile", default=None)
+        # Span nesting is per context, not per profile: executor threads
+        # and shard fan-out add spans to one profile concurrently, each
+        # from a copy of the submitting context.
+        self._depth = ContextVar("docs2chat_span_depth", default=0)
+
+    def enable(self, track_memory: bool = False):
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.enabled = True
+
+    def disable(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.enabled = False
+
+    def add_export_hook(self, hook: Callable[[QueryProfile], None]):
+        self._export_hooks.append(hook)
+
+    @property
+    def current(self) -> Optional[QueryProfile]:
+        return self._current.get()
+
+    @contextmanager
+    def trace(self, name: str = "query") -> Iterator[Optional[QueryProfile]]:
+        if not self.enabled:
+            yield None
+            return
+        profile = QueryProfile(name=name)
+        token = self._current.set(profile)
+        depth_token = self._depth.set(0)
+        try:
+            yield profile
+        finally:
+            self._depth.reset(depth_token)
+            self._current.reset(token)
+            profile.duration = time.perf_counter() - profile.start
+            self.registry.observe(name, profile.duration)
+            for hook in self._export_hooks:
+                hook(profile)
+
+    def start_span(self, name: str) -> Optional[Span]:
+        if not self.enabled:
+            return None
+        profile = self._current.get()
+        span = Span(
+            name=name,
+            start=time.perf_counter(),
+            depth=self._depth.get() if profile is not None else 0
+        )
+        if tracemalloc.is_tracing():
+            span._memory_start = tracemalloc.get_traced_memory()[0]
+        if profile is not None:
+            profile.spans.append(span)
+            self._depth.set(span.depth + 1)
+            span._traced = True
+        return span
+
+    def end_span(self, span: Optional[Span]):
+        if span is None or span.duration is not None:
+            return
+        span.duration = time.perf_counter() - span.start
+        if span._memory_start is not None and tracemalloc.is_tracing():
+            span.memory_delta = (
+                tracemalloc.get_traced_memory()[0] - span._memory_start
+            )
+        if span._traced:
+            self._depth.set(span.depth)
+        self.registry.observe(span.name, span.duration)
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[Optional[Span]]:
+        span = self.start_span(name)
+        try:
+            yield span
+        finally:
+            self.end_span(span)
+
+    def count(self, name: str, value: float = 1):
+        if not self.enabled:
+            return
+        profile = self._current.get()
+        if profile is not None:
+            profile.counters[name] = profile.counters.get(name, 0) + value
+        self.registry.increment(name, value)
+
+
+profiler = Profiler()
@@ -0,0 +1,123 @@
+"""
+Purpose: Tests for precomputed answers.
+"""
+
+
+import functools
+import os
+
+
+from docs2chat.apps.answers import (
+    AnswerIndex,
+    AnsweringChain,
+    file_digest,
+    index_version,
+    normalize_question,
+    precompute_answers
+)
+from docs2chat.apps.benchmark import generate_corpus, generate_queries
+from docs2chat.apps.loadtest import build_stub_chain
+from docs2chat.apps.utils import format_snip_pipeline_output
+
+
+def test_snip_answers_keep_sources(tmp_path):
+    docs_dir = tmp_path / "docs"
+    docs_dir.mkdir()
+    sentences = generate_corpus(docs_dir=str(docs_dir), num_docs=5)
+    questions = generate_queries(sentences, num_queries=4)
+    pipeline = build_stub_chain("snip", str(docs_dir))
+    answer_index = AnswerIndex(str(tmp_path / "answers.db"))
+    precompute_answers(
+        chain=pipeline,
+        chain_type="snip",
+        questions=questions,
+        answer_index=answer_index,
+        version="v1"
+    )
+    chain = AnsweringChain(
+        pipeline=pipeline,
+        chain_type="snip",
+        answer_index=answer_index,
+        version="v1"
+    )
+    for question in questions:
+        output = chain.lookup(question)
+        assert output
+        for answer in output:
+            assert answer.meta["source"].startswith(str(docs_dir))
+        format_snip_pipeline_output(output)
+
+
+class StaticPipeline:
+
+    def update_retriever(self, retriever):
+        return
+
+
+def test_normalize_question():
+    assert normalize_question("  What is  FAISS? ") == "what is faiss"
+    assert normalize_question("\uff26\uff21\uff29\uff33\uff33") == "faiss"
+    assert normalize_question("?!") == ""
+
+
+def test_lookup_matches_exact_then_normalized(tmp_path):
+    answer_index = AnswerIndex(str(tmp_path / "answers.db"))
+    answer_index.put_many("v1", "search", [("What is FAISS?", ["exact"])])
+    answer_index.put_many("v1", "search", [("what is faiss", ["latest"])])
+
+    assert answer_index.lookup("v1", "search", "What is FAISS?") == ["exact"]
+    assert answer_index.lookup("v1", "search", "WHAT is faiss!") == ["latest"]
+    assert answer_index.lookup("v1", "search", "what is hnsw") is None
+    assert answer_index.lookup("v1", "search", "?") is None
+    assert answer_index.lookup("v1", "snip", "What is FAISS?") is None
+    assert answer_index.lookup("v2", "search", "What is FAISS?") is None
+
+
+def test_version_changes_with_file_contents(tmp_path):
+    docs_dir = tmp_path / "docs"
+    docs_dir.mkdir()
+    path = docs_dir / "a.txt"
+    path.write_text("FAISS is a vector index.")
+    version_func = functools.partial(
+        index_version,
+        chain_type="search",
+        docs_dir=str(docs_dir),
+        num_return_docs=4,
+        return_threshold=0
+    )
+    answer_index = AnswerIndex(str(tmp_path / "answers.db"))
+    chain = AnsweringChain(
+        pipeline=StaticPipeline(),
+        chain_type="search",
+        answer_index=answer_index,
+        version_func=version_func
+    )
+    version = chain.version
+    answer_index.put_many(version, "search", [("What is FAISS?", [])])
+    assert chain.lookup("What is FAISS?") == []
+
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    chain.update_retriever(None)
+    assert chain.version == version
+    assert chain.lookup("What is FAISS?") == []
+
+    path.write_text("FAISS is a vector library.")
+    chain.update_retriever(None)
+    assert chain.version != version
+    assert chain.lookup("What is FAISS?") is None
+
+
+def test_file_digest_rehashes_only_changed_files(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_text("first")
+    digest = file_digest(path)
+    stat = path.stat()
+
+    # Same size and mtime: the cached digest is reused without reading.
+    path.write_text("other")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert file_digest(path) == digest
+
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert file_digest(path) != digest
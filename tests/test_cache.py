@@ -0,0 +1,73 @@
+"""
+Purpose: Tests for the ranker-score cache.
+"""
+
+
+from haystack.schema import Document as HS_Document
+
+
+from docs2chat.apps.stubs import StubRanker
+from docs2chat.concurrency import stage_latency
+from docs2chat.extract.cache import CachingRanker, RankScoreCache
+
+
+class CountingRanker(StubRanker):
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def predict_batch(self, queries, documents, top_k=None, batch_size=None):
+        self.calls.append(sum(len(docs) for docs in documents))
+        return super().predict_batch(
+            queries=queries, documents=documents, top_k=top_k
+        )
+
+
+def make_documents():
+    return [
+        HS_Document(content=content)
+        for content in ("red apples", "green apples", "red cars", "blue sky")
+    ]
+
+
+def test_predict_batch_scores_misses_in_one_call():
+    docs = make_documents()
+    queries = ["red apples", "blue  sky"]
+    ranker = CountingRanker()
+    caching_ranker = CachingRanker(
+        ranker, cache=RankScoreCache(max_bytes=2 ** 20)
+    )
+    caching_ranker.predict(query="red apples", documents=docs[:2], top_k=4)
+    ranker.calls.clear()
+
+    results = caching_ranker.predict_batch(
+        queries=queries, documents=[docs, docs], top_k=3
+    )
+    assert ranker.calls == [6]
+    expected = StubRanker().predict_batch(
+        queries=queries, documents=[docs, docs], top_k=3
+    )
+    for docs_, expected_docs in zip(results, expected):
+        assert [doc.id for doc in docs_] == [doc.id for doc in expected_docs]
+        assert [doc.score for doc in docs_] == [
+            doc.score for doc in expected_docs
+        ]
+
+    caching_ranker.predict_batch(queries=queries, documents=docs, top_k=3)
+    assert ranker.calls == [6]
+
+
+def test_rank_latency_counts_only_scored_pairs():
+    docs = make_documents()
+    caching_ranker = CachingRanker(
+        StubRanker(),
+        cache=RankScoreCache(max_bytes=2 ** 20),
+        stage="test.rank"
+    )
+    caching_ranker.predict(query="red apples", documents=docs)
+    estimate = stage_latency.estimate("test.rank")
+    assert estimate is not None
+
+    caching_ranker.predict(query="red apples", documents=docs)
+    assert stage_latency.estimate("test.rank") == estimate
@@ -0,0 +1,170 @@
+"""
+Purpose: Tests for deadline-driven degradation.
+"""
+
+
+from langchain.callbacks.base import BaseCallbackHandler
+import pytest
+
+
+from docs2chat.apps.benchmark import generate_corpus
+from docs2chat.apps.loadtest import build_stub_chain
+from docs2chat.concurrency import Deadline, LatencyEstimator, use_deadline
+from docs2chat.extract.extract import _fit_candidates
+
+
+QUERY = "how does the index store documents"
+
+
+def make_estimator(per_item: dict) -> LatencyEstimator:
+    estimator = LatencyEstimator()
+    for stage, seconds in per_item.items():
+        estimator.observe(stage, seconds)
+    return estimator
+
+
+def make_deadline(per_item: dict, seconds: float = 10, **kwargs) -> Deadline:
+    return Deadline(
+        seconds=seconds, estimator=make_estimator(per_item), **kwargs
+    )
+
+
+@pytest.fixture(scope="module")
+def docs_dir(tmp_path_factory):
+    docs_dir = tmp_path_factory.mktemp("docs")
+    generate_corpus(docs_dir=str(docs_dir), num_docs=10)
+    return str(docs_dir)
+
+
+class LLMChainCounter(BaseCallbackHandler):
+
+    def __init__(self):
+        self.num_llm_chains = 0
+
+    def on_chain_start(self, serialized, inputs, **kwargs):
+        if (serialized or {}).get("id", [""])[-1] == "LLMChain":
+            self.num_llm_chains += 1
+
+
+def test_can_afford_and_affordable_items():
+    deadline = make_deadline({"stage": 2.0})
+    assert deadline.can_afford("stage", 4)
+    assert not deadline.can_afford("stage", 5)
+    assert not deadline.can_afford("stage", 1, reserve=9)
+    assert deadline.can_afford("unseen", 1000)
+    assert deadline.affordable_items("stage", 10) == 4
+    assert deadline.affordable_items("stage", 3) == 3
+    assert deadline.affordable_items("stage", 10, reserve=5) == 2
+    assert deadline.affordable_items("stage", 10, min_items=6) == 6
+    assert deadline.affordable_items("unseen", 10) == 10
+
+    expired = make_deadline({"stage": 2.0}, seconds=0)
+    assert not expired.can_afford("unseen")
+    assert expired.affordable_items("stage", 10, min_items=2) == 2
+
+    deadline.degrade("stage.skipped")
+    deadline.degrade("stage.skipped")
+    assert deadline.degradations == ["stage.skipped"]
+
+
+def test_fit_candidates():
+    assert _fit_candidates(None, "extract.read", 6, 4) == 6
+
+    per_item = {"extract.retrieve": 1.0, "extract.read": 2.0}
+    deadline = make_deadline(per_item)
+    assert _fit_candidates(deadline, "extract.read", 3, 2) == 3
+    assert deadline.degradations == []
+    assert _fit_candidates(deadline, "extract.read", 6, 2) == 4
+    assert deadline.degradations == ["extract.fewer_candidates"]
+
+    deadline = make_deadline(per_item)
+    assert _fit_candidates(deadline, "extract.read", 6, 5) == 5
+    assert deadline.degradations == ["extract.fewer_candidates"]
+
+
+@pytest.mark.parametrize(
+    "chain_type, stage, degradation, answer_type",
+    [
+        ("snip", "extract.read", "extract.read_skipped", "other"),
+        ("search", "extract.rank", "extract.rank_skipped", None)
+    ]
+)
+def test_skipped_stage_returns_retriever_results(
+    docs_dir,
+    chain_type,
+    stage,
+    degradation,
+    answer_type
+):
+    pipeline = build_stub_chain(chain_type, docs_dir, num_return_docs=4)
+    # Above any stub score, so only degraded results get through.
+    pipeline.return_threshold = 2.0
+
+    deadline = make_deadline({stage: 0.001})
+    with use_deadline(deadline):
+        assert pipeline.run(QUERY) == []
+    assert deadline.degradations == []
+
+    deadline = make_deadline({stage: 100.0})
+    with use_deadline(deadline):
+        results = pipeline.run(QUERY)
+    assert deadline.degradations == ["extract.fewer_candidates", degradation]
+    expected = pipeline.retriever.retrieve(query=QUERY, top_k=4)
+    if answer_type is None:
+        assert [doc.id for doc in results] == [doc.id for doc in expected]
+    else:
+        assert [answer.type for answer in results] == [answer_type] * 4
+        assert [answer.document_ids[0] for answer in results] == [
+            doc.id for doc in expected
+        ]
+        assert [answer.meta for answer in results] == [
+            doc.meta for doc in expected
+        ]
+
+
+def test_generation_token_and_time_caps(docs_dir):
+    pipeline = build_stub_chain("generative", docs_dir)
+    pipeline.llm.streaming = True
+
+    deadline = make_deadline({"chat.token": 0.001}, max_tokens=3)
+    with use_deadline(deadline):
+        output = pipeline.run(QUERY)
+    assert deadline.degradations == ["chat.tokens_capped"]
+    assert len(output["answer"].split()) == 3
+    assert output["source_documents"]
+
+    pipeline.chain.memory.clear()
+    deadline = make_deadline({"chat.token": 100.0}, max_tokens=32)
+    with use_deadline(deadline):
+        output = pipeline.run(QUERY)
+    assert deadline.degradations == ["chat.time_capped"]
+    assert len(output["answer"].split()) == 1
+
+    pipeline.chain.memory.clear()
+    deadline = make_deadline({}, seconds=0)
+    with use_deadline(deadline):
+        output = pipeline.run(QUERY)
+    assert deadline.degradations == ["chat.generate_skipped"]
+    assert output["answer"] == ""
+
+
+def test_condense_skipped(docs_dir):
+    pipeline = build_stub_chain("generative", docs_dir)
+    get_chat_history = pipeline.chain.get_chat_history
+    pipeline.run(QUERY)
+
+    counter = LLMChainCounter()
+    deadline = make_deadline({"chat.token": 0.001})
+    with use_deadline(deadline):
+        pipeline.run("and where are they kept", callbacks=[counter])
+    assert deadline.degradations == []
+    assert counter.num_llm_chains == 2
+
+    counter = LLMChainCounter()
+    deadline = make_deadline({"chat.token": 100.0})
+    with use_deadline(deadline):
+        output = pipeline.run("and where are they kept", callbacks=[counter])
+    assert deadline.degradations == ["chat.condense_skipped"]
+    assert counter.num_llm_chains == 1
+    assert output["chat_history"]
+    assert pipeline.chain.get_chat_history is get_chat_history
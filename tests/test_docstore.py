@@ -0,0 +1,85 @@
+"""
+Purpose: Tests for the NumPy document store.
+"""
+
+
+from haystack.errors import DocumentStoreError
+from haystack.schema import Document as HS_Document
+import numpy as np
+import pytest
+
+
+from docs2chat.preprocessing.docstore import NumpyDocumentStore
+from docs2chat.preprocessing.filters import FilteredFAISSDocumentStore
+
+
+EMBEDDING_DIM = 8
+FILTERS = [
+    None,
+    {"folders": "a"},
+    {"folders": {"$in": ["b", "c"]}},
+    {"position": {"$gte": 10, "$lt": 30}},
+    {"$and": [{"folders": "a"}, {"position": {"$gt": 20}}]}
+]
+
+
+def make_documents(num_docs=40):
+    rng = np.random.default_rng(0)
+    return [
+        HS_Document(
+            content=f"doc {idx}",
+            meta={"folders": ["abc"[idx % 3]], "position": idx},
+            embedding=rng.standard_normal(EMBEDDING_DIM).astype(np.float32)
+        )
+        for idx in range(num_docs)
+    ]
+
+
+def results(document_store, query_emb, filters):
+    docs = document_store.query_by_embedding(
+        query_emb, filters=filters, top_k=5
+    )
+    return [doc.id for doc in docs], [doc.score for doc in docs]
+
+
+def test_top_k_and_filters_match_faiss():
+    docs = make_documents()
+    numpy_store = NumpyDocumentStore(embedding_dim=EMBEDDING_DIM)
+    faiss_store = FilteredFAISSDocumentStore(
+        sql_url="sqlite:///",
+        embedding_dim=EMBEDDING_DIM,
+        similarity="cosine",
+        progress_bar=False
+    )
+    numpy_store.write_documents(docs)
+    faiss_store.write_documents(docs)
+
+    rng = np.random.default_rng(1)
+    for query_emb in rng.standard_normal((3, EMBEDDING_DIM)):
+        query_emb = query_emb.astype(np.float32)
+        for filters in FILTERS:
+            numpy_ids, numpy_scores = results(numpy_store, query_emb, filters)
+            faiss_ids, faiss_scores = results(faiss_store, query_emb, filters)
+            assert numpy_ids == faiss_ids
+            np.testing.assert_allclose(numpy_scores, faiss_scores, atol=1e-5)
+
+
+def test_copy_is_independent():
+    docs = make_documents()
+    document_store = NumpyDocumentStore(embedding_dim=EMBEDDING_DIM)
+    document_store.write_documents(docs[:30])
+    copied_store = document_store.copy()
+    copied_store.delete_documents(ids=[docs[0].id])
+    copied_store.write_documents(docs[30:])
+
+    assert document_store.get_document_count() == 30
+    assert copied_store.get_document_count() == 39
+    assert document_store.get_document_by_id(docs[0].id) is not None
+    assert copied_store.get_document_by_id(docs[0].id) is None
+    assert copied_store.get_document_count(filters={"folders": "a"}) == 13
+
+
+def test_write_labels_raises():
+    document_store = NumpyDocumentStore(embedding_dim=EMBEDDING_DIM)
+    with pytest.raises(DocumentStoreError):
+        document_store.write_labels([])
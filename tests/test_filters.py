@@ -0,0 +1,100 @@
+"""
+Purpose: Tests for metadata filtering of FAISS document stores.
+"""
+
+
+from haystack.schema import Document as HS_Document
+import numpy as np
+
+
+from docs2chat.preprocessing.filters import (
+    FilteredFAISSDocumentStore,
+    JSON_META_FIELDS_KEY
+)
+from docs2chat.preprocessing.utils import (
+    file_metadata,
+    restore_file_metadata
+)
+
+
+EMBEDDING_DIM = 8
+
+
+def make_documents(root):
+    (root / "a" / "b").mkdir(parents=True)
+    (root / "c").mkdir()
+    paths = [root / "a" / "one.txt", root / "a" / "b" / "two.txt",
+             root / "c" / "three.txt"]
+    rng = np.random.default_rng(0)
+    docs = []
+    for idx, path in enumerate(paths):
+        path.write_text(path.stem)
+        meta = {"source": str(path), **file_metadata(str(path), root)}
+        meta["mtime"] = 100.0 + idx
+        docs.append(HS_Document(
+            content=path.stem,
+            meta=meta,
+            embedding=rng.random(EMBEDDING_DIM, dtype=np.float32)
+        ))
+    return docs
+
+
+def query(document_store, filters):
+    docs = document_store.query_by_embedding(
+        np.ones(EMBEDDING_DIM, dtype=np.float32), filters=filters, top_k=10
+    )
+    return sorted(doc.content for doc in docs)
+
+
+def test_filters_after_store_round_trip(tmp_path):
+    docs = make_documents(tmp_path / "docs")
+    sql_path = tmp_path / "store.db"
+    document_store = FilteredFAISSDocumentStore(
+        sql_url=f"sqlite:///{sql_path}",
+        embedding_dim=EMBEDDING_DIM,
+        progress_bar=False
+    )
+    document_store.write_documents(docs)
+    index_path = tmp_path / "store.faiss"
+    document_store.save(index_path=index_path)
+    loaded_store = FilteredFAISSDocumentStore.load(index_path=index_path)
+
+    for store in (document_store, loaded_store):
+        assert query(store, {"folders": "a"}) == ["one", "two"]
+        assert query(store, {"folders": {"$in": ["a/b", "c"]}}) == [
+            "three", "two"
+        ]
+        assert query(store, {"mtime": {"$gt": 100.5}}) == ["three", "two"]
+        assert query(store, {"mtime": {"$gte": 100, "$lt": 101}}) == ["one"]
+
+
+def test_list_meta_read_back_from_sql(tmp_path):
+    docs = make_documents(tmp_path / "docs")
+    docs[0].meta["sources"] = [docs[0].meta["source"], "copy/one.txt"]
+    document_store = FilteredFAISSDocumentStore(
+        sql_url="sqlite:///",
+        embedding_dim=EMBEDDING_DIM,
+        progress_bar=False
+    )
+    document_store.write_documents(docs)
+
+    doc = document_store.get_document_by_id(docs[0].id)
+    assert doc.meta["sources"] == docs[0].meta["sources"]
+    assert doc.meta["folders"] == ["a"]
+    assert JSON_META_FIELDS_KEY not in doc.meta
+    assert [
+        doc.meta["folders"] for doc in document_store.query_by_embedding(
+            np.ones(EMBEDDING_DIM, dtype=np.float32),
+            filters={"folders": "c"}
+        )
+    ] == [["c"]]
+
+
+def test_restore_file_metadata_from_strings():
+    meta = restore_file_metadata({
+        "directory": "a/b",
+        "folders": "['a', 'a/b']",
+        "mtime": "101.5"
+    })
+    assert meta["folders"] == ["a", "a/b"]
+    assert meta["mtime"] == 101.5
@@ -0,0 +1,44 @@
+"""
+Purpose: Offline smoke tests for the load tester.
+"""
+
+
+import asyncio
+import pytest
+
+
+from docs2chat.apps.benchmark import generate_corpus
+from docs2chat.apps.loadtest import (
+    InProcessTarget,
+    build_stub_chain,
+    run_load_test
+)
+
+
+@pytest.mark.parametrize("chain_type", ["generative", "search", "snip"])
+def test_run_load_test_with_stub_models(chain_type):
+    report = run_load_test(
+        chain_type=chain_type,
+        concurrency=2,
+        num_requests=6,
+        warmup_requests=2,
+        num_docs=10
+    )
+    assert report["requests"] == 6
+    assert report["completed"] == 6, report["errors"]
+    assert report["latency"]["p50_seconds"] > 0
+
+
+def test_generative_requests_start_without_history(tmp_path):
+    generate_corpus(docs_dir=str(tmp_path), num_docs=5)
+    target = InProcessTarget(chain=build_stub_chain("generative", str(tmp_path)))
+    memory = target.chain.chain.memory
+
+    async def _run():
+        await asyncio.gather(*[
+            target.query(f"question {idx}") for idx in range(3)
+        ])
+
+    asyncio.run(_run())
+    messages = memory.chat_memory.messages
+    assert len(messages) == 2
@@ -0,0 +1,62 @@
+"""
+Purpose: Tests for the sharded index.
+"""
+
+
+from haystack.schema import Document as HS_Document
+import numpy as np
+
+
+from docs2chat.apps.stubs import StubEmbeddingRetriever, hash_embed
+from docs2chat.preprocessing.docstore import NumpyDocumentStore
+from docs2chat.preprocessing.shards import ShardedIndex
+
+
+EMBEDDING_DIM = 16
+CONTENTS = [
+    "red apples", "green apples", "red cars", "blue sky", "blue cars",
+    "green sky"
+]
+
+
+def make_store(contents):
+    document_store = NumpyDocumentStore(embedding_dim=EMBEDDING_DIM)
+    embeddings = hash_embed(contents, dim=EMBEDDING_DIM)
+    document_store.write_documents([
+        HS_Document(content=content, embedding=embedding)
+        for content, embedding in zip(contents, embeddings)
+    ])
+    return document_store
+
+
+def test_scale_score_matches_single_store(tmp_path):
+    query_encoder = StubEmbeddingRetriever(dim=EMBEDDING_DIM)
+    index = ShardedIndex(
+        index_dir=str(tmp_path),
+        query_encoder=query_encoder,
+        shards={"a": make_store(CONTENTS[:3]), "b": make_store(CONTENTS[3:])}
+    )
+    single_store = make_store(CONTENTS)
+    query_encoder.document_store = single_store
+    retriever = index.retriever
+    for scale_score in (True, False):
+        expected = query_encoder.retrieve(
+            "red sky", top_k=6, scale_score=scale_score
+        )
+        for docs in (
+            retriever.retrieve("red sky", top_k=6, scale_score=scale_score),
+            retriever.retrieve_batch(
+                ["red sky"], top_k=6, scale_score=scale_score
+            )[0]
+        ):
+            scores = {doc.id: doc.score for doc in docs}
+            assert scores.keys() == {doc.id for doc in expected}
+            np.testing.assert_allclose(
+                [scores[doc.id] for doc in expected],
+                [doc.score for doc in expected],
+                atol=1e-6
+            )
+    assert retriever.scale_score is True
+    scaled = retriever.retrieve("red sky", top_k=6)
+    unscaled = retriever.retrieve("red sky", top_k=6, scale_score=False)
+    assert [doc.score for doc in scaled] != [doc.score for doc in unscaled]
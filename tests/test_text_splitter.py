@@ -0,0 +1,43 @@
+"""
+Purpose: Tests for the token-aware text splitter.
+"""
+
+
+from docs2chat.apps.stubs import StubTokenizer
+from docs2chat.preprocessing.text_splitter import TokenTextSplitter
+
+
+def make_splitter():
+    return TokenTextSplitter(
+        chunk_size=16,
+        chunk_overlap=4,
+        tokenizer=StubTokenizer(),
+        max_seq_length=32
+    )
+
+
+def make_text():
+    long_sentence = " ".join(f"w{idx}" for idx in range(40)) + "."
+    paragraphs = []
+    for idx in range(6):
+        paragraphs.append(
+            f"Short sentence {idx}. Another one here. " + long_sentence
+        )
+    return "\n\n".join(paragraphs)
+
+
+def test_stream_counts_each_hard_split_once():
+    text = make_text()
+    splitter = make_splitter()
+    splitter.split_text(text)
+    assert splitter.stats.num_hard_splits == 6
+
+    for window_size in (50, 120, 300):
+        windows = [
+            text[idx:idx + window_size]
+            for idx in range(0, len(text), window_size)
+        ]
+        splitter = make_splitter()
+        chunks = list(splitter.split_stream(windows))
+        assert splitter.stats.num_chunks == len(chunks)
+        assert splitter.stats.num_hard_splits == 6